@@ -1,8 +1,12 @@
-from flask import Blueprint, render_template, redirect, url_for, flash
+from flask import Blueprint, render_template, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from models import User, Department
 from forms import EditUserForm, DepartmentForm, RegistrationForm
 from extensions import db, bcrypt
+from loaders import USER_LIST_OPTIONS
+import stats
+import directory
+from usercache import user_cache
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -15,15 +19,14 @@ def check_admin():
 
 @admin_bp.route('/users')
 def manage_users():
-    users = User.query.all()
+    users = User.query.options(*USER_LIST_OPTIONS).all()
     return render_template('admin/users.html', users=users)
 
 @admin_bp.route('/user/<int:user_id>/edit', methods=['GET', 'POST'])
 def edit_user(user_id):
     user = User.query.get_or_404(user_id)
     form = EditUserForm(obj=user)
-    departments = Department.query.all()
-    form.department_id.choices = [(d.id, d.name) for d in departments]
+    form.department_id.choices = directory.department_choices()
     
     if form.validate_on_submit():
         user.realname = form.realname.data
@@ -31,6 +34,8 @@ def edit_user(user_id):
         user.department_id = form.department_id.data
         # 更新创建工单权限
         user.can_create_order = form.can_create_order.data
+        directory.invalidate()
+        user_cache.invalidate(user.id)
         db.session.commit()
         flash('用户信息已更新', 'success')
         return redirect(url_for('admin.manage_users'))
@@ -42,15 +47,22 @@ def edit_user(user_id):
 @admin_bp.route('/user/<int:user_id>/delete')
 def delete_user(user_id):
     user = User.query.get_or_404(user_id)
-    if user == current_user:
+    if user.id == current_user.id:
         flash('不能删除当前登录的用户', 'danger')
         return redirect(url_for('admin.manage_users'))
     
     db.session.delete(user)
+    stats.user_deleted()
+    directory.invalidate()
+    user_cache.invalidate(user.id)
     db.session.commit()
     flash('用户已删除', 'success')
     return redirect(url_for('admin.manage_users'))
 
+@admin_bp.route('/cache_stats')
+def cache_stats():
+    return jsonify(user_cache=user_cache.metrics())
+
 @admin_bp.route('/departments')
 def manage_departments():
     departments = Department.query.all()
@@ -62,6 +74,7 @@ def add_department():
     if form.validate_on_submit():
         department = Department(name=form.name.data, description=form.description.data)
         db.session.add(department)
+        directory.invalidate()
         db.session.commit()
         flash('部门已添加', 'success')
         return redirect(url_for('admin.manage_departments'))
@@ -74,6 +87,9 @@ def edit_department(dept_id):
     if form.validate_on_submit():
         department.name = form.name.data
         department.description = form.description.data
+        directory.invalidate()
+        # 缓存的登录身份带有部门名称
+        user_cache.invalidate()
         db.session.commit()
         flash('部门信息已更新', 'success')
         return redirect(url_for('admin.manage_departments'))
@@ -87,6 +103,7 @@ def delete_department(dept_id):
         return redirect(url_for('admin.manage_departments'))
     
     db.session.delete(department)
+    directory.invalidate()
     db.session.commit()
     flash('部门已删除', 'success')
     return redirect(url_for('admin.manage_departments'))
@@ -94,8 +111,7 @@ def delete_department(dept_id):
 @admin_bp.route('/user/add', methods=['GET', 'POST'])
 def add_user():
     form = RegistrationForm()
-    departments = Department.query.all()
-    form.department_id.choices = [(d.id, d.name) for d in departments]
+    form.department_id.choices = directory.department_choices()
     
     if form.validate_on_submit():
         hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
@@ -109,6 +125,8 @@ def add_user():
             can_create_order=form.can_create_order.data
         )
         db.session.add(user)
+        stats.user_added()
+        directory.invalidate()
         db.session.commit()
         flash('用户添加成功!', 'success')
         return redirect(url_for('admin.manage_users'))
@@ -0,0 +1,235 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from extensions import db
+from models import StageDurationRollup, StageDurationBucket
+import directory
+
+# 环节历时分析
+# - 每个环节结束时（指派 / 处理工单）在同一事务内把历时累加到当天的汇总行和直方图桶
+# - 报表只读汇总表：行数约为 天数 × 环节 × 负责人，与 order_stage 的规模无关
+# - 平均值由 total / count 得到；p50 / p95 从对数直方图合并估算：
+#   每个桶覆盖 2^(1/8) 倍的区间，取桶的几何中点，相对误差约 4%，再用 min / max 截断
+# - 全量重建用一条 GROUP BY 在库内集合运算完成，不在 Python 里逐行循环
+
+BUCKETS_PER_DOUBLING = 8
+# 创建工单时的首个环节即时结束，历时恒为 0，不计入分析
+EXCLUDED_STAGES = ('创建工单',)
+
+GROUPS = {
+    'stage': '按环节',
+    'assignee': '按负责人',
+    'department': '按部门',
+}
+PERIODS = {
+    'all': ('合计', None),
+    'month': ('按月', '%Y-%m'),
+    'week': ('按周', '%Y-W%W'),
+    'day': ('按日', '%Y-%m-%d'),
+}
+
+
+def duration_bucket(seconds):
+    if seconds < 1:
+        return -1
+    return math.floor(BUCKETS_PER_DOUBLING * math.log2(seconds))
+
+
+def bucket_value(bucket):
+    """桶的代表值（几何中点，秒）"""
+    if bucket < 0:
+        return 0.0
+    return 2 ** ((bucket + 0.5) / BUCKETS_PER_DOUBLING)
+
+
+def stage_closed(stage):
+    """
+    环节结束后调用，与环节的修改一起提交
+    stage.assignee 需已加载（ORDER_WORKFLOW_OPTIONS 会预加载）
+    """
+    if stage is None or stage.end_time is None or stage.duration is None:
+        return
+    if stage.stage_name in EXCLUDED_STAGES:
+        return
+    key = {
+        'day': stage.end_time.date(),
+        'stage_name': stage.stage_name,
+        'assignee_id': stage.assignee_id,
+        'department_id': (stage.assignee.department_id if stage.assignee else None) or 0,
+    }
+    duration = stage.duration
+    rollup = StageDurationRollup.__table__
+    stmt = sqlite_insert(rollup).values(count=1, total_seconds=duration, min_seconds=duration,
+                                        max_seconds=duration, **key)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=list(key),
+        set_={
+            'count': rollup.c.count + 1,
+            'total_seconds': rollup.c.total_seconds + duration,
+            'min_seconds': func.min(rollup.c.min_seconds, duration),
+            'max_seconds': func.max(rollup.c.max_seconds, duration),
+        }))
+    buckets = StageDurationBucket.__table__
+    stmt = sqlite_insert(buckets).values(bucket=duration_bucket(duration), count=1, **key)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=list(key) + ['bucket'],
+        set_={'count': buckets.c.count + 1}))
+
+
+def _ensure_log2(connection):
+    """SQLite 未编译数学函数时注册 log2（只有全量重建会用到）"""
+    try:
+        connection.exec_driver_sql('SELECT log2(2)')
+    except Exception:
+        connection.connection.driver_connection.create_function('log2', 1, math.log2, deterministic=True)
+
+
+# 在线和归档的环节一起统计
+_CLOSED_STAGES = (
+    " FROM (SELECT stage_name, end_time, duration, assignee_id FROM order_stage"
+    "       UNION ALL SELECT stage_name, end_time, duration, assignee_id FROM archived_order_stage) AS order_stage"
+    " LEFT JOIN user ON user.id = order_stage.assignee_id"
+    " WHERE order_stage.end_time IS NOT NULL AND order_stage.duration IS NOT NULL"
+    " AND order_stage.stage_name NOT IN :excluded"
+)
+_KEY = "date(order_stage.end_time), order_stage.stage_name, order_stage.assignee_id, coalesce(user.department_id, 0)"
+
+
+def rebuild():
+    """按 order_stage 和 archived_order_stage 全量重建汇总表；负责人部门取当前所在部门"""
+    _ensure_log2(db.session.connection())
+    params = {'excluded': EXCLUDED_STAGES}
+    db.session.execute(StageDurationRollup.__table__.delete())
+    db.session.execute(StageDurationBucket.__table__.delete())
+    db.session.execute(text(
+        "INSERT INTO stage_duration_rollup"
+        " (day, stage_name, assignee_id, department_id, count, total_seconds, min_seconds, max_seconds)"
+        f" SELECT {_KEY}, count(*), sum(order_stage.duration), min(order_stage.duration), max(order_stage.duration)"
+        f" {_CLOSED_STAGES} GROUP BY 1, 2, 3, 4"
+    ).bindparams(db.bindparam('excluded', expanding=True)), params)
+    db.session.execute(text(
+        "INSERT INTO stage_duration_bucket (day, stage_name, assignee_id, department_id, bucket, count)"
+        f" SELECT {_KEY}, CASE WHEN order_stage.duration < 1 THEN -1"
+        f" ELSE CAST(floor({BUCKETS_PER_DOUBLING} * log2(order_stage.duration)) AS INTEGER) END, count(*)"
+        f" {_CLOSED_STAGES} GROUP BY 1, 2, 3, 4, 5"
+    ).bindparams(db.bindparam('excluded', expanding=True)), params)
+    db.session.commit()
+    return db.session.query(func.coalesce(func.sum(StageDurationRollup.count), 0)).scalar()
+
+
+def percentile(histogram, total, pct):
+    """histogram: [(bucket, count)] 按桶升序；按最近秩取第 pct 百分位所在的桶"""
+    rank = max(1, math.ceil(pct / 100 * total))
+    seen = 0
+    for bucket, count in histogram:
+        seen += count
+        if seen >= rank:
+            return bucket_value(bucket)
+    return bucket_value(histogram[-1][0]) if histogram else 0.0
+
+
+def stage_histograms(start, end):
+    """
+    各环节在日期区间内合并后的历时分布：{环节: (环节数, 最短秒, 最长秒, [(桶, 数量)])}
+    供交期风险评估等需要秒级分位数的地方使用
+    """
+    rollup, buckets = StageDurationRollup, StageDurationBucket
+    totals = db.session.execute(
+        select(rollup.stage_name, func.sum(rollup.count), func.min(rollup.min_seconds), func.max(rollup.max_seconds))
+        .where(rollup.day >= start, rollup.day <= end)
+        .group_by(rollup.stage_name)
+    ).all()
+    histograms = defaultdict(list)
+    for stage, bucket, count in db.session.execute(
+            select(buckets.stage_name, buckets.bucket, func.sum(buckets.count))
+            .where(buckets.day >= start, buckets.day <= end)
+            .group_by(buckets.stage_name, buckets.bucket)
+            .order_by(buckets.stage_name, buckets.bucket)):
+        histograms[stage].append((bucket, count))
+    return {stage: (count, low, high, histograms[stage]) for stage, count, low, high in totals}
+
+
+def stage_duration_report(start, end, group='stage', period='all', stage_name=None):
+    """
+    读取汇总表生成报表，start / end 为日期（含首尾）
+    返回按 (周期, 环节, 分组) 排序的字典列表，时间单位为小时
+    """
+    if group not in GROUPS or period not in PERIODS:
+        raise ValueError('无效的分组或周期')
+    rollup, buckets = StageDurationRollup, StageDurationBucket
+
+    def key_columns(model):
+        fmt = PERIODS[period][1]
+        columns = [func.strftime(fmt, model.day) if fmt else db.literal('合计'), model.stage_name]
+        if group == 'assignee':
+            columns.append(model.assignee_id)
+        elif group == 'department':
+            columns.append(model.department_id)
+        else:
+            columns.append(db.literal(0))
+        return columns
+
+    def where(model):
+        conditions = [model.day >= start, model.day <= end]
+        if stage_name:
+            conditions.append(model.stage_name == stage_name)
+        return conditions
+
+    keys = key_columns(rollup)
+    totals = db.session.execute(
+        select(*keys, func.sum(rollup.count), func.sum(rollup.total_seconds),
+               func.min(rollup.min_seconds), func.max(rollup.max_seconds))
+        .where(*where(rollup)).group_by(*keys).order_by(*keys)
+    ).all()
+
+    keys = key_columns(buckets)
+    histograms = defaultdict(list)
+    for *key, bucket, count in db.session.execute(
+            select(*keys, buckets.bucket, func.sum(buckets.count))
+            .where(*where(buckets)).group_by(*keys, buckets.bucket).order_by(*keys, buckets.bucket)):
+        histograms[tuple(key)].append((bucket, count))
+
+    names = {}
+    if group == 'assignee':
+        names = dict(directory.user_choices())
+    elif group == 'department':
+        names = dict(directory.department_choices())
+
+    rows = []
+    for period_label, stage, group_id, count, total, low, high in totals:
+        histogram = histograms[(period_label, stage, group_id)]
+
+        def pct(p):
+            return round(min(max(percentile(histogram, count, p), low), high) / 3600, 2)
+        rows.append({
+            'period': period_label,
+            'stage_name': stage,
+            'group_id': group_id if group != 'stage' else None,
+            'group_name': names.get(group_id, '未分配' if group == 'department' else f'#{group_id}')
+                          if group != 'stage' else None,
+            'count': count,
+            'avg_hours': round(total / count / 3600, 2),
+            'p50_hours': pct(50),
+            'p95_hours': pct(95),
+            'min_hours': round(low / 3600, 2),
+            'max_hours': round(high / 3600, 2),
+        })
+    return rows
+
+
+def default_range(days=30):
+    # 环节结束时间按 UTC 记录
+    end = datetime.utcnow().date()
+    return end - timedelta(days=days - 1), end
+
+
+@click.command('rebuild-analytics')
+@with_appcontext
+def rebuild_analytics_command():
+    """按全部已结束环节重建环节历时汇总表"""
+    count = rebuild()
+    click.echo(f'已汇总 {count} 个已结束环节')
@@ -0,0 +1,262 @@
+import hashlib
+from flask import Blueprint, current_app, jsonify, request, url_for
+from flask_login import current_user
+from sqlalchemy.orm import joinedload, load_only, selectinload
+from werkzeug.exceptions import HTTPException, BadRequest, Forbidden, NotFound
+from models import CacheVersion, WorkOrder, OrderStage
+from pagination import keyset_paginate
+from dates import parse_date
+import directory
+import search
+import analytics
+
+# JSON API：供看板等程序化客户端轮询
+# - fields=a,b 只返回所需字段（稀疏字段集），关联对象只在被选中时预加载
+# - 列表按 (下单日期, id) 键集分页，游标与网页列表一致
+# - 弱 ETag 由工单的行版本 updated_at 和用户目录版本计算，If-None-Match 命中时
+#   只执行一次轻量查询就返回 304，不加载关联数据也不序列化
+
+api_bp = Blueprint('api', __name__)
+
+
+def _user(user):
+    return {'id': user.id, 'realname': user.realname} if user else None
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+def _attachment(attachment):
+    return {
+        'filename': attachment.filename,
+        'size': attachment.size,
+        'upload_time': _iso(attachment.upload_time),
+        'url': url_for('download_file', filename=attachment.filename),
+    }
+
+
+# 字段名 -> (取值函数, 需要的加载选项)
+STAGE_FIELDS = {
+    'id': (lambda s: s.id, ()),
+    'stage_name': (lambda s: s.stage_name, ()),
+    'start_time': (lambda s: _iso(s.start_time), ()),
+    'end_time': (lambda s: _iso(s.end_time), ()),
+    'duration': (lambda s: s.duration, ()),
+    'comments': (lambda s: s.comments, ()),
+    'assignee': (lambda s: _user(s.assignee), (joinedload(OrderStage.assignee),)),
+    'attachments': (lambda s: [_attachment(a) for a in s.attachments], (selectinload(OrderStage.attachments),)),
+}
+DEFAULT_STAGE_FIELDS = ('id', 'stage_name', 'start_time', 'end_time', 'duration', 'comments', 'assignee')
+
+ORDER_FIELDS = {
+    'id': (lambda o: o.id, ()),
+    'order_number': (lambda o: o.order_number, ()),
+    'order_date': (lambda o: _iso(o.order_date), ()),
+    'quantity': (lambda o: o.quantity, ()),
+    'delivery_date': (lambda o: _iso(o.delivery_date), ()),
+    'total_duration': (lambda o: o.total_duration, ()),
+    'current_stage': (lambda o: o.current_stage, ()),
+    'created_at': (lambda o: _iso(o.created_at), ()),
+    'updated_at': (lambda o: _iso(o.updated_at), ()),
+    'risk_score': (lambda o: o.risk_score, ()),
+    'projected_finish': (lambda o: _iso(o.projected_finish), ()),
+    'salesperson': (lambda o: _user(o.salesperson), (joinedload(WorkOrder.salesperson),)),
+    'current_assignee': (lambda o: _user(o.current_assignee), (joinedload(WorkOrder.current_assignee),)),
+    'active_stage': (lambda o: _stage(o.active_stage, ('id', 'stage_name', 'start_time')) if o.active_stage else None,
+                     (joinedload(WorkOrder.active_stage),)),
+}
+DEFAULT_ORDER_FIELDS = ('id', 'order_number', 'order_date', 'quantity', 'delivery_date',
+                        'current_stage', 'salesperson', 'current_assignee')
+
+
+def _stage(stage, fields):
+    return {name: STAGE_FIELDS[name][0](stage) for name in fields}
+
+
+def _order(order, fields):
+    return {name: ORDER_FIELDS[name][0](order) for name in fields}
+
+
+def parse_fields(param, available, default):
+    """解析 fields 参数，未指定时用默认字段；未知字段返回 400"""
+    value = request.args.get(param)
+    if not value:
+        return default
+    fields = tuple(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in available]
+    if unknown:
+        raise BadRequest(f'未知字段: {", ".join(unknown)}，可选 {", ".join(available)}')
+    return fields
+
+
+def load_options(fields, available):
+    return [option for name in fields for option in available[name][1]]
+
+
+def weak_etag(*parts):
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def conditional(etag, build):
+    """If-None-Match 命中时直接 304，否则调用 build() 生成响应体"""
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag, weak=True)
+    # 客户端可以缓存，但每次使用前都要带 ETag 回来验证
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _int_arg(name, default=None):
+    value = request.args.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f'{name} 必须为整数')
+
+
+def _date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    parsed = parse_date(value)
+    if parsed is None:
+        raise BadRequest(f'{name} 日期格式无效')
+    return parsed.date()
+
+
+def _visible_order(order_id):
+    """工单的行版本；不存在或无权查看时 404"""
+    row = (WorkOrder.query.with_entities(WorkOrder.updated_at)
+           .filter(WorkOrder.id == order_id, WorkOrder.visible_to(current_user))
+           .first())
+    if row is None:
+        raise NotFound('工单不存在')
+    return row.updated_at
+
+
+@api_bp.before_request
+def require_login():
+    if not current_user.is_authenticated:
+        return jsonify(error='未登录'), 401
+
+
+@api_bp.errorhandler(HTTPException)
+def json_error(e):
+    return jsonify(error=e.description), e.code
+
+
+@api_bp.route('/orders')
+def list_orders():
+    fields = parse_fields('fields', ORDER_FIELDS, DEFAULT_ORDER_FIELDS)
+    per_page = min(max(_int_arg('limit', current_app.config['ORDERS_PER_PAGE']), 1),
+                   current_app.config['API_MAX_PAGE_SIZE'])
+    conditions = [WorkOrder.visible_to(current_user)] + WorkOrder.filter_conditions(
+        stage=request.args.get('stage'),
+        assignee_id=_int_arg('assignee_id'),
+        salesperson_id=_int_arg('salesperson_id'),
+        delivery_from=_date_arg('delivery_from'),
+        delivery_to=_date_arg('delivery_to'))
+
+    # 先只取这一页的 (id, 下单日期, 行版本) 计算 ETag
+    keys = keyset_paginate(
+        WorkOrder.query.options(load_only(WorkOrder.id, WorkOrder.order_date, WorkOrder.updated_at))
+        .filter(*conditions),
+        WorkOrder.order_date, WorkOrder.id, per_page=per_page,
+        after=request.args.get('after'), before=request.args.get('before'))
+    etag = weak_etag('orders', fields, CacheVersion.current(directory.DIRECTORY),
+                     [(o.id, o.updated_at) for o in keys.items], keys.next_cursor, keys.prev_cursor)
+
+    def build():
+        ids = [o.id for o in keys.items]
+        # 同一会话内这些工单已在标识映射中，这里补齐所选字段的列和关联
+        orders = {o.id: o for o in WorkOrder.query.options(*load_options(fields, ORDER_FIELDS))
+                  .filter(WorkOrder.id.in_(ids))} if ids else {}
+        args = {k: v for k, v in request.args.items() if k not in ('after', 'before')}
+        return {
+            'data': [_order(orders[i], fields) for i in ids],
+            'links': {
+                'next': url_for('.list_orders', after=keys.next_cursor, **args) if keys.has_next else None,
+                'prev': url_for('.list_orders', before=keys.prev_cursor, **args) if keys.has_prev else None,
+            },
+        }
+    return conditional(etag, build)
+
+
+@api_bp.route('/orders/<int:order_id>')
+def get_order(order_id):
+    fields = parse_fields('fields', ORDER_FIELDS, DEFAULT_ORDER_FIELDS)
+    include_stages = 'stages' in request.args.get('include', '').split(',')
+    stage_fields = parse_fields('stage_fields', STAGE_FIELDS, DEFAULT_STAGE_FIELDS) if include_stages else ()
+    # 环节和附件只会随指派 / 处理工单一起变化，工单的行版本同样覆盖它们
+    updated_at = _visible_order(order_id)
+    etag = weak_etag('order', order_id, fields, stage_fields,
+                     CacheVersion.current(directory.DIRECTORY), updated_at)
+
+    def build():
+        options = load_options(fields, ORDER_FIELDS)
+        if include_stages:
+            options.append(selectinload(WorkOrder.stages).options(*load_options(stage_fields, STAGE_FIELDS)))
+        order = WorkOrder.query.options(*options).get(order_id)
+        data = _order(order, fields)
+        if include_stages:
+            data['stages'] = [_stage(s, stage_fields) for s in order.stages]
+        return {'data': data}
+    return conditional(etag, build)
+
+
+@api_bp.route('/orders/<int:order_id>/stages')
+def list_stages(order_id):
+    fields = parse_fields('fields', STAGE_FIELDS, DEFAULT_STAGE_FIELDS)
+    updated_at = _visible_order(order_id)
+    etag = weak_etag('stages', order_id, fields, CacheVersion.current(directory.DIRECTORY), updated_at)
+
+    def build():
+        stages = (OrderStage.query.options(*load_options(fields, STAGE_FIELDS))
+                  .filter_by(order_id=order_id)
+                  .order_by(OrderStage.start_time, OrderStage.id))
+        return {'data': [_stage(s, fields) for s in stages]}
+    return conditional(etag, build)
+
+
+@api_bp.route('/search')
+def search_orders():
+    """按相关度检索工单；结果随索引实时变化，不计算 ETag"""
+    fields = parse_fields('fields', ORDER_FIELDS, DEFAULT_ORDER_FIELDS)
+    per_page = min(max(_int_arg('limit', current_app.config['SEARCH_PER_PAGE']), 1),
+                   current_app.config['API_MAX_PAGE_SIZE'])
+    page = max(_int_arg('page', 1), 1)
+    q = request.args.get('q', '')
+    result = search.search_orders(q, current_user, page=page, per_page=per_page,
+                                  options=load_options(fields, ORDER_FIELDS))
+    args = {k: v for k, v in request.args.items() if k != 'page'}
+    return jsonify({
+        'data': [dict(_order(r.order, fields), rank=r.rank, snippet=str(r.snippet)) for r in result.items],
+        'links': {
+            'next': url_for('.search_orders', page=page + 1, **args) if result.has_next else None,
+            'prev': url_for('.search_orders', page=page - 1, **args) if result.has_prev else None,
+        },
+    })
+
+
+@api_bp.route('/reports/stage_durations')
+def stage_duration_report():
+    """环节历时报表，参数与网页一致：date_from、date_to、stage_name、group、period"""
+    if not current_user.is_admin():
+        raise Forbidden('只有管理员可以查看报表')
+    default_from, default_to = analytics.default_range()
+    date_from = _date_arg('date_from') or default_from
+    date_to = _date_arg('date_to') or default_to
+    try:
+        rows = analytics.stage_duration_report(date_from, date_to,
+                                               group=request.args.get('group', 'stage'),
+                                               period=request.args.get('period', 'all'),
+                                               stage_name=request.args.get('stage_name') or None)
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return jsonify({'date_from': date_from.isoformat(), 'date_to': date_to.isoformat(), 'data': rows})
@@ -1,34 +1,133 @@
 import os
 import re
-from flask import Flask, render_template, request, redirect, url_for, flash, send_from_directory
-from flask_migrate import Migrate
+import click
+from flask import Flask, current_app, render_template, request, redirect, url_for, flash, abort, Response, stream_with_context
 from datetime import datetime, timedelta
-from forms import CreateOrderForm, AssignOrderForm, ProcessOrderForm  # 确保导入 ProcessOrderForm
-from config import Config
+from forms import CreateOrderForm, AssignOrderForm, ProcessOrderForm, OrderFilterForm, ImportOrdersForm, ReportFilterForm  # 确保导入 ProcessOrderForm
+from config import get_config
+from dbprofile import apply_pragmas
+from dates import parse_date
+from uploads import StreamingRequest, save_upload, release_upload, discard_upload
+from storage import start_sweeper, gc_blobs_command
+import importer
+from importer import import_orders_command
+import exporter
+from exporter import export_orders_command
+import search
+from search import rebuild_search_command
+from analytics import rebuild_analytics_command
+from risk import start_scheduler, score_risk_command
+import archive
+from archive import start_archiver, archive_orders_command
+from tasks import task_queue, worker_command, jobs_command
 from extensions import db, login_manager, bcrypt
-from models import WorkOrder, OrderStage, Attachment, User, Department
+from instrumentation import instrumentation
+from models import WorkOrder, OrderStage, Attachment, User, Department, ArchivedWorkOrder
+from pagination import keyset_paginate
+from querybudget import check_query_budget
+import stats
+import analytics
+import changefeed
+import submissions
+import directory
+from usercache import user_cache
+from stats import get_dashboard_stats, rebuild_stats_command
+from queryplans import explain_queries_command
+from benchmarks import bench_db_command, bench_dates_command, bench_routes_command
+from seeddata import seed_data_command
+from loaders import ORDER_LIST_OPTIONS, ORDER_DETAIL_OPTIONS, ORDER_WORKFLOW_OPTIONS, ATTACHMENT_DOWNLOAD_OPTIONS, ORDER_SEARCH_OPTIONS
+from loaders import ARCHIVED_ORDER_DETAIL_OPTIONS, ARCHIVED_ATTACHMENT_DOWNLOAD_OPTIONS
+from downloads import can_download, send_attachment, send_preview
 from auth import auth_bp
 from admin import admin_bp
+from api import api_bp
 from flask_login import login_required, current_user
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db.init_app(app)
-login_manager.init_app(app)
-bcrypt.init_app(app)
-migrate = Migrate(app, db)
+# 本模块的页面在 create_app 中注册，端点名即函数名
+_ROUTES = []
 
-# 注册蓝图
-app.register_blueprint(auth_bp, url_prefix='/auth')
-app.register_blueprint(admin_bp, url_prefix='/admin')
+CLI_COMMANDS = (
+    check_query_budget,
+    rebuild_stats_command,
+    explain_queries_command,
+    bench_db_command,
+    bench_dates_command,
+    bench_routes_command,
+    seed_data_command,
+    gc_blobs_command,
+    import_orders_command,
+    export_orders_command,
+    rebuild_search_command,
+    rebuild_analytics_command,
+    score_risk_command,
+    archive_orders_command,
+    worker_command,
+    jobs_command,
+)
 
-# 确保上传目录存在
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-# 用户加载器
+def route(rule, **options):
+    def decorator(view):
+        _ROUTES.append((rule, view, options))
+        return view
+    return decorator
+
+
+def create_app(config=None):
+    """
+    创建应用实例；config 为配置类或名称（development / testing / production），
+    默认按环境变量 APP_ENV 选择。flask 命令行、gunicorn 'app:create_app()' 和测试都通过它创建
+    """
+    app = Flask(__name__)
+    app.request_class = StreamingRequest
+    app.config.from_object(get_config(config))
+
+    db.init_app(app)
+    with app.app_context():
+        apply_pragmas(db.engine, app.config['DB_PROFILE'])
+    instrumentation.init_app(app)
+    login_manager.init_app(app)
+    bcrypt.init_app(app)
+    user_cache.init_app(app)
+    directory.init_app(app)
+    task_queue.init_app(app)
+    if click.get_current_context(silent=True) is not None:
+        # 只有命令行（flask db ...）用到迁移扩展；Web 进程和测试不导入 alembic，启动快约一半
+        from flask_migrate import Migrate
+        Migrate(app, db, include_name=search.migration_include_name)
+
+    # 注册蓝图和页面
+    app.register_blueprint(auth_bp, url_prefix='/auth')
+    app.register_blueprint(admin_bp, url_prefix='/admin')
+    app.register_blueprint(api_bp, url_prefix='/api')
+    for rule, view, options in _ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+    app.context_processor(utility_processor)
+
+    # 命令行工具
+    for command in CLI_COMMANDS:
+        app.cli.add_command(command)
+
+    # 确保上传目录存在
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+
+    # 后台清理无引用的附件文件
+    start_sweeper(app)
+
+    # 后台评估未完成工单的交期风险
+    start_scheduler(app)
+
+    # 后台归档已完成的工单
+    start_archiver(app)
+    return app
+
+
+# 用户加载器：优先命中进程内的登录身份缓存
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
 # 未授权处理器
 @login_manager.unauthorized_handler
@@ -36,55 +135,46 @@ def unauthorized():
     flash('请先登录以访问此页面', 'warning')
     return redirect(url_for('auth.login'))
 
-@app.route('/')
+@route('/')
 def index():
     return redirect(url_for('view_orders'))
 
-@app.route('/create_order', methods=['GET', 'POST'])
+# 重复提交与并发修改
+# - 重复提交：同一提交键已成功处理过，直接回到结果页，不再执行
+# - 并发修改：表单里的版本号与工单当前版本不一致，或提交时条件 UPDATE 影响 0 行（StaleDataError），
+#   说明期间已被他人流转；只回滚本次请求，不加锁、不让写入排队
+DUPLICATE_SUBMIT_MESSAGE = '该操作已提交，无需重复提交'
+ORDER_CONFLICT_MESSAGE = '工单已被他人更新，请查看最新状态后重新操作'
+
+
+def _duplicate_submit(endpoint, **values):
+    flash(DUPLICATE_SUBMIT_MESSAGE, 'info')
+    return redirect(url_for(endpoint, **values))
+
+
+def _write_conflict(order_id):
+    """提交冲突后回滚，再按提交键区分是自己的重复提交（并发到达的另一次）还是与他人的修改冲突"""
+    db.session.rollback()
+    if submissions.is_replay():
+        return _duplicate_submit('view_order', order_id=order_id)
+    flash(ORDER_CONFLICT_MESSAGE, 'warning')
+    return redirect(url_for('view_order', order_id=order_id))
+
+
+@route('/create_order', methods=['GET', 'POST'])
 @login_required
 def create_order():
+    if request.method == 'POST' and submissions.is_replay():
+        return _duplicate_submit('view_orders')
+
     # 检查用户是否有创建工单的权限
     if not (current_user.is_admin() or current_user.can_create_order):
         flash('您没有创建工单的权限', 'danger')
         return redirect(url_for('view_orders'))
     
     form = CreateOrderForm()
-    form.next_assignee_id.choices = [(u.id, u.realname) for u in User.query.order_by(User.realname).all()]
     
     if form.validate_on_submit():
-        # 自定义日期解析函数
-        def parse_date(date_str):
-            # 尝试多种日期格式
-            formats = [
-                '%Y%m%d',    # yyyymmdd (如20250629)
-                '%Y/%m/%d',  # yyyy/mm/dd
-                '%m/%d/%Y',  # mm/dd/yyyy
-                '%Y-%m-%d',  # yyyy-mm-dd
-                '%m-%d-%Y',  # mm-dd-yyyy
-                '%d/%m/%Y',  # dd/mm/yyyy
-                '%d-%m-%Y'   # dd-mm-yyyy
-            ]
-            
-            for fmt in formats:
-                try:
-                    return datetime.strptime(date_str, fmt)
-                except ValueError:
-                    continue
-            
-            # 如果所有格式都失败，尝试只解析数字
-            try:
-                # 尝试拆分数字
-                if len(date_str) == 8 and date_str.isdigit():
-                    # 处理yyyymmdd格式
-                    year = int(date_str[:4])
-                    month = int(date_str[4:6])
-                    day = int(date_str[6:8])
-                    return datetime(year, month, day)
-            except:
-                pass
-            
-            return None
-        
         # 解析日期
         order_date = parse_date(form.order_date.data)
         delivery_date = parse_date(form.delivery_date.data)
@@ -97,6 +187,10 @@ def create_order():
             flash('交货期格式无效，请使用 yyyy/mm/dd 或 yyyymmdd 等标准格式', 'danger')
             return render_template('create_order.html', form=form)
         
+        if archive.archived_order_numbers([form.order_number.data]):
+            flash('派工单号已存在（已归档）', 'danger')
+            return render_template('create_order.html', form=form)
+
         total_duration = (delivery_date - order_date).total_seconds()
         
         try:
@@ -119,9 +213,13 @@ def create_order():
                 comments='由 ' + current_user.realname + ' 创建'
             )
             order.stages.append(initial_stage)
+            order.active_stage = initial_stage
             
             # 创建下一环节
             if form.next_stage_name.data and form.next_assignee_id.data:
+                # 创建环节随即结束，保证任一时刻只有一个活跃环节
+                initial_stage.end_time = initial_stage.start_time
+                initial_stage.duration = 0
                 next_stage = OrderStage(
                     stage_name=form.next_stage_name.data,
                     start_time=datetime.utcnow(),  # 修改为当前时间
@@ -129,17 +227,28 @@ def create_order():
                     work_order=order
                 )
                 order.stages.append(next_stage)
+                order.active_stage = next_stage
                 order.current_stage = next_stage.stage_name
                 order.current_assignee_id = form.next_assignee_id.data  # 设置当前负责人
 
             db.session.add(order)
+            stats.order_created(order)
+            changefeed.record(order, 'created')
+            submissions.remember(submissions.submitted_key(), 'create_order')
             db.session.commit()
             flash('工单创建成功!', 'success')
             return redirect(url_for('view_orders'))
+        except IntegrityError:
+            # 同一提交并发到达两次时，后到的一方在派工单号或提交键上冲突
+            db.session.rollback()
+            if submissions.is_replay():
+                return _duplicate_submit('view_orders')
+            flash('派工单号已存在', 'danger')
+            return render_template('create_order.html', form=form)
         except Exception as e:
             db.session.rollback()
             flash(f'创建工单失败: {str(e)}', 'danger')
-            app.logger.error(f'创建工单失败: {str(e)}')
+            current_app.logger.error(f'创建工单失败: {str(e)}')
     
     # 设置默认日期值
     today = datetime.utcnow().strftime('%Y/%m/%d')
@@ -150,49 +259,154 @@ def create_order():
     return render_template('create_order.html', form=form)
 
 
-@app.route('/orders')
+@route('/import_orders', methods=['GET', 'POST'])
 @login_required
-def view_orders():
-    # 管理员查看所有工单
-    if current_user.is_admin():
-        orders = WorkOrder.query.order_by(WorkOrder.order_date.desc()).all()
-    else:
-        # 获取用户创建或负责的工单
-        created_orders_q = WorkOrder.query.filter_by(salesperson_id=current_user.id)
-        
-        # 获取用户作为负责人参与的工单ID
-        assigned_order_ids = db.session.query(OrderStage.order_id).filter_by(assignee_id=current_user.id).distinct()
-        
-        assigned_orders_q = WorkOrder.query.filter(WorkOrder.id.in_(assigned_order_ids))
-        
-        # 合并两个查询并去重
-        all_orders_q = created_orders_q.union(assigned_orders_q).order_by(WorkOrder.order_date.desc())
-        orders = all_orders_q.all()
+def import_orders():
+    if not (current_user.is_admin() or current_user.can_create_order):
+        flash('您没有创建工单的权限', 'danger')
+        return redirect(url_for('view_orders'))
+    
+    form = ImportOrdersForm()
+    result = None
+    if form.validate_on_submit():
+        file = form.file.data
+        try:
+            result = importer.import_orders(file.stream, file.filename, current_user)
+        except ValueError as e:
+            flash(f'导入失败: {e}', 'danger')
+        else:
+            if result.created:
+                flash(f'成功导入 {result.created} 张工单', 'success')
+            if result.errors:
+                flash(f'{len(result.errors)} 行未导入，请查看错误报告', 'warning')
     
-    # 计算统计数据
-    total_orders = WorkOrder.query.count()
-    ongoing_orders = WorkOrder.query.filter(WorkOrder.current_stage != '完成').count()
-    completed_orders = WorkOrder.query.filter_by(current_stage='完成').count()
-    user_count = User.query.count()
-    on_time_rate = 98  # 这里应该是实际计算的值
+    return render_template('import_orders.html', form=form, result=result)
+
+
+def order_filter_form():
+    filter_form = OrderFilterForm(formdata=request.args)
+    user_choices = [(0, '全部')] + directory.user_choices()
+    filter_form.assignee_id.choices = user_choices
+    filter_form.salesperson_id.choices = user_choices
+    filter_form.validate()
+    return filter_form
+
+
+def order_filter_conditions(filter_form, model=WorkOrder):
+    """筛选表单中校验通过的字段转换为查询条件（model 为在线或归档工单表），无效的选项忽略"""
+    def valid(field):
+        return None if field.errors else field.data
+    return model.filter_conditions(stage=valid(filter_form.stage),
+                                   assignee_id=valid(filter_form.assignee_id),
+                                   salesperson_id=valid(filter_form.salesperson_id),
+                                   delivery_from=valid(filter_form.delivery_from),
+                                   delivery_to=valid(filter_form.delivery_to))
+
+
+@route('/orders')
+@login_required
+def view_orders():
+    # 非管理员只能看到自己创建或负责过的工单
+    query = WorkOrder.query.options(*ORDER_LIST_OPTIONS).filter(WorkOrder.visible_to(current_user))
+
+    # 服务端筛选
+    filter_form = order_filter_form()
+    query = query.filter(*order_filter_conditions(filter_form))
+
+    # 按 (下单日期, id) 键集分页
+    page = keyset_paginate(query, WorkOrder.order_date, WorkOrder.id,
+                           per_page=current_app.config['ORDERS_PER_PAGE'],
+                           after=request.args.get('after'),
+                           before=request.args.get('before'))
+    orders = page.items
+    # 翻页链接需要保留的筛选参数
+    filter_args = {k: v for k, v in request.args.items() if k not in ('after', 'before') and v}
     
-    stats = {
-        'ongoing': ongoing_orders,
-        'completed': completed_orders,
-        'users': user_count,
-        'on_time_rate': on_time_rate
-    }
+    # 统计数据来自增量维护的计数器
+    stats = get_dashboard_stats()
     
     # 确保传递了 stats 变量
-    return render_template('view_orders.html', orders=orders, stats=stats)
+    return render_template('view_orders.html', orders=orders, stats=stats, page=page,
+                           filter_form=filter_form, filter_args=filter_args)
+
+
+@route('/orders/rows')
+@login_required
+def order_rows():
+    """列表页收到变更事件后只取变化的行（逗号分隔的 id，最多 50 个）"""
+    ids = [int(i) for i in request.args.get('ids', '').split(',') if i.isdigit()][:50]
+    orders = (WorkOrder.query.options(*ORDER_LIST_OPTIONS)
+              .filter(WorkOrder.id.in_(ids), WorkOrder.visible_to(current_user))
+              .all()) if ids else []
+    return render_template('_order_rows.html', orders=orders)
+
+
+@route('/events')
+@login_required
+def order_events():
+    """工单变更推送（text/event-stream），重连时浏览器带上 Last-Event-ID"""
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    user = current_user._get_current_object()
+    return Response(stream_with_context(changefeed.stream(user, last_id)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@route('/export_orders')
+@login_required
+def export_orders():
+    """按列表的可见范围和筛选条件导出工单及流转记录，边查询边输出"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in exporter.FORMATS:
+        abort(400)
+    filter_form = order_filter_form()
+    conditions = [WorkOrder.visible_to(current_user)] + order_filter_conditions(filter_form)
+    archived_conditions = ([ArchivedWorkOrder.visible_to(current_user)]
+                           + order_filter_conditions(filter_form, ArchivedWorkOrder))
+    filename = exporter.export_filename(fmt)
+    return Response(stream_with_context(exporter.generate(fmt, conditions, archived_conditions)),
+                    mimetype=exporter.FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@route('/search')
+@login_required
+def search_orders():
+    q = request.args.get('q', '').strip()
+    page = search.search_orders(q, current_user, page=request.args.get('page', 1, type=int),
+                                per_page=current_app.config['SEARCH_PER_PAGE'],
+                                options=ORDER_SEARCH_OPTIONS)
+    return render_template('search.html', q=q, page=page)
+
+
+@route('/reports/stage_durations')
+@login_required
+def stage_duration_report():
+    if not current_user.is_admin():
+        flash('您没有访问此页面的权限', 'danger')
+        return redirect(url_for('view_orders'))
+    form = ReportFilterForm(formdata=request.args)
+    form.validate()
+    default_from, default_to = analytics.default_range()
+    date_from = form.date_from.data or default_from
+    date_to = form.date_to.data or default_to
+    group = form.group.data if not form.group.errors else 'stage'
+    period = form.period.data if not form.period.errors else 'all'
+    stage_name = form.stage_name.data if not form.stage_name.errors else None
+    rows = analytics.stage_duration_report(date_from, date_to, group=group, period=period, stage_name=stage_name)
+    return render_template('stage_durations.html', form=form, rows=rows, group=group,
+                           date_from=date_from, date_to=date_to)
 
 
 # =========== 新增的视图函数 ===========
 # 用于查看单个工单的详细信息
-@app.route('/order/<int:order_id>')
+@route('/order/<int:order_id>')
 @login_required
 def view_order(order_id):
-    order = WorkOrder.query.get_or_404(order_id)
+    # 已归档的工单从归档表读取，页面相同
+    order = archive.find_order(order_id, ORDER_DETAIL_OPTIONS, ARCHIVED_ORDER_DETAIL_OPTIONS)
+    if order is None:
+        abort(404)
     # 这里可以添加权限检查，例如只允许相关人员查看
     # if not (current_user.is_admin() or current_user.id == order.salesperson_id or current_user.id in [s.assignee_id for s in order.stages]):
     #     flash('您没有权限查看此工单。', 'danger')
@@ -201,10 +415,13 @@ def view_order(order_id):
 # ===================================
 
 
-@app.route('/assign_order/<int:order_id>', methods=['GET', 'POST'])
+@route('/assign_order/<int:order_id>', methods=['GET', 'POST'])
 @login_required
 def assign_order(order_id):
-    order = WorkOrder.query.get_or_404(order_id)
+    if request.method == 'POST' and submissions.is_replay():
+        return _duplicate_submit('view_order', order_id=order_id)
+
+    order = WorkOrder.query.options(*ORDER_WORKFLOW_OPTIONS).get_or_404(order_id)
     
     # 权限检查：管理员或当前负责人可以指派
     if not (current_user.is_admin() or current_user.id == order.current_assignee_id):
@@ -212,12 +429,20 @@ def assign_order(order_id):
         return redirect(url_for('view_order', order_id=order.id))
     
     form = AssignOrderForm()
-    form.assignee_id.choices = [(u.id, u.realname) for u in User.query.order_by(User.realname).all()]
+    form.assignee_id.choices = directory.user_choices()
     
     if form.validate_on_submit():
+        if form.version.data is not None and form.version.data != order.version:
+            flash(ORDER_CONFLICT_MESSAGE, 'warning')
+            return redirect(url_for('view_order', order_id=order.id))
+        stored = None
         try:
+            # 先把附件落盘，此时还没有写数据库，不持有写锁
+            if form.attachment.data:
+                stored = save_upload(form.attachment.data, f"{order_id}_{form.stage_name.data}")
+            
             # 结束当前环节
-            current_stage = OrderStage.query.filter_by(order_id=order.id, end_time=None).first()
+            current_stage = order.active_stage
             if current_stage:
                 current_stage.end_time = datetime.utcnow()
                 current_stage.duration = int((current_stage.end_time - current_stage.start_time).total_seconds())
@@ -231,59 +456,79 @@ def assign_order(order_id):
             )
             
             # 更新工单状态
+            previous_stage = order.current_stage
+            order.active_stage = new_stage
             order.current_stage = new_stage.stage_name
             order.current_assignee_id = form.assignee_id.data
+            stats.stage_changed(order, previous_stage, current_stage)
+            analytics.stage_closed(current_stage)
+            changefeed.record(order, 'stage' if new_stage.stage_name != previous_stage else 'reassigned')
             
-            # 处理附件上传
-            if form.attachment.data:
-                file = form.attachment.data
-                filename = f"{order_id}_{new_stage.stage_name}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{file.filename}"
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-                
+            # 登记已落盘的附件
+            if stored:
                 attachment = Attachment(
-                    filename=filename
-                    # 注意：关联到 stage 需要在 stage 被添加到 session 之后
+                    filename=stored.filename,
+                    size=stored.size,
+                    sha256=stored.sha256
                 )
                 new_stage.attachments.append(attachment)
             
             db.session.add(new_stage)
+            submissions.remember(submissions.submitted_key(), 'assign_order', order.id)
             db.session.commit()
+            release_upload(stored)
             
             flash('工单已指派!', 'success')
             return redirect(url_for('view_order', order_id=order.id))
+        except (StaleDataError, IntegrityError):
+            discard_upload(stored)
+            return _write_conflict(order_id)
         except Exception as e:
             db.session.rollback()
+            discard_upload(stored)
             flash(f'指派工单失败: {str(e)}', 'danger')
-            app.logger.error(f'指派工单失败: {str(e)}')
+            current_app.logger.error(f'指派工单失败: {str(e)}')
     
+    if not form.is_submitted():
+        form.version.data = order.version
+
     return render_template('assign_order.html', form=form, order=order)
 
 
-@app.route('/process_order/<int:order_id>', methods=['GET', 'POST'])
+@route('/process_order/<int:order_id>', methods=['GET', 'POST'])
 @login_required
 def process_order(order_id):
-    order = WorkOrder.query.get_or_404(order_id)
+    if request.method == 'POST' and submissions.is_replay():
+        return _duplicate_submit('view_order', order_id=order_id)
+
+    order = WorkOrder.query.options(*ORDER_WORKFLOW_OPTIONS).get_or_404(order_id)
     
     # 检查当前用户是否是当前负责人
     if order.current_assignee_id != current_user.id:
         flash('您不是当前环节负责人，无法处理此工单', 'danger')
         return redirect(url_for('view_order', order_id=order.id))
     
-    # 获取当前活跃环节
-    current_stage = OrderStage.query.filter_by(order_id=order.id, end_time=None).first()
+    # 当前活跃环节已随工单一起加载
+    current_stage = order.active_stage
     
     # 确保当前环节存在
     if not current_stage:
         flash('找不到当前环节，无法处理', 'danger')
         return redirect(url_for('view_order', order_id=order.id))
     
+    # 负责人选项（部门 - 姓名）来自目录缓存
     form = ProcessOrderForm()
-    # 动态加载用户列表
-    form.next_assignee_id.choices = [(u.id, f"{u.department.name} - {u.realname}") for u in User.query.join(Department).order_by(Department.name, User.realname).all()]
 
     if form.validate_on_submit():
+        if form.version.data is not None and form.version.data != order.version:
+            flash(ORDER_CONFLICT_MESSAGE, 'warning')
+            return redirect(url_for('view_order', order_id=order.id))
+        stored = None
         try:
+            # 0. 先把附件落盘，此时还没有写数据库，不持有写锁
+            if form.attachment.data:
+                stored = save_upload(form.attachment.data, f"{order_id}_{form.next_stage_name.data}")
+            
             # 1. 更新当前环节信息
             current_stage.end_time = datetime.utcnow()
             current_stage.duration = int((current_stage.end_time - current_stage.start_time).total_seconds())
@@ -298,47 +543,60 @@ def process_order(order_id):
             )
             
             # 3. 更新工单主状态
+            previous_stage = order.current_stage
+            order.active_stage = new_stage
             order.current_stage = new_stage.stage_name
             order.current_assignee_id = form.next_assignee_id.data
+            stats.stage_changed(order, previous_stage, current_stage)
+            analytics.stage_closed(current_stage)
+            changefeed.record(order, 'stage')
             
             db.session.add(new_stage)
-            # 在添加新阶段后，处理附件，这样 new_stage 就会有一个 id
-            db.session.flush() # flush 以便 new_stage.id 可用
 
-            # 4. 处理附件上传
-            if form.attachment.data:
-                file = form.attachment.data
-                # 创建一个安全的文件名
-                filename = f"{order_id}_{new_stage.id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{file.filename}"
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(file_path)
-                
+            # 4. 登记已落盘的附件
+            if stored:
                 attachment = Attachment(
-                    filename=filename,
-                    stage_id=new_stage.id
+                    filename=stored.filename,
+                    size=stored.size,
+                    sha256=stored.sha256
                 )
-                db.session.add(attachment)
+                new_stage.attachments.append(attachment)
 
+            submissions.remember(submissions.submitted_key(), 'process_order', order.id)
             db.session.commit()
+            release_upload(stored)
             
             flash('工单处理完成! 已指派给下一环节负责人', 'success')
             return redirect(url_for('view_order', order_id=order.id))
+        except (StaleDataError, IntegrityError):
+            discard_upload(stored)
+            return _write_conflict(order_id)
         except Exception as e:
             db.session.rollback()
+            discard_upload(stored)
             flash(f'处理工单失败: {str(e)}', 'danger')
-            app.logger.error(f'处理工单失败: {e}', exc_info=True)
+            current_app.logger.error(f'处理工单失败: {e}', exc_info=True)
             
     # GET 请求时，为表单设置默认值
     if not form.is_submitted():
         form.next_stage_name.data = current_stage.stage_name
+        form.version.data = order.version
         
     return render_template('process_order.html', form=form, order=order, current_stage=current_stage)
 
 
-@app.route('/download/<filename>')
+@route('/download/<filename>')
 @login_required
 def download_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # 按附件记录定位文件并做权限检查，未登记的文件一律 404
+    attachment = archive.find_attachment(filename, ATTACHMENT_DOWNLOAD_OPTIONS, ARCHIVED_ATTACHMENT_DOWNLOAD_OPTIONS)
+    if attachment is None:
+        abort(404)
+    if not can_download(attachment, current_user):
+        abort(403)
+    if request.args.get('preview'):
+        return send_preview(attachment)
+    return send_attachment(attachment)
 
 def can_assign_order(order, user):
     """
@@ -349,8 +607,8 @@ def can_assign_order(order, user):
     if user.is_admin():
         return True
     
-    # 获取当前活跃环节
-    current_stage = OrderStage.query.filter_by(order_id=order.id, end_time=None).first()
+    # 当前活跃环节由工单上的冗余指针给出，列表页已预加载
+    current_stage = order.active_stage
     
     # 如果是当前环节的负责人
     if current_stage and current_stage.assignee_id == user.id:
@@ -358,11 +616,11 @@ def can_assign_order(order, user):
     
     return False
 
-@app.context_processor
 def utility_processor():
     return dict(can_assign_order=can_assign_order)
 
 if __name__ == '__main__':
+    app = create_app()
     # 确保在应用上下文中操作
     with app.app_context():
         # # 下面的代码块用于初始化数据库，正常运行时可以注释掉
@@ -483,10 +741,12 @@ if __name__ == '__main__':
                 assignee_id=prod_user.id,
                 work_order=order
             )
+            order.active_stage = stage2
             
             db.session.add(order)
             db.session.add_all([stage1, stage2])
             db.session.commit()
+            stats.rebuild()
             print("数据库初始化完成！管理员账号：admin/admin123, 销售员账号: wzl/qq")
 
     # 运行应用
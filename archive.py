@@ -0,0 +1,178 @@
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, literal, select
+from extensions import db
+from models import (WorkOrder, OrderStage, Attachment, OrderChange,
+                    ArchivedWorkOrder, ArchivedOrderStage, ArchivedAttachment)
+from stats import COMPLETED_STAGE
+
+# 已完成工单归档
+# - 进入"完成"超过 ARCHIVE_AFTER_DAYS 天的工单，连同环节和附件记录迁入 archived_* 表（同一数据库，保留原 id）
+# - 每批 ARCHIVE_BATCH_SIZE 张工单一个事务：INSERT ... SELECT 复制后删除在线表的行，
+#   失败整批回滚，不会出现两边都有或都没有；批次之间停顿，页面请求的写事务不会被长时间挡住
+# - 在线表只剩未完成和近期完成的工单，列表、计数、活跃环节查询的数据量不再随历史增长
+# - 工单详情和附件下载先查在线表、再查归档表；导出和环节历时统计同时读取两层
+# - 附件文件原地不动，归档的附件记录仍计入 attachment_blob 的引用数，不会被清理
+# - 归档的工单不再出现在工单列表和全文检索中
+# - 持有当前最大 id 的工单 / 环节 / 附件暂不归档：SQLite 新行 id 取现有最大值加一，
+#   删掉最大的一行会让之后的新行复用归档表里已有的 id
+
+
+def _newest_owners():
+    """持有最大工单 id、最大环节 id、最大附件 id 的工单"""
+    owners = {
+        db.session.query(func.max(WorkOrder.id)).scalar(),
+        db.session.query(OrderStage.order_id).order_by(OrderStage.id.desc()).limit(1).scalar(),
+        db.session.query(OrderStage.order_id).join(Attachment, Attachment.stage_id == OrderStage.id)
+        .order_by(Attachment.id.desc()).limit(1).scalar(),
+    }
+    owners.discard(None)
+    return owners
+
+
+def _eligible(cutoff):
+    """可归档的条件：当前处于"完成"，且完成环节（活跃环节）在 cutoff 之前开始"""
+    return (WorkOrder.current_stage == COMPLETED_STAGE, OrderStage.start_time < cutoff)
+
+
+def candidates(cutoff, after_id=0, limit=200, exclude=()):
+    query = (select(WorkOrder.id)
+             .join(OrderStage, OrderStage.id == WorkOrder.active_stage_id)
+             .where(*_eligible(cutoff), WorkOrder.id > after_id)
+             .order_by(WorkOrder.id)
+             .limit(limit))
+    if exclude:
+        query = query.where(WorkOrder.id.notin_(exclude))
+    return db.session.execute(query).scalars().all()
+
+
+def archive_batch(order_ids, cutoff):
+    """
+    在一个事务内把一批工单迁入归档表，返回实际迁移的工单 id
+    复制时重新检查归档条件：选出之后被重新打开的工单不会迁移
+    """
+    now = datetime.utcnow()
+    order_columns = ['id', 'order_number', 'order_date', 'quantity', 'delivery_date', 'salesperson_id',
+                     'total_duration', 'current_stage', 'created_at', 'current_assignee_id']
+    moved = db.session.execute(
+        insert(ArchivedWorkOrder.__table__)
+        .from_select(order_columns + ['completed_at', 'archived_at'],
+                     select(*[WorkOrder.__table__.c[name] for name in order_columns],
+                            OrderStage.start_time, literal(now))
+                     .join(OrderStage, OrderStage.id == WorkOrder.active_stage_id)
+                     .where(WorkOrder.id.in_(order_ids), *_eligible(cutoff)))
+        .returning(ArchivedWorkOrder.__table__.c.id)
+    ).scalars().all()
+    if not moved:
+        db.session.commit()
+        return []
+
+    stage_ids = select(OrderStage.id).where(OrderStage.order_id.in_(moved)).scalar_subquery()
+    stage_columns = ['id', 'stage_name', 'start_time', 'end_time', 'duration', 'comments', 'assignee_id', 'order_id']
+    db.session.execute(
+        insert(ArchivedOrderStage.__table__)
+        .from_select(stage_columns, select(*[OrderStage.__table__.c[name] for name in stage_columns])
+                     .where(OrderStage.order_id.in_(moved))))
+    attachment_columns = ['id', 'filename', 'upload_time', 'size', 'sha256', 'stage_id']
+    db.session.execute(
+        insert(ArchivedAttachment.__table__)
+        .from_select(attachment_columns, select(*[Attachment.__table__.c[name] for name in attachment_columns])
+                     .where(Attachment.stage_id.in_(stage_ids))))
+
+    # 先删工单：全文检索触发器随之删除索引行，之后删环节、附件时触发器找不到工单，不再重建索引
+    # 附件用 Core 删除，不经过 ORM 事件，attachment_blob 的引用数保持不变（引用转给了归档记录）
+    db.session.execute(delete(WorkOrder.__table__).where(WorkOrder.id.in_(moved)))
+    db.session.execute(delete(Attachment.__table__).where(Attachment.stage_id.in_(stage_ids)))
+    db.session.execute(delete(OrderStage.__table__).where(OrderStage.order_id.in_(moved)))
+    db.session.execute(delete(OrderChange.__table__).where(OrderChange.order_id.in_(moved)))
+    db.session.commit()
+    return moved
+
+
+def archive_orders(days=None, batch_size=None, pause=None):
+    """按批归档完成超过 days 天的工单，返回迁移的工单数"""
+    config = current_app.config
+    days = config['ARCHIVE_AFTER_DAYS'] if days is None else days
+    batch_size = batch_size or config['ARCHIVE_BATCH_SIZE']
+    pause = config['ARCHIVE_BATCH_PAUSE'] if pause is None else pause
+    if not days:
+        return 0
+    cutoff = datetime.utcnow() - timedelta(days=days)
+
+    archived = 0
+    last_id = 0
+    while True:
+        order_ids = candidates(cutoff, last_id, batch_size, exclude=_newest_owners())
+        # 结束读事务，下一批从写语句开始
+        db.session.commit()
+        if not order_ids:
+            break
+        archived += len(archive_batch(order_ids, cutoff))
+        last_id = order_ids[-1]
+        if pause:
+            time.sleep(pause)
+    return archived
+
+
+def find_order(order_id, options=(), archived_options=()):
+    """按 id 取工单，在线表没有时取归档表；都没有返回 None"""
+    return (WorkOrder.query.options(*options).filter_by(id=order_id).first()
+            or ArchivedWorkOrder.query.options(*archived_options).filter_by(id=order_id).first())
+
+
+def find_attachment(filename, options=(), archived_options=()):
+    """按文件名取附件记录（同名取最新），在线表没有时取归档表"""
+    return (Attachment.query.options(*options).filter_by(filename=filename)
+            .order_by(Attachment.id.desc()).first()
+            or ArchivedAttachment.query.options(*archived_options).filter_by(filename=filename)
+            .order_by(ArchivedAttachment.id.desc()).first())
+
+
+def archived_order_numbers(order_numbers):
+    """已归档工单中存在的派工单号（派工单号在两层之间也不能重复）"""
+    if not order_numbers:
+        return set()
+    return {number for (number,) in db.session.query(ArchivedWorkOrder.order_number)
+            .filter(ArchivedWorkOrder.order_number.in_(order_numbers))}
+
+
+def start_archiver(app):
+    """每 ARCHIVE_INTERVAL 秒在后台线程归档一次；多进程同时执行时，后到的一方复制时条件不再满足，迁移 0 行"""
+    interval = app.config['ARCHIVE_INTERVAL']
+    if not interval or not app.config['ARCHIVE_AFTER_DAYS']:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    started = time.perf_counter()
+                    archived = archive_orders()
+                    if archived:
+                        app.logger.info(f'工单归档: 迁移 {archived} 张工单，'
+                                        f'耗时 {(time.perf_counter() - started) * 1000:.0f}ms')
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f'工单归档失败: {e}', exc_info=True)
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=run, name='order-archiver', daemon=True)
+    thread.start()
+    return thread
+
+
+@click.command('archive-orders')
+@click.option('--days', type=int, default=None, help='归档完成超过该天数的工单，默认取 ARCHIVE_AFTER_DAYS')
+@click.option('--batch-size', type=int, default=None, help='每个事务迁移的工单数')
+@with_appcontext
+def archive_orders_command(days, batch_size):
+    """立即归档已完成的工单"""
+    started = time.perf_counter()
+    archived = archive_orders(days=days, batch_size=batch_size, pause=0)
+    click.echo(f'归档 {archived} 张工单，耗时 {(time.perf_counter() - started) * 1000:.0f}ms')
@@ -3,6 +3,8 @@ from flask_login import login_user, logout_user, login_required, current_user
 from forms import LoginForm, RegistrationForm
 from models import User, Department
 from extensions import db, bcrypt
+import stats
+import directory
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -35,8 +37,7 @@ def register():
         return redirect(url_for('view_orders'))
     
     form = RegistrationForm()
-    departments = Department.query.all()
-    form.department_id.choices = [(d.id, d.name) for d in departments]
+    form.department_id.choices = directory.department_choices()
     
     if form.validate_on_submit():
         hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
@@ -48,6 +49,8 @@ def register():
             department_id=form.department_id.data
         )
         db.session.add(user)
+        stats.user_added()
+        directory.invalidate()
         db.session.commit()
         flash('账户创建成功! 请登录', 'success')
         return redirect(url_for('auth.login'))
@@ -0,0 +1,399 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import create_engine, insert, select, update, func
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm.exc import StaleDataError
+from extensions import db
+from models import Department, User, WorkOrder, OrderStage
+from dbprofile import SQLITE_PROFILES, engine_options, apply_pragmas
+from querybudget import QueryCounter
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+    return samples[index]
+
+
+def _seed(engine, orders):
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(Department.__table__), [{'id': 1, 'name': '生产部'}])
+        conn.execute(insert(User.__table__), [
+            {'id': i, 'username': f'u{i}', 'password_hash': '-', 'realname': f'用户{i}', 'department_id': 1}
+            for i in range(1, 21)
+        ])
+        conn.execute(insert(WorkOrder.__table__), [
+            {'id': i, 'order_number': f'B{i:06d}', 'order_date': now - timedelta(minutes=i), 'quantity': 1,
+             'delivery_date': now + timedelta(days=7), 'salesperson_id': 1, 'current_assignee_id': 2,
+             'current_stage': '计划', 'active_stage_id': i}
+            for i in range(1, orders + 1)
+        ])
+        conn.execute(insert(OrderStage.__table__), [
+            {'id': i, 'order_id': i, 'stage_name': '计划', 'start_time': now, 'assignee_id': 2}
+            for i in range(1, orders + 1)
+        ])
+
+
+def _writer(engine, orders, deadline, result):
+    """
+    模拟 process_order：先读出工单版本和活跃环节（打开页面），再在一个事务内
+    按版本条件更新工单、结束当前环节、插入新环节；期间工单已被其他线程流转时记为冲突
+    """
+    rng = random.Random()
+    while time.monotonic() < deadline:
+        order_id = rng.randint(1, orders)
+        started = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                stage_id, version = conn.execute(
+                    select(WorkOrder.active_stage_id, WorkOrder.version).where(WorkOrder.id == order_id)).one()
+            with engine.begin() as conn:
+                now = datetime.utcnow()
+                updated = conn.execute(update(WorkOrder).where(WorkOrder.id == order_id, WorkOrder.version == version)
+                                       .values(current_stage='技术部', version=version + 1)).rowcount
+                if not updated:
+                    raise StaleDataError(f'工单 {order_id} 已被修改')
+                conn.execute(update(OrderStage).where(OrderStage.id == stage_id).values(end_time=now, duration=1))
+                new_id = conn.execute(insert(OrderStage).values(
+                    order_id=order_id, stage_name='技术部', start_time=now, assignee_id=rng.randint(1, 20)
+                )).inserted_primary_key[0]
+                conn.execute(update(WorkOrder).where(WorkOrder.id == order_id).values(active_stage_id=new_id))
+        except (StaleDataError, IntegrityError):
+            result['conflicts'] += 1
+            continue
+        except OperationalError:
+            result['errors'] += 1
+            continue
+        result['latencies'].append(time.perf_counter() - started)
+
+
+def _reader(engine, deadline, result):
+    """模拟工单列表：取一页工单及其活跃环节"""
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(
+                    select(WorkOrder.id, WorkOrder.order_number, OrderStage.stage_name)
+                    .join(OrderStage, OrderStage.id == WorkOrder.active_stage_id)
+                    .order_by(WorkOrder.order_date.desc(), WorkOrder.id.desc())
+                    .limit(50)
+                ).fetchall()
+                conn.execute(select(func.count()).select_from(OrderStage).where(OrderStage.end_time.is_(None))).scalar()
+        except OperationalError:
+            result['errors'] += 1
+            continue
+        result['latencies'].append(time.perf_counter() - started)
+
+
+def run_db_benchmark(profile, writers, readers, seconds, orders):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        uri = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+        engine = create_engine(uri, **engine_options(uri, profile))
+        apply_pragmas(engine, profile)
+        db.metadata.create_all(engine)
+        _seed(engine, orders)
+
+        write_results = [{'errors': 0, 'conflicts': 0, 'latencies': []} for _ in range(writers)]
+        read_results = [{'errors': 0, 'conflicts': 0, 'latencies': []} for _ in range(readers)]
+        deadline = time.monotonic() + seconds
+        threads = [threading.Thread(target=_writer, args=(engine, orders, deadline, r)) for r in write_results]
+        threads += [threading.Thread(target=_reader, args=(engine, deadline, r)) for r in read_results]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        engine.dispose()
+
+    def summarize(results):
+        latencies = [l for r in results for l in r['latencies']]
+        return {
+            'ops': len(latencies),
+            'ops_per_sec': round(len(latencies) / seconds, 1),
+            'errors': sum(r['errors'] for r in results),
+            # 乐观并发冲突：版本不符或同一工单的活跃环节唯一约束冲突，事务已回滚
+            'conflicts': sum(r['conflicts'] for r in results),
+            'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+            'p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+        }
+    return {'writes': summarize(write_results), 'reads': summarize(read_results)}
+
+
+@click.command('bench-db')
+@click.option('--profile', 'profiles', multiple=True, type=click.Choice(sorted(SQLITE_PROFILES)),
+              help='要对比的配置方案，可重复指定，默认全部')
+@click.option('--writers', default=4, show_default=True, help='并发写线程数')
+@click.option('--readers', default=8, show_default=True, help='并发读线程数')
+@click.option('--seconds', default=5.0, show_default=True, help='每个方案的运行时长')
+@click.option('--orders', default=2000, show_default=True, help='预置工单数')
+def bench_db_command(profiles, writers, readers, seconds, orders):
+    """在临时 SQLite 文件上对比各配置方案的读写并发吞吐"""
+    for profile in profiles or sorted(SQLITE_PROFILES):
+        result = run_db_benchmark(profile, writers, readers, seconds, orders)
+        click.echo(f'[{profile}] writers={writers} readers={readers} seconds={seconds}')
+        for kind in ('writes', 'reads'):
+            r = result[kind]
+            click.echo(f'  {kind:<6} {r["ops_per_sec"]:>9}/s  ops={r["ops"]:<7} errors={r["errors"]:<5} '
+                       f'conflicts={r["conflicts"]:<5} p50={r["p50_ms"]}ms p95={r["p95_ms"]}ms')
+
+
+_LEGACY_DATE_FORMATS = ('%Y%m%d', '%Y/%m/%d', '%m/%d/%Y', '%Y-%m-%d', '%m-%d-%Y', '%d/%m/%Y', '%d-%m-%Y')
+
+
+def _legacy_parse_date(date_str):
+    """原先 create_order 里逐个 strptime 试错的实现，只用于对比"""
+    for fmt in _LEGACY_DATE_FORMATS:
+        try:
+            return datetime.strptime(date_str, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _date_samples(count, distinct):
+    """各格式族混合的输入，distinct 控制不同取值的个数（重复输入命中缓存）"""
+    rng = random.Random(42)
+    base = datetime(2025, 1, 1)
+    patterns = ('%Y%m%d', '%Y/%m/%d', '%Y-%m-%d', '%m/%d/%Y', '%d-%m-%Y', 'bad')
+    values = []
+    for i in range(distinct):
+        day = base + timedelta(days=rng.randint(0, 730))
+        pattern = patterns[i % len(patterns)]
+        values.append(f'x{i}' if pattern == 'bad' else day.strftime(pattern))
+    return [values[rng.randrange(distinct)] for _ in range(count)]
+
+
+def run_date_benchmark(count, distinct):
+    import dates
+    samples = _date_samples(count, distinct)
+
+    def timed(fn):
+        started = time.perf_counter()
+        for s in samples:
+            fn(s)
+        return (time.perf_counter() - started) / count * 1e6
+
+    dates.clear_cache()
+    results = {'legacy': timed(_legacy_parse_date), 'cold': None}
+    # cold：每次调用前清空缓存，只衡量正则分派本身
+    started = time.perf_counter()
+    for s in samples:
+        dates.clear_cache()
+        dates.parse_date(s, day_first=False)
+    results['cold'] = (time.perf_counter() - started) / count * 1e6
+    dates.clear_cache()
+    results['cached'] = timed(lambda s: dates.parse_date(s, day_first=False))
+    results['hits'] = dates.cache_info().hits
+    return results
+
+
+@click.command('bench-dates')
+@click.option('--count', default=200000, show_default=True, help='解析次数')
+@click.option('--distinct', default=2000, show_default=True, help='不同输入的个数')
+def bench_dates_command(count, distinct):
+    """对比原先的 strptime 试错与预编译正则 + LRU 缓存的日期解析耗时"""
+    r = run_date_benchmark(count, distinct)
+    click.echo(f'count={count} distinct={distinct}')
+    click.echo(f'  legacy strptime  {r["legacy"]:.2f} us/op')
+    click.echo(f'  regex (no cache) {r["cold"]:.2f} us/op')
+    click.echo(f'  regex + lru      {r["cached"]:.2f} us/op  hits={r["hits"]}')
+
+
+# =========== 页面压测 ===========
+# 用 Flask 测试客户端依次访问各页面（不经过网络和 WSGI 服务器），每个页面记录：
+# - 延迟分位数：先预热，再计时 requests 次，每次使用新的应用上下文，不复用会话和 g 上的缓存
+# - 每次请求的 SQL 语句数（QueryCounter）
+# - 峰值内存：另外用 tracemalloc 跟踪少量请求取最大值，避免跟踪开销影响延迟
+# 结果保存为 JSON，--compare 与之前的结果逐项对比
+
+ROUTE_RESULTS_FOLDER = os.path.join('instance', 'bench')
+
+
+def _route_cases(order_ids, active_orders, rng, writes):
+    """
+    [(名称, 方法, 路径生成函数, 登录用户生成函数, 表单生成函数)]
+    路径和用户按样本随机选取，避免一直命中同一张工单的缓存页
+    """
+    def admin(_):
+        return None
+
+    def pick(ids):
+        return lambda: rng.choice(ids)
+
+    any_order = pick(order_ids)
+    any_active = pick([order_id for order_id, _ in active_orders])
+    assignees = dict(active_orders)
+    cases = [
+        ('view_orders', 'GET', lambda: '/orders', admin, None),
+        ('view_orders_filtered', 'GET', lambda: '/orders?stage=技术部', admin, None),
+        ('view_orders_assignee', 'GET', lambda: '/orders', 'assignee', None),
+        ('view_order', 'GET', lambda: f'/order/{any_order()}', admin, None),
+        ('assign_order', 'GET', lambda: f'/assign_order/{any_active()}', admin, None),
+        ('process_order', 'GET', lambda: f'/process_order/{any_active()}', 'assignee', None),
+        ('search', 'GET', lambda: '/search?q=' + rng.choice(('图纸', '客户确认', 'SD00001', '加急')), admin, None),
+        ('api_orders', 'GET', lambda: '/api/orders?limit=50', admin, None),
+        ('stage_duration_report', 'GET', lambda: '/reports/stage_durations?group=assignee&period=month',
+         admin, None),
+    ]
+    if writes:
+        cases.append(('process_order_post', 'POST', lambda: f'/process_order/{any_active()}', 'assignee',
+                      lambda: {'comments': '压测', 'next_stage_name': '采购部'}))
+    return cases, assignees
+
+
+def run_route_benchmark(requests=50, warmup=3, memory_samples=5, sample_orders=500, writes=False, seed=1,
+                        routes=None):
+    """返回 {页面: 指标}，需在应用上下文中调用"""
+    app = current_app._get_current_object()
+    rng = random.Random(seed)
+    admin = User.query.filter_by(role='admin').order_by(User.id).first()
+    if admin is None:
+        raise ValueError('需要一个管理员账号')
+    order_ids = db.session.execute(
+        select(WorkOrder.id).order_by(func.random()).limit(sample_orders)).scalars().all()
+    active_orders = db.session.execute(
+        select(WorkOrder.id, WorkOrder.current_assignee_id)
+        .where(WorkOrder.current_stage != '完成', WorkOrder.current_assignee_id.isnot(None))
+        .order_by(func.random()).limit(sample_orders)).all()
+    if not order_ids or not active_orders:
+        raise ValueError('没有可压测的工单，先运行 flask seed-data')
+    cases, assignees = _route_cases(order_ids, active_orders, rng, writes)
+    if routes:
+        cases = [case for case in cases if case[0] in routes]
+
+    client = app.test_client()
+    csrf_enabled = app.config.get('WTF_CSRF_ENABLED', True)
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    def request_once(method, path, user, form):
+        if user == 'assignee':
+            # 以该工单（或任一进行中工单）的当前负责人身份访问
+            order_id = int(path.rstrip('/').rsplit('/', 1)[-1]) if path[-1].isdigit() else None
+            user_id = assignees.get(order_id) or rng.choice(list(assignees.values()))
+        else:
+            user_id = admin.id
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        if form:
+            data = form()
+            data['next_assignee_id'] = user_id
+            return client.open(path, method=method, data=data)
+        return client.open(path, method=method)
+
+    results = {}
+    try:
+        for name, method, path_fn, user, form in cases:
+            for _ in range(warmup):
+                with app.app_context():
+                    request_once(method, path_fn(), user, form)
+
+            latencies, queries, statuses = [], [], {}
+            for _ in range(requests):
+                path = path_fn()
+                with app.app_context(), QueryCounter() as counter:
+                    started = time.perf_counter()
+                    response = request_once(method, path, user, form)
+                    response.get_data()
+                    latencies.append(time.perf_counter() - started)
+                queries.append(counter.count)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            peak = 0
+            tracemalloc.start()
+            try:
+                for _ in range(memory_samples):
+                    tracemalloc.reset_peak()
+                    with app.app_context():
+                        request_once(method, path_fn(), user, form).get_data()
+                    peak = max(peak, tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+
+            results[name] = {
+                'requests': requests,
+                'status': {str(code): count for code, count in sorted(statuses.items())},
+                'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+                'p95_ms': round(_percentile(latencies, 95) * 1000, 2),
+                'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+                'max_ms': round(max(latencies) * 1000, 2),
+                'queries_avg': round(sum(queries) / len(queries), 1),
+                'queries_max': max(queries),
+                'peak_kib': round(peak / 1024, 1),
+            }
+    finally:
+        app.config['WTF_CSRF_ENABLED'] = csrf_enabled
+    return results
+
+
+def _dataset_summary():
+    return {
+        'orders': db.session.query(func.count(WorkOrder.id)).scalar(),
+        'stages': db.session.query(func.count(OrderStage.id)).scalar(),
+        'users': db.session.query(func.count(User.id)).scalar(),
+    }
+
+
+def _route_table(results, baseline=None):
+    lines = [f'{"route":<24}{"p50":>9}{"p95":>9}{"p99":>9}{"queries":>9}{"peak KiB":>10}  status']
+    for name, r in results.items():
+        line = (f'{name:<24}{r["p50_ms"]:>9}{r["p95_ms"]:>9}{r["p99_ms"]:>9}'
+                f'{r["queries_avg"]:>9}{r["peak_kib"]:>10}  {r["status"]}')
+        lines.append(line)
+        base = (baseline or {}).get(name)
+        if base:
+            def delta(key):
+                if not base[key]:
+                    return '-'
+                return f'{(r[key] - base[key]) / base[key] * 100:+.0f}%'
+            lines.append(f'{"  vs baseline":<24}{delta("p50_ms"):>9}{delta("p95_ms"):>9}{delta("p99_ms"):>9}'
+                         f'{delta("queries_avg"):>9}{delta("peak_kib"):>10}')
+    return '\n'.join(lines)
+
+
+@click.command('bench-routes')
+@click.option('--requests', default=50, show_default=True, help='每个页面计时的请求数')
+@click.option('--warmup', default=3, show_default=True, help='每个页面预热的请求数')
+@click.option('--memory-samples', default=5, show_default=True, help='每个页面测量峰值内存的请求数')
+@click.option('--route', 'routes', multiple=True, help='只压测指定页面，可重复指定')
+@click.option('--writes', is_flag=True, help='同时压测处理工单的提交（会修改数据）')
+@click.option('--seed', default=1, show_default=True, help='选取工单样本的随机种子')
+@click.option('--save', 'save_path', default=None, help='结果保存路径，默认 instance/bench/routes-<时间>.json')
+@click.option('--compare', 'compare_path', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='与之前保存的结果对比')
+@with_appcontext
+def bench_routes_command(requests, warmup, memory_samples, routes, writes, seed, save_path, compare_path):
+    """用测试客户端压测各页面：延迟分位数（毫秒）、SQL 语句数和峰值内存"""
+    results = run_route_benchmark(requests, warmup, memory_samples, writes=writes, seed=seed, routes=routes)
+    baseline = None
+    if compare_path:
+        with open(compare_path, encoding='utf-8') as f:
+            baseline = json.load(f)['routes']
+    click.echo(_route_table(results, baseline))
+
+    report = {
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'dataset': _dataset_summary(),
+        'db_profile': current_app.config['DB_PROFILE'],
+        'options': {'requests': requests, 'warmup': warmup, 'writes': writes, 'seed': seed},
+        'routes': results,
+    }
+    if not save_path:
+        save_path = os.path.join(current_app.root_path, ROUTE_RESULTS_FOLDER,
+                                 f'routes-{datetime.now().strftime("%Y%m%d-%H%M%S")}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(save_path)), exist_ok=True)
+    with open(save_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    click.echo(f'结果已保存到 {save_path}')
@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, func, insert, select
+from sqlalchemy.orm import Session
+from extensions import db
+from models import OrderChange, WorkOrder, User
+
+# 工单变更推送（Server-Sent Events）
+# - 建单、环节流转、改派时在同一事务内向 order_change 写一行，回滚则一起消失
+# - 推送连接按自增 id 增量读取变更流水，只取当前用户可见的工单（可见性在读取时按 WorkOrder.visible_to 判断）
+# - 本进程内提交后立即唤醒等待中的连接；其他进程的提交由 CHANGEFEED_POLL_INTERVAL 轮询发现
+# - 事件只带工单 id 和变更摘要，页面据此只重新获取变化的行，不再整页刷新
+# - 每个连接最长保持 CHANGEFEED_STREAM_SECONDS 秒，浏览器带 Last-Event-ID 自动重连，不会漏掉事件
+
+KINDS = {
+    'created': '新工单',
+    'stage': '环节流转',
+    'reassigned': '改派',
+}
+_WAKE = 'changefeed_wake'
+
+
+class _Signal:
+    """提交计数 + 条件变量：读取前记下计数，等待时计数已变化就不再等待，避免错过读取与等待之间的提交"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.generation = 0
+
+    def notify(self):
+        with self._condition:
+            self.generation += 1
+            self._condition.notify_all()
+
+    def wait(self, seen, timeout):
+        with self._condition:
+            if self.generation == seen:
+                self._condition.wait(timeout)
+
+
+_signal = _Signal()
+
+
+def record(order, kind):
+    """在当前事务内登记一次变更；order 可以尚未写入数据库（建单时）"""
+    db.session.add(OrderChange(order=order, kind=kind, stage_name=order.current_stage,
+                               assignee_id=order.current_assignee_id, created_at=datetime.utcnow()))
+    db.session.info[_WAKE] = True
+
+
+def record_created(rows):
+    """批量导入时登记新工单：rows 为 [(order_id, stage_name, assignee_id)]"""
+    if not rows:
+        return
+    now = datetime.utcnow()
+    db.session.execute(insert(OrderChange), [
+        {'order_id': order_id, 'kind': 'created', 'stage_name': stage_name,
+         'assignee_id': assignee_id, 'created_at': now}
+        for order_id, stage_name, assignee_id in rows])
+    db.session.info[_WAKE] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _notify_after_commit(session):
+    if session.info.pop(_WAKE, False):
+        _signal.notify()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _clear_after_rollback(session):
+    session.info.pop(_WAKE, None)
+
+
+def latest_id():
+    return db.session.query(func.coalesce(func.max(OrderChange.id), 0)).scalar()
+
+
+def fetch(user, after_id, limit=100):
+    """用户可见的、id 大于 after_id 的变更，按 id 升序"""
+    return db.session.execute(
+        select(OrderChange.id, OrderChange.order_id, OrderChange.kind, OrderChange.stage_name,
+               WorkOrder.order_number, User.realname)
+        .join(WorkOrder, WorkOrder.id == OrderChange.order_id)
+        .outerjoin(User, User.id == OrderChange.assignee_id)
+        .where(OrderChange.id > after_id, WorkOrder.visible_to(user))
+        .order_by(OrderChange.id)
+        .limit(limit)
+    ).all()
+
+
+def _event(change):
+    change_id, order_id, kind, stage_name, order_number, assignee = change
+    data = json.dumps({
+        'order_id': order_id,
+        'order_number': order_number,
+        'kind': kind,
+        'label': KINDS.get(kind, kind),
+        'stage_name': stage_name,
+        'assignee': assignee,
+    }, ensure_ascii=False)
+    return f'id: {change_id}\nevent: order\ndata: {data}\n\n'
+
+
+def stream(user, last_id=None):
+    """
+    生成 SSE 文本，需在 stream_with_context 中使用
+    last_id 为 None 时从当前最新的变更之后开始
+    """
+    config = current_app.config
+    poll = config['CHANGEFEED_POLL_INTERVAL']
+    heartbeat = config['CHANGEFEED_HEARTBEAT']
+    deadline = time.monotonic() + config['CHANGEFEED_STREAM_SECONDS']
+    if last_id is None:
+        last_id = latest_id()
+    # 断开后浏览器等待的毫秒数
+    yield f'retry: {poll * 1000}\n\n'
+    idle_since = time.monotonic()
+    while time.monotonic() < deadline:
+        seen = _signal.generation
+        changes = fetch(user, last_id)
+        # 不在等待期间占用连接和读事务
+        db.session.commit()
+        for change in changes:
+            last_id = change[0]
+            yield _event(change)
+        if changes:
+            idle_since = time.monotonic()
+            continue
+        if time.monotonic() - idle_since >= heartbeat:
+            # 注释行保持连接，代理和浏览器不会因空闲断开
+            yield ': keep-alive\n\n'
+            idle_since = time.monotonic()
+        _signal.wait(seen, poll)
+
+
+def purge(retention_hours=None):
+    """删除超过保留时长的变更流水；断线超过该时长的页面重连后只收到之后的事件"""
+    retention_hours = retention_hours or current_app.config['CHANGEFEED_RETENTION_HOURS']
+    cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+    result = db.session.execute(OrderChange.__table__.delete().where(OrderChange.created_at < cutoff))
+    db.session.commit()
+    return result.rowcount
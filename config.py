@@ -1,9 +1,119 @@
 import os
+import tempfile
+from dbprofile import engine_options
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'your-very-secret-key'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///work_orders.db'
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///work_orders.db'
+    # 数据库参数方案，见 dbprofile.SQLITE_PROFILES；多进程部署请使用 production
+    DB_PROFILE = os.environ.get('DB_PROFILE') or 'default'
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, DB_PROFILE)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = 'uploads'
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'doc', 'docx'}
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB
+    # 上传按块流式写入磁盘，内存占用与文件大小无关，可以放宽大小限制以接收 CAD / PDF 大文件
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_UPLOAD_MB') or 100) * 1024 * 1024
+    UPLOAD_CHUNK_SIZE = 64 * 1024
+    # 附件下载：文件名带时间戳、内容不变，浏览器可长期缓存
+    DOWNLOAD_MAX_AGE = 365 * 24 * 3600
+    # None / 'x-sendfile'（Apache、lighttpd）/ 'x-accel'（nginx，需配置 internal location）
+    DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD') or None
+    X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX') or '/protected-uploads/'
+    # 附件存储清理：无引用文件保留 BLOB_GC_GRACE 秒后删除，0 表示不启动后台清理线程
+    BLOB_GC_INTERVAL = int(os.environ.get('BLOB_GC_INTERVAL') or 3600)
+    BLOB_GC_GRACE = 3600
+    ORDERS_PER_PAGE = int(os.environ.get('ORDERS_PER_PAGE') or 50)
+    IMPORT_BATCH_SIZE = 500  # 批量导入每个事务插入的工单数
+    EXPORT_CHUNK_SIZE = 1000  # 导出时每次从数据库游标取出的行数
+    API_MAX_PAGE_SIZE = 200  # JSON API 每页最多返回的工单数
+    SEARCH_PER_PAGE = 20
+    # 交期风险评估：后台评估间隔（秒，0 表示不启动）、同一环节停留时的重算间隔、参考的历史天数
+    RISK_INTERVAL = int(os.environ.get('RISK_INTERVAL') or 300)
+    RISK_RESCORE_AFTER = 3600
+    RISK_HISTORY_DAYS = 90
+    # 已完成工单归档：完成超过 ARCHIVE_AFTER_DAYS 天的工单迁入归档表（0 表示不归档）、
+    # 后台检查间隔（秒，0 表示不启动）、每个事务迁移的工单数、批次之间的停顿（秒，让出写锁给页面请求）
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS') or 180)
+    ARCHIVE_INTERVAL = int(os.environ.get('ARCHIVE_INTERVAL') or 3600)
+    ARCHIVE_BATCH_SIZE = 200
+    ARCHIVE_BATCH_PAUSE = 0.2
+    # 后台任务：Web 进程内执行（也可以关闭后单独运行 flask worker）、并发线程数、
+    # 轮询间隔（秒，提交后会立即唤醒）、重试退避基数和上限（秒）、认领超时（秒）、已完成任务保留天数
+    TASK_RUN_IN_PROCESS = os.environ.get('TASK_RUN_IN_PROCESS', '1').lower() in ('1', 'true', 'yes')
+    TASK_WORKERS = int(os.environ.get('TASK_WORKERS') or 2)
+    TASK_POLL_INTERVAL = 5
+    TASK_BACKOFF_BASE = 10
+    TASK_BACKOFF_MAX = 3600
+    TASK_LOCK_TIMEOUT = 600
+    TASK_RETENTION_DAYS = 7
+    # 新环节通知的 Webhook 地址（企业微信、钉钉机器人等），为空时只写日志
+    NOTIFY_WEBHOOK_URL = os.environ.get('NOTIFY_WEBHOOK_URL') or None
+    # 工单变更推送：轮询间隔（秒，本进程的提交会立即唤醒）、心跳间隔、单个连接最长保持时间、变更流水保留小时数
+    CHANGEFEED_POLL_INTERVAL = 2
+    CHANGEFEED_HEARTBEAT = 15
+    CHANGEFEED_STREAM_SECONDS = 300
+    CHANGEFEED_RETENTION_HOURS = 24
+    # 表单提交键保留小时数：超过后同一页面再次提交不再识别为重复提交，由工单版本号兜底
+    SUBMISSION_KEY_RETENTION_HOURS = 24
+    # 请求埋点：响应带 Server-Timing 头，/metrics 输出 Prometheus 指标（设置令牌后用 Bearer 认证，否则仅管理员）
+    INSTRUMENTATION_ENABLED = True
+    INSTRUMENTATION_SERVER_TIMING = True
+    INSTRUMENTATION_SLOW_STATEMENTS = 5  # 每个端点保留的最慢 SQL 条数
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+    # 采样分析：逗号分隔的端点名（如 view_orders,api.list_orders），为空时不启动；
+    # 采样间隔（秒）、folded 调用栈的输出目录和写盘间隔（秒）
+    PROFILE_ENDPOINTS = os.environ.get('PROFILE_ENDPOINTS') or None
+    PROFILE_INTERVAL = 0.005
+    PROFILE_FOLDER = os.path.join('instance', 'profiles')
+    PROFILE_FLUSH_INTERVAL = 10
+    # 日期 03/04/2025 这类月日有歧义时按日在前解析（默认月在前）
+    DATE_DAY_FIRST = os.environ.get('DATE_DAY_FIRST', '').lower() in ('1', 'true', 'yes')
+    # 登录身份缓存
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 300  # 秒
+    USER_CACHE_VERSION_INTERVAL = 5  # 秒，多进程间发现用户修改的最长延迟
+
+
+class DevelopmentConfig(Config):
+    pass
+
+
+class TestingConfig(Config):
+    """测试：内存数据库（Flask-SQLAlchemy 自动使用单连接池），不启动后台线程，bcrypt 用最少轮数"""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    DB_PROFILE = 'default'
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI, DB_PROFILE)
+    WTF_CSRF_ENABLED = False
+    BCRYPT_LOG_ROUNDS = 4
+    UPLOAD_FOLDER = os.path.join(tempfile.gettempdir(), 'work-orders-test-uploads')
+    BLOB_GC_INTERVAL = 0
+    RISK_INTERVAL = 0
+    ARCHIVE_INTERVAL = 0
+    TASK_RUN_IN_PROCESS = False
+    PROFILE_ENDPOINTS = None
+    CHANGEFEED_STREAM_SECONDS = 1
+
+
+class ProductionConfig(Config):
+    """生产：文件数据库使用 WAL 等调优参数（dbprofile 的 production 方案）"""
+    DB_PROFILE = os.environ.get('DB_PROFILE') or 'production'
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(Config.SQLALCHEMY_DATABASE_URI, DB_PROFILE)
+
+
+CONFIGS = {
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+    'production': ProductionConfig,
+}
+
+
+def get_config(config=None):
+    """config 为配置类或名称；为空时取环境变量 APP_ENV，默认 development"""
+    if config is None or isinstance(config, str):
+        name = config or os.environ.get('APP_ENV') or 'development'
+        try:
+            return CONFIGS[name]
+        except KeyError:
+            raise ValueError(f'未知的配置: {name}，可选 {", ".join(CONFIGS)}')
+    return config
@@ -0,0 +1,74 @@
+import re
+from datetime import datetime
+from functools import lru_cache
+from flask import current_app, has_app_context
+
+# 工单日期解析：按格式族用预编译的正则一次匹配，不再逐个 strptime 试错
+# 支持的格式族：
+# - 紧凑：yyyymmdd（如 20250629）
+# - 年在前：yyyy/mm/dd、yyyy-mm-dd、yyyy.mm.dd、yyyy年m月d日
+# - 年在后：mm/dd/yyyy、dd/mm/yyyy 及 - . 分隔，月日顺序按下面的规则判定
+# 年在后时的歧义规则：
+# - 第一段 > 12 只能是日，第二段 > 12 只能是月日顺序
+# - 两段都 <= 12 时无法判断，按 day_first 决定；默认月在前，与原先先试 %m/%d/%Y 的行为一致
+# 同一个日期里的分隔符必须一致，日期本身无效（如 2 月 30 日）返回 None
+
+_COMPACT = re.compile(r'(\d{4})(\d{2})(\d{2})')
+_YEAR_FIRST = re.compile(r'(\d{4})([-/.])(\d{1,2})\2(\d{1,2})')
+_YEAR_FIRST_CN = re.compile(r'(\d{4})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日?')
+_YEAR_LAST = re.compile(r'(\d{1,2})([-/.])(\d{1,2})\2(\d{4})')
+
+CACHE_SIZE = 4096
+
+
+def _make(year, month, day):
+    try:
+        return datetime(int(year), int(month), int(day))
+    except ValueError:
+        return None
+
+
+def _year_last(first, second, year, day_first):
+    first, second = int(first), int(second)
+    if first > 12:
+        day_first = True
+    elif second > 12:
+        day_first = False
+    return _make(year, first, second) if not day_first else _make(year, second, first)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _parse(text, day_first):
+    # 按长度和第 5 个字符分派，每个输入只匹配一个正则
+    if len(text) == 8 and text.isdigit():
+        m = _COMPACT.fullmatch(text)
+        return _make(m[1], m[2], m[3])
+    if text[4:5] in ('-', '/', '.') and text[:4].isdigit():
+        m = _YEAR_FIRST.fullmatch(text)
+        return _make(m[1], m[3], m[4]) if m else None
+    if '年' in text:
+        m = _YEAR_FIRST_CN.fullmatch(text)
+        return _make(m[1], m[2], m[3]) if m else None
+    m = _YEAR_LAST.fullmatch(text)
+    return _year_last(m[1], m[3], m[4], day_first) if m else None
+
+
+def parse_date(date_str, day_first=None):
+    """
+    解析工单日期，无法解析时返回 None
+    - day_first: 年在后且月日有歧义时是否日在前，默认取配置 DATE_DAY_FIRST（没有应用上下文时为 False）
+    - 结果按 (输入, day_first) 缓存；datetime 不可变，可以安全共享
+    """
+    if not date_str:
+        return None
+    if day_first is None:
+        day_first = has_app_context() and current_app.config.get('DATE_DAY_FIRST', False)
+    return _parse(str(date_str).strip(), bool(day_first))
+
+
+def cache_info():
+    return _parse.cache_info()
+
+
+def clear_cache():
+    _parse.cache_clear()
@@ -0,0 +1,69 @@
+import os
+from sqlalchemy import event
+
+# SQLite 连接参数方案，由 DB_PROFILE 选择
+# - default: 保持 SQLite 默认行为（回滚日志，写事务期间读者被阻塞）
+# - production: WAL 日志，读写互不阻塞；写锁冲突时等待 busy_timeout 而不是立即报 "database is locked"
+SQLITE_PROFILES = {
+    'default': {
+        'pragmas': {},
+        'pool_size': 5,
+        'max_overflow': 10,
+    },
+    'production': {
+        'pragmas': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',  # WAL 下只在检查点时 fsync，掉电最多丢失最近提交，不会损坏数据库
+            'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000),  # 毫秒
+            'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024),
+            'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE') or -64000),  # 负数单位为 KiB
+            'temp_store': 'MEMORY',
+        },
+        # 每个工作进程复用的连接数；SQLite 同一时刻只有一个写者，连接不宜过多
+        'pool_size': int(os.environ.get('DB_POOL_SIZE') or 8),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW') or 4),
+    },
+}
+
+
+def get_profile(name):
+    try:
+        return SQLITE_PROFILES[name]
+    except KeyError:
+        raise ValueError(f'未知的数据库配置方案: {name}，可选 {", ".join(SQLITE_PROFILES)}')
+
+
+def is_file_sqlite(uri):
+    return uri.startswith('sqlite') and ':memory:' not in uri and uri.rstrip('/') != 'sqlite:'
+
+
+def engine_options(uri, profile_name):
+    """生成 SQLALCHEMY_ENGINE_OPTIONS；内存库使用单连接池，不设置连接池大小"""
+    profile = get_profile(profile_name)
+    if not is_file_sqlite(uri):
+        return {}
+    options = {
+        'pool_size': profile['pool_size'],
+        'max_overflow': profile['max_overflow'],
+    }
+    busy_timeout = profile['pragmas'].get('busy_timeout')
+    if busy_timeout:
+        # pysqlite 自身的等待时间（秒），与 PRAGMA busy_timeout 保持一致
+        options['connect_args'] = {'timeout': busy_timeout / 1000}
+    return options
+
+
+def apply_pragmas(engine, profile_name):
+    """在引擎的每个新连接上执行方案中的 PRAGMA"""
+    pragmas = get_profile(profile_name)['pragmas']
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
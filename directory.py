@@ -0,0 +1,75 @@
+import threading
+from flask import current_app, g
+from models import CacheVersion, User, Department
+
+# 用户 / 部门目录缓存：下拉框选项在进程内只构建一次
+# cache_version 表里的版本号由后台修改用户、部门时递增，其他工作进程在下个请求里发现版本变化后重建
+# 缓存按应用存放在 app.extensions['directory']：版本号只在各自的数据库内有意义，
+# 同一进程内的多个应用（如测试）共用一份会拿到别的库的选项
+DIRECTORY = 'directory'
+
+
+class _DirectoryCache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+
+
+def init_app(app):
+    app.extensions['directory'] = _DirectoryCache()
+
+
+def _build(version):
+    users = User.query.order_by(User.realname).all()
+    departments = Department.query.order_by(Department.name).all()
+    dept_names = {d.id: d.name for d in departments}
+    # 与原先 join(Department) 一致：未分配部门的用户不出现在带部门的选项里
+    dept_users = sorted((u for u in users if u.department_id in dept_names),
+                        key=lambda u: (dept_names[u.department_id], u.realname))
+    return {
+        'version': version,
+        'users': [(u.id, u.realname) for u in users],
+        'users_by_department': [(u.id, f"{dept_names[u.department_id]} - {u.realname}") for u in dept_users],
+        'departments': [(d.id, d.name) for d in departments],
+    }
+
+
+def _directory():
+    """每个请求只核对一次版本号，版本未变时直接复用进程内缓存"""
+    if 'directory' in g:
+        return g.directory
+    cache = current_app.extensions['directory']
+    version = CacheVersion.current(DIRECTORY)
+    cached = cache.data
+    if cached is None or cached['version'] != version:
+        with cache.lock:
+            cached = cache.data
+            if cached is None or cached['version'] != version:
+                cached = cache.data = _build(version)
+    g.directory = cached
+    return cached
+
+
+def user_choices():
+    """(id, 姓名)，按姓名排序"""
+    return _directory()['users']
+
+
+def user_department_choices():
+    """(id, '部门 - 姓名')，按部门、姓名排序"""
+    return _directory()['users_by_department']
+
+
+def department_choices():
+    """(id, 部门名称)"""
+    return _directory()['departments']
+
+
+def invalidate():
+    """
+    在当前事务内递增版本号，随用户 / 部门的修改一起提交
+    其他进程在下一个请求核对版本号时重建缓存
+    """
+    CacheVersion.bump(DIRECTORY)
+    current_app.extensions['directory'].data = None
+    g.pop('directory', None)
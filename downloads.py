@@ -0,0 +1,77 @@
+import os
+from urllib.parse import quote
+from flask import current_app, request, abort
+from werkzeug.utils import send_file
+from extensions import db
+from models import OrderStage, ArchivedOrderStage
+from storage import attachment_path, preview_path
+
+# 附件下载：
+# - 强 ETag 取自上传时计算的 SHA-256，Last-Modified 取上传时间，命中时返回 304
+# - 支持 Range 请求（断点续传、PDF 分段加载）
+# - 附件文件名带时间戳，内容不会变化，可以长期缓存
+# - DOWNLOAD_OFFLOAD 为 'x-sendfile' 或 'x-accel' 时只返回头部，由前端服务器发送文件
+
+
+def can_download(attachment, user):
+    """管理员、业务员、当前负责人以及参与过该工单的人可以下载"""
+    if user.is_admin():
+        return True
+    order = attachment.order_stage.work_order
+    if user.id in (order.salesperson_id, order.current_assignee_id):
+        return True
+    stage = ArchivedOrderStage if order.is_archived else OrderStage
+    return db.session.query(stage.id).filter_by(order_id=order.id, assignee_id=user.id).first() is not None
+
+
+def send_attachment(attachment):
+    config = current_app.config
+    path = os.path.abspath(attachment_path(attachment))
+    offload = config['DOWNLOAD_OFFLOAD']
+
+    environ = request.environ
+    if offload:
+        # 分段请求交给前端服务器处理
+        environ = dict(environ)
+        environ.pop('HTTP_RANGE', None)
+
+    response = send_file(
+        path,
+        environ,
+        download_name=attachment.filename,
+        conditional=True,
+        etag=attachment.sha256 or True,
+        last_modified=attachment.upload_time,
+        max_age=config['DOWNLOAD_MAX_AGE'],
+        use_x_sendfile=bool(offload),
+        response_class=current_app.response_class,
+    )
+    # 附件需要登录才能访问，只允许浏览器缓存，不允许共享缓存
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+
+    if offload == 'x-accel' and 'X-Sendfile' in response.headers:
+        del response.headers['X-Sendfile']
+        relative = os.path.relpath(path, os.path.abspath(config['UPLOAD_FOLDER'])).replace(os.sep, '/')
+        response.headers['X-Accel-Redirect'] = config['X_ACCEL_REDIRECT_PREFIX'].rstrip('/') + '/' + quote(relative)
+    return response
+
+
+def send_preview(attachment):
+    """图片附件的缩略图；尚未生成（任务未执行或未安装 Pillow）时 404，页面回退为文件名链接"""
+    path = os.path.abspath(preview_path(attachment.sha256)) if attachment.sha256 else None
+    if not path or not os.path.exists(path):
+        abort(404)
+    response = send_file(
+        path,
+        request.environ,
+        mimetype='image/jpeg',
+        conditional=True,
+        etag=attachment.sha256 + '-preview',
+        max_age=current_app.config['DOWNLOAD_MAX_AGE'],
+        response_class=current_app.response_class,
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
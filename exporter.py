@@ -0,0 +1,169 @@
+import csv
+import heapq
+import io
+import sys
+import tempfile
+from datetime import datetime
+from itertools import islice
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, func
+from sqlalchemy.orm import aliased
+from extensions import db
+from models import WorkOrder, OrderStage, Attachment, User, ArchivedWorkOrder, ArchivedOrderStage, ArchivedAttachment
+
+# 导出工单及流转记录：每个环节一行，附带工单信息、负责人、历时、备注和附件名
+# 查询结果按 EXPORT_CHUNK_SIZE 分块从游标取出，逐块写出，内存占用与导出行数无关
+# 在线表和归档表各一个按 (下单日期, 工单 id) 有序的游标，按同一顺序归并输出
+
+HEADERS = ('派工单号', '下单日期', '数量', '交货期', '业务员', '当前环节',
+           '环节', '负责人', '开始时间', '结束时间', '历时(小时)', '备注', '附件')
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+# (工单, 环节, 附件)：在线表与归档表
+TIERS = (
+    (WorkOrder, OrderStage, Attachment),
+    (ArchivedWorkOrder, ArchivedOrderStage, ArchivedAttachment),
+)
+
+
+def export_query(conditions=(), tier=TIERS[0]):
+    """
+    一层工单与流转记录的联表查询；附件名在库内用 group_concat 合并，不逐环节加载
+    末尾两列为工单 id 和环节 id，只用于两层归并排序，不输出
+    """
+    order, stage, attachment = tier
+    salesperson = aliased(User)
+    assignee = aliased(User)
+    attachment_names = (select(func.group_concat(attachment.filename, '; '))
+                        .where(attachment.stage_id == stage.id)
+                        .scalar_subquery())
+    return (select(order.order_number, order.order_date, order.quantity, order.delivery_date,
+                   salesperson.realname, order.current_stage,
+                   stage.stage_name, assignee.realname, stage.start_time, stage.end_time,
+                   stage.duration, stage.comments, attachment_names, order.id, stage.id)
+            .outerjoin(salesperson, salesperson.id == order.salesperson_id)
+            .join(stage, stage.order_id == order.id)
+            .outerjoin(assignee, assignee.id == stage.assignee_id)
+            .where(*conditions)
+            # 外层沿 (下单日期, id) 索引扫描，每张工单的环节沿 (order_id, start_time) 索引取出
+            .order_by(order.order_date, order.id, stage.start_time, stage.id))
+
+
+def _sort_key(row):
+    # 未开始的环节没有开始时间，排在最前
+    return row[1], row[13], row[8] or datetime.min, row[14]
+
+
+def iter_chunks(conditions=(), archived_conditions=(), chunk_size=None):
+    """按块产出两层合并后的导出行（tuple 列表），历时换算为小时"""
+    chunk_size = chunk_size or current_app.config['EXPORT_CHUNK_SIZE']
+    results = [db.session.execute(export_query(tier_conditions, tier), execution_options={'yield_per': chunk_size})
+               for tier_conditions, tier in zip((conditions, archived_conditions), TIERS)]
+    rows = heapq.merge(*results, key=_sort_key)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        yield [row[:10] + (None if row[10] is None else round(row[10] / 3600, 2),) + row[11:13]
+               for row in chunk]
+
+
+def _format_cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M')
+    return value
+
+
+def iter_csv(chunks):
+    """逐块生成 CSV 文本；带 BOM，Excel 直接打开不乱码"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(HEADERS)
+    for chunk in chunks:
+        writer.writerows([_format_cell(value) for value in row] for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_xlsx(chunks, block_size=64 * 1024):
+    """
+    openpyxl 的 write_only 工作簿逐行写入磁盘上的临时 XML，再打包到临时文件
+    XLSX 是 zip 格式，必须整体写完才能输出，之后按块读出
+    """
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ValueError('导出 XLSX 需要安装 openpyxl')
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('工单')
+    sheet.append(HEADERS)
+    for chunk in chunks:
+        for row in chunk:
+            sheet.append(row)
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
+
+
+def generate(fmt, conditions=(), archived_conditions=(), chunk_size=None):
+    """按格式返回输出块的生成器；conditions / archived_conditions 分别是在线表和归档表的筛选条件"""
+    if fmt not in FORMATS:
+        raise ValueError(f'不支持的导出格式: {fmt}')
+    chunks = iter_chunks(conditions, archived_conditions, chunk_size)
+    return iter_csv(chunks) if fmt == 'csv' else iter_xlsx(chunks)
+
+
+def export_filename(fmt):
+    return f"orders_{datetime.now().strftime('%Y%m%d%H%M%S')}.{fmt}"
+
+
+@click.command('export-orders')
+@click.option('--format', 'fmt', type=click.Choice(sorted(FORMATS)), default='csv', show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), default=None,
+              help='输出文件，默认按格式生成文件名；CSV 可用 - 输出到标准输出')
+@click.option('--stage', default=None, help='只导出当前处于该环节的工单')
+@click.option('--delivery-from', type=click.DateTime(['%Y-%m-%d']), default=None, help='交货期起')
+@click.option('--delivery-to', type=click.DateTime(['%Y-%m-%d']), default=None, help='交货期止（含当天）')
+@click.option('--chunk-size', type=int, default=None, help='每次从数据库取出的行数')
+@with_appcontext
+def export_orders_command(fmt, output, stage, delivery_from, delivery_to, chunk_size):
+    """导出工单及流转记录到 CSV / XLSX"""
+    filters = dict(stage=stage,
+                   delivery_from=delivery_from and delivery_from.date(),
+                   delivery_to=delivery_to and delivery_to.date())
+    conditions = WorkOrder.filter_conditions(**filters)
+    archived_conditions = ArchivedWorkOrder.filter_conditions(**filters)
+    output = output or export_filename(fmt)
+    if output == '-':
+        if fmt != 'csv':
+            raise click.ClickException('只有 CSV 可以输出到标准输出')
+        for text in generate(fmt, conditions, archived_conditions, chunk_size):
+            sys.stdout.write(text)
+        return
+    if fmt == 'csv':
+        with open(output, 'w', encoding='utf-8', newline='') as f:
+            for text in generate(fmt, conditions, archived_conditions, chunk_size):
+                f.write(text)
+    else:
+        with open(output, 'wb') as f:
+            for block in generate(fmt, conditions, archived_conditions, chunk_size):
+                f.write(block)
+    click.echo(f'已导出到 {output}')
@@ -1,9 +1,23 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, IntegerField, SubmitField, FileField, PasswordField, SelectField, BooleanField, TextAreaField
-from wtforms.validators import DataRequired, NumberRange, EqualTo, ValidationError
+from wtforms import StringField, IntegerField, SubmitField, FileField, PasswordField, SelectField, BooleanField, TextAreaField, DateField, HiddenField
+from wtforms.widgets import HiddenInput
+from wtforms.validators import DataRequired, NumberRange, EqualTo, ValidationError, Optional
 from datetime import datetime
-from flask_wtf.file import FileAllowed
+from flask_wtf.file import FileAllowed, FileRequired
 from models import User
+import directory
+import submissions
+from analytics import GROUPS, PERIODS
+
+# 可指派的流转环节
+NEXT_STAGE_CHOICES = [
+    ('计划', '计划'),
+    ('技术部', '技术部'),
+    ('采购部', '采购部'),
+    ('宁泰公司', '宁泰公司'),
+    ('鑫泽公司', '鑫泽公司'),
+    ('鑫波公司', '鑫波公司')
+]
 
 class LoginForm(FlaskForm):
     username = StringField('用户名', validators=[DataRequired()])
@@ -37,20 +51,22 @@ class DepartmentForm(FlaskForm):
     description = StringField('描述')
     submit = SubmitField('保存')
 
-class CreateOrderForm(FlaskForm):
+# 修改工单的表单：每次渲染带一个新的提交键，重复提交（双击、刷新重发）据此识别
+class IdempotentForm(FlaskForm):
+    idempotency_key = HiddenField()
+
+    def __init__(self, *args, **kwargs):
+        super(IdempotentForm, self).__init__(*args, **kwargs)
+        if not self.idempotency_key.data:
+            self.idempotency_key.data = submissions.new_key()
+
+class CreateOrderForm(IdempotentForm):
     order_number = StringField('派工单号', validators=[DataRequired()])
     order_date = StringField('下单日期', validators=[DataRequired()])
     quantity = IntegerField('数量', validators=[DataRequired(), NumberRange(min=1)])
     delivery_date = StringField('交货期', validators=[DataRequired()])
     
-    next_stage_name = SelectField('下一环节名称', choices=[
-        ('计划', '计划'),
-        ('技术部', '技术部'),
-        ('采购部', '采购部'),
-        ('宁泰公司', '宁泰公司'),
-        ('鑫泽公司', '鑫泽公司'),
-        ('鑫波公司', '鑫波公司')
-    ], validators=[DataRequired()])
+    next_stage_name = SelectField('下一环节名称', choices=NEXT_STAGE_CHOICES, validators=[DataRequired()])
     
     next_assignee_id = SelectField('下一环节负责人', coerce=int)
     
@@ -58,24 +74,20 @@ class CreateOrderForm(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super(CreateOrderForm, self).__init__(*args, **kwargs)
-        self.next_assignee_id.choices = [(u.id, u.realname) for u in User.query.order_by(User.realname).all()]
+        self.next_assignee_id.choices = directory.user_choices()
         
-class AssignOrderForm(FlaskForm):
-    stage_name = SelectField('环节名称', choices=[
-        ('计划', '计划'),
-        ('技术部', '技术部'),
-        ('采购部', '采购部'),
-        ('宁泰公司', '宁泰公司'),
-        ('鑫泽公司', '鑫泽公司'),
-        ('鑫波公司', '鑫波公司')
-    ], validators=[DataRequired()])
+class AssignOrderForm(IdempotentForm):
+    # 打开页面时工单的版本号，提交时不一致说明期间已被他人修改
+    version = IntegerField(widget=HiddenInput(), validators=[Optional()])
+    stage_name = SelectField('环节名称', choices=NEXT_STAGE_CHOICES, validators=[DataRequired()])
     
     assignee_id = SelectField('负责人', coerce=int, choices=[])
     attachment = FileField('附件', validators=[FileAllowed(['pdf', 'png', 'jpg', 'jpeg', 'doc', 'docx'], '只允许特定文件类型')])
     submit = SubmitField('指派工单')
 
 # 添加处理工单表单
-class ProcessOrderForm(FlaskForm):
+class ProcessOrderForm(IdempotentForm):
+    version = IntegerField(widget=HiddenInput(), validators=[Optional()])
     comments = TextAreaField('进度备注', validators=[DataRequired()])
     
     # 下一环节信息
@@ -98,4 +110,44 @@ class ProcessOrderForm(FlaskForm):
     
     def __init__(self, *args, **kwargs):
         super(ProcessOrderForm, self).__init__(*args, **kwargs)
-        self.next_assignee_id.choices = [(u.id, u.realname) for u in User.query.order_by(User.realname).all()]
+        self.next_assignee_id.choices = directory.user_department_choices()
+
+
+# 工单列表筛选表单（GET 查询参数，不需要 CSRF）
+class OrderFilterForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    stage = SelectField('当前环节', choices=[
+        ('', '全部环节'),
+        ('创建工单', '创建工单'),
+        ('计划', '计划'),
+        ('技术部', '技术部'),
+        ('采购部', '采购部'),
+        ('宁泰公司', '宁泰公司'),
+        ('鑫泽公司', '鑫泽公司'),
+        ('鑫波公司', '鑫波公司'),
+        ('完成', '完成')
+    ], default='')
+
+    assignee_id = SelectField('当前负责人', coerce=int, default=0)
+    salesperson_id = SelectField('业务员', coerce=int, default=0)
+    delivery_from = DateField('交货期从', validators=[Optional()])
+    delivery_to = DateField('交货期至', validators=[Optional()])
+
+    submit = SubmitField('筛选')
+
+class ReportFilterForm(FlaskForm):
+    class Meta:
+        csrf = False
+
+    date_from = DateField('结束日期从', validators=[Optional()])
+    date_to = DateField('结束日期至', validators=[Optional()])
+    stage_name = SelectField('环节', choices=[('', '全部环节')] + NEXT_STAGE_CHOICES, default='')
+    group = SelectField('分组', choices=list(GROUPS.items()), default='stage')
+    period = SelectField('周期', choices=[(k, label) for k, (label, _) in PERIODS.items()], default='all')
+    submit = SubmitField('查询')
+
+class ImportOrdersForm(FlaskForm):
+    file = FileField('导入文件', validators=[FileRequired('请选择文件'), FileAllowed(['csv', 'xlsx'], '只支持 CSV 或 XLSX 文件')])
+    submit = SubmitField('导入')
@@ -0,0 +1,278 @@
+import csv
+import io
+import os
+from collections import namedtuple
+from datetime import datetime
+from itertools import islice
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, insert, update
+from extensions import db
+from models import WorkOrder, OrderStage, User
+from dates import parse_date
+from forms import NEXT_STAGE_CHOICES
+import stats
+import changefeed
+import archive
+import tasks
+
+# 批量导入工单：逐行流式解析 CSV / XLSX，按批校验并用 executemany 插入
+# 每批一个事务；某行出错只记录到报告，不影响其他行
+
+# 表头（中英文均可）到字段的映射
+COLUMNS = {
+    'order_number': 'order_number', '派工单号': 'order_number',
+    'order_date': 'order_date', '下单日期': 'order_date',
+    'quantity': 'quantity', '数量': 'quantity',
+    'delivery_date': 'delivery_date', '交货期': 'delivery_date',
+    'salesperson': 'salesperson', '业务员': 'salesperson',
+    'next_stage_name': 'next_stage_name', '下一环节': 'next_stage_name', '下一环节名称': 'next_stage_name',
+    'next_assignee': 'next_assignee', '下一环节负责人': 'next_assignee',
+}
+REQUIRED = ('order_number', 'order_date', 'quantity', 'delivery_date')
+STAGE_NAMES = {name for name, _ in NEXT_STAGE_CHOICES}
+
+RowError = namedtuple('RowError', 'row order_number message')
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = []
+
+    def error(self, row, order_number, message):
+        self.errors.append(RowError(row, order_number or '', message))
+
+
+def iter_csv(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        return
+    yield header
+    yield from reader
+
+
+def iter_xlsx(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError('导入 XLSX 需要安装 openpyxl')
+    # read_only 模式按行读取，不把整个工作表载入内存
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ['' if value is None else value for value in row]
+    finally:
+        workbook.close()
+
+
+def iter_rows(stream, filename):
+    """按文件扩展名逐行产出 (行号, 字段字典)，行号从表头下一行的 2 开始"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    if ext == '.csv':
+        rows = iter_csv(stream)
+    elif ext == '.xlsx':
+        rows = iter_xlsx(stream)
+    else:
+        raise ValueError('只支持 CSV 或 XLSX 文件')
+
+    header = next(rows, None)
+    if header is None:
+        return
+    fields = [COLUMNS.get(str(name).strip()) for name in header]
+    missing = [name for name in REQUIRED if name not in fields]
+    if missing:
+        raise ValueError('缺少列: ' + ', '.join(missing))
+    for line_no, values in enumerate(rows, start=2):
+        if not any(str(v).strip() for v in values):
+            continue
+        yield line_no, {field: value for field, value in zip(fields, values) if field}
+
+
+def _to_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    return parse_date(str(value).strip())
+
+
+def _validate(line_no, raw, usernames, default_salesperson_id, result):
+    """校验并转换一行，失败时记录错误并返回 None"""
+    order_number = str(raw.get('order_number') or '').strip()
+    if not order_number:
+        result.error(line_no, '', '派工单号不能为空')
+        return None
+    order_date = _to_datetime(raw.get('order_date') or '')
+    if not order_date:
+        result.error(line_no, order_number, '下单日期格式无效')
+        return None
+    delivery_date = _to_datetime(raw.get('delivery_date') or '')
+    if not delivery_date:
+        result.error(line_no, order_number, '交货期格式无效')
+        return None
+    try:
+        quantity = int(str(raw.get('quantity')).strip())
+    except ValueError:
+        quantity = 0
+    if quantity < 1:
+        result.error(line_no, order_number, '数量必须为正整数')
+        return None
+
+    salesperson = str(raw.get('salesperson') or '').strip()
+    salesperson_id = usernames.get(salesperson) if salesperson else default_salesperson_id
+    if not salesperson_id:
+        result.error(line_no, order_number, f'业务员不存在: {salesperson}')
+        return None
+
+    next_stage_name = str(raw.get('next_stage_name') or '').strip()
+    next_assignee = str(raw.get('next_assignee') or '').strip()
+    next_assignee_id = None
+    if next_stage_name or next_assignee:
+        if next_stage_name not in STAGE_NAMES:
+            result.error(line_no, order_number, f'下一环节无效: {next_stage_name}')
+            return None
+        next_assignee_id = usernames.get(next_assignee)
+        if not next_assignee_id:
+            result.error(line_no, order_number, f'下一环节负责人不存在: {next_assignee}')
+            return None
+
+    return {
+        'line_no': line_no,
+        'order_number': order_number,
+        'order_date': order_date,
+        'delivery_date': delivery_date,
+        'quantity': quantity,
+        'salesperson_id': salesperson_id,
+        'next_stage_name': next_stage_name,
+        'next_assignee_id': next_assignee_id,
+    }
+
+
+def _insert_batch(batch, creator_name):
+    """一个事务内插入一批工单及其初始环节，返回插入数"""
+    now = datetime.utcnow()
+    order_rows = [{
+        'order_number': r['order_number'],
+        'order_date': r['order_date'],
+        'quantity': r['quantity'],
+        'delivery_date': r['delivery_date'],
+        'salesperson_id': r['salesperson_id'],
+        'current_assignee_id': r['next_assignee_id'] or r['salesperson_id'],
+        'total_duration': int((r['delivery_date'] - r['order_date']).total_seconds()),
+        'current_stage': r['next_stage_name'] or '创建工单',
+        'created_at': now,
+    } for r in batch]
+    order_ids = {number: order_id for order_id, number in db.session.execute(
+        insert(WorkOrder).returning(WorkOrder.id, WorkOrder.order_number), order_rows)}
+
+    # 与 create_order 一致：有下一环节时创建环节即结束
+    stage_rows = []
+    for r in batch:
+        has_next = bool(r['next_stage_name'])
+        stage_rows.append({
+            'order_id': order_ids[r['order_number']],
+            'stage_name': '创建工单',
+            'start_time': now,
+            'end_time': now if has_next else None,
+            'duration': 0 if has_next else None,
+            'assignee_id': r['salesperson_id'],
+            'comments': '由 ' + creator_name + ' 批量导入',
+        })
+        if has_next:
+            stage_rows.append({
+                'order_id': order_ids[r['order_number']],
+                'stage_name': r['next_stage_name'],
+                'start_time': now,
+                'end_time': None,
+                'duration': None,
+                'assignee_id': r['next_assignee_id'],
+                'comments': None,
+            })
+    stages = db.session.execute(
+        insert(OrderStage).returning(OrderStage.id, OrderStage.order_id, OrderStage.end_time,
+                                     sort_by_parameter_order=True),
+        stage_rows).all()
+    active = [{'order_id': order_id, 'active_stage_id': stage_id}
+              for stage_id, order_id, end_time in stages if end_time is None]
+    # 工单刚在本事务中插入，按主键回填活跃环节即可，不经过 ORM 的版本号检查
+    db.session.execute(update(WorkOrder.__table__).where(WorkOrder.__table__.c.id == bindparam('order_id')), active)
+    # Core 批量插入不触发 OrderStage 的 after_insert 事件，新环节的通知在这里登记
+    tasks.enqueue_many('notify_assignee', [{'stage_id': row['active_stage_id']} for row in active])
+    stats.incr(stats.ONGOING, len(batch))
+    changefeed.record_created([(order_ids[r['order_number']], r['next_stage_name'] or '创建工单',
+                                r['next_assignee_id'] or r['salesperson_id']) for r in batch])
+    db.session.commit()
+    return len(batch)
+
+
+def import_orders(stream, filename, creator, batch_size=None):
+    """
+    导入工单，返回 ImportResult
+    - creator: 执行导入的用户，文件中没有业务员列时作为业务员
+    - 派工单号与库中已有的工单（含已归档）按批用 IN 查询比对，文件内重复也会报错
+    """
+    batch_size = batch_size or current_app.config['IMPORT_BATCH_SIZE']
+    result = ImportResult()
+    usernames = dict(db.session.query(User.username, User.id))
+    seen = set()
+    rows = iter_rows(stream, filename)
+
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        candidates = []
+        for line_no, raw in chunk:
+            row = _validate(line_no, raw, usernames, creator.id, result)
+            if row is None:
+                continue
+            if row['order_number'] in seen:
+                result.error(line_no, row['order_number'], '文件中派工单号重复')
+                continue
+            seen.add(row['order_number'])
+            candidates.append(row)
+        if not candidates:
+            continue
+
+        numbers = [r['order_number'] for r in candidates]
+        existing = {number for (number,) in db.session.query(WorkOrder.order_number)
+                    .filter(WorkOrder.order_number.in_(numbers))}
+        existing |= archive.archived_order_numbers(numbers)
+        batch = []
+        for row in candidates:
+            if row['order_number'] in existing:
+                result.error(row['line_no'], row['order_number'], '派工单号已存在')
+            else:
+                batch.append(row)
+        if not batch:
+            continue
+        try:
+            result.created += _insert_batch(batch, creator.realname)
+        except Exception as e:
+            db.session.rollback()
+            for row in batch:
+                result.error(row['line_no'], row['order_number'], f'写入失败: {e}')
+    result.errors.sort(key=lambda e: e.row)
+    return result
+
+
+@click.command('import-orders')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--username', default='admin', show_default=True, help='导入人，文件中没有业务员列时作为业务员')
+@click.option('--batch-size', type=int, default=None, help='每批插入的行数')
+@with_appcontext
+def import_orders_command(path, username, batch_size):
+    """从 CSV / XLSX 文件批量导入工单"""
+    creator = User.query.filter_by(username=username).first()
+    if creator is None:
+        raise click.ClickException(f'用户不存在: {username}')
+    with open(path, 'rb') as f:
+        try:
+            result = import_orders(f, path, creator, batch_size)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    click.echo(f'成功导入 {result.created} 张工单，失败 {len(result.errors)} 行')
+    for error in result.errors:
+        click.echo(f'  第 {error.row} 行 {error.order_number}: {error.message}')
@@ -0,0 +1,345 @@
+import atexit
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from flask import Response, abort, current_app, g, has_app_context, request
+from flask.signals import before_render_template, template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+from extensions import db
+from usercache import user_cache
+
+# 请求级性能埋点
+# - before_request / after_request 计时，引擎的 before/after_cursor_execute 事件统计 SQL 条数和耗时，
+#   模板渲染信号统计 render_template 的耗时（包含模板里触发的懒加载 SQL）
+# - 每个响应带 Server-Timing 头（db / tpl / app / total），浏览器开发者工具的 Timing 面板可以直接看到
+# - 按端点累计，/metrics 以 Prometheus 文本格式输出，同时保留每个端点最慢的几条 SQL
+# - 流式响应（导出、SSE）只计到返回响应对象为止，之后生成内容的时间不计入
+# - 指标只在本进程内累计，多进程部署时由 Prometheus 分别抓取各进程
+# - 可选的采样分析器：对 PROFILE_ENDPOINTS 中的端点，后台线程每 PROFILE_INTERVAL 秒采一次调用栈，
+#   按 folded 格式（"帧;帧;帧 次数"）写入 PROFILE_FOLDER，可直接交给 flamegraph.pl / speedscope
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = 'workorder'
+_G_KEY = '_instrumentation'
+_WHITESPACE = re.compile(r'\s+')
+
+
+class RequestTiming:
+    __slots__ = ('started', 'queries', 'sql_seconds', 'template_seconds', 'statements', '_template_started')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.statements = []
+        self._template_started = []
+
+
+class EndpointStats:
+    __slots__ = ('requests', 'statuses', 'seconds', 'buckets', 'queries', 'sql_seconds', 'template_seconds',
+                 'slowest')
+
+    def __init__(self):
+        self.requests = 0
+        self.statuses = Counter()
+        self.seconds = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        # 语句 -> 最长耗时
+        self.slowest = {}
+
+
+def _normalize(statement):
+    return _WHITESPACE.sub(' ', statement).strip()[:300]
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+
+class AppInstrumentation:
+    """单个应用的埋点状态：按端点的累计指标、采样分析器，以及挂在该应用和它的引擎上的钩子"""
+
+    def __init__(self, app):
+        self.slow_statements = app.config.get('INSTRUMENTATION_SLOW_STATEMENTS', 5)
+        self.server_timing = app.config.get('INSTRUMENTATION_SERVER_TIMING', True)
+        self._stats = defaultdict(EndpointStats)
+        self._lock = threading.Lock()
+        self.profiler = None
+        if not app.config.get('INSTRUMENTATION_ENABLED', True):
+            return
+
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+        endpoints = app.config.get('PROFILE_ENDPOINTS')
+        if endpoints:
+            self.profiler = SamplingProfiler(endpoints, app.config['PROFILE_INTERVAL'],
+                                             os.path.join(app.root_path, app.config['PROFILE_FOLDER']),
+                                             app.config['PROFILE_FLUSH_INTERVAL'])
+
+    # ---------- 采集 ----------
+
+    @staticmethod
+    def _current():
+        return g.get(_G_KEY) if has_app_context() else None
+
+    def _before_request(self):
+        g.setdefault(_G_KEY, RequestTiming())
+        if self.profiler:
+            self.profiler.enter(request.endpoint)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['_instrumentation_started'] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop('_instrumentation_started', None)
+        timing = self._current()
+        if timing is None or started is None:
+            return
+        elapsed = time.perf_counter() - started
+        timing.queries += 1
+        timing.sql_seconds += elapsed
+        timing.statements.append((elapsed, statement))
+
+    def _before_render(self, app, template, context, **extra):
+        timing = self._current()
+        if timing is not None:
+            timing._template_started.append(time.perf_counter())
+
+    def _after_render(self, app, template, context, **extra):
+        timing = self._current()
+        if timing is not None and timing._template_started:
+            timing.template_seconds += time.perf_counter() - timing._template_started.pop()
+
+    def _after_request(self, response):
+        timing = g.pop(_G_KEY, None)
+        if self.profiler:
+            self.profiler.leave()
+        if timing is None:
+            return response
+        total = time.perf_counter() - timing.started
+        endpoint = request.endpoint or '<unmatched>'
+        if endpoint == 'static':
+            return response
+        self._record(endpoint, response.status_code, total, timing)
+        if self.server_timing:
+            other = max(total - timing.sql_seconds - timing.template_seconds, 0.0)
+            response.headers['Server-Timing'] = ', '.join((
+                f'db;dur={timing.sql_seconds * 1000:.1f};desc="{timing.queries} queries"',
+                f'tpl;dur={timing.template_seconds * 1000:.1f}',
+                f'app;dur={other * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}',
+            ))
+        return response
+
+    def _record(self, endpoint, status, total, timing):
+        slowest = sorted(timing.statements, key=lambda s: s[0], reverse=True)[:self.slow_statements]
+        with self._lock:
+            stats = self._stats[endpoint]
+            stats.requests += 1
+            stats.statuses[status] += 1
+            stats.seconds += total
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if total <= bound:
+                    stats.buckets[i] += 1
+                    break
+            stats.queries += timing.queries
+            stats.sql_seconds += timing.sql_seconds
+            stats.template_seconds += timing.template_seconds
+            for elapsed, statement in slowest:
+                statement = _normalize(statement)
+                if elapsed > stats.slowest.get(statement, 0.0):
+                    stats.slowest[statement] = elapsed
+            if len(stats.slowest) > self.slow_statements * 4:
+                kept = sorted(stats.slowest.items(), key=lambda item: item[1], reverse=True)[:self.slow_statements]
+                stats.slowest = dict(kept)
+
+    # ---------- 输出 ----------
+
+    def snapshot(self):
+        """{端点: 汇总字典}"""
+        with self._lock:
+            result = {}
+            for endpoint, stats in self._stats.items():
+                slowest = sorted(stats.slowest.items(), key=lambda item: item[1], reverse=True)
+                result[endpoint] = {
+                    'requests': stats.requests,
+                    'statuses': dict(stats.statuses),
+                    'seconds': stats.seconds,
+                    'buckets': list(stats.buckets),
+                    'queries': stats.queries,
+                    'sql_seconds': stats.sql_seconds,
+                    'template_seconds': stats.template_seconds,
+                    'slowest': slowest[:self.slow_statements],
+                }
+            return result
+
+    def prometheus_text(self):
+        p = METRIC_PREFIX
+        lines = [
+            f'# HELP {p}_http_requests_total 按端点和状态码统计的请求数',
+            f'# TYPE {p}_http_requests_total counter',
+        ]
+        snapshot = self.snapshot()
+        for endpoint, s in sorted(snapshot.items()):
+            for status, count in sorted(s['statuses'].items()):
+                lines.append(f'{p}_http_requests_total{{endpoint="{_label(endpoint)}",status="{status}"}} {count}')
+
+        lines += [f'# HELP {p}_http_request_duration_seconds 请求处理耗时（到返回响应对象为止）',
+                  f'# TYPE {p}_http_request_duration_seconds histogram']
+        for endpoint, s in sorted(snapshot.items()):
+            label = f'endpoint="{_label(endpoint)}"'
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS, s['buckets']):
+                cumulative += count
+                lines.append(f'{p}_http_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'{p}_http_request_duration_seconds_bucket{{{label},le="+Inf"}} {s["requests"]}')
+            lines.append(f'{p}_http_request_duration_seconds_sum{{{label}}} {s["seconds"]:.6f}')
+            lines.append(f'{p}_http_request_duration_seconds_count{{{label}}} {s["requests"]}')
+
+        for name, key, kind, help_text in (
+                ('sql_queries_total', 'queries', 'counter', 'SQL 语句数'),
+                ('sql_duration_seconds_total', 'sql_seconds', 'counter', 'SQL 执行耗时'),
+                ('template_render_seconds_total', 'template_seconds', 'counter', '模板渲染耗时（含其中的懒加载）')):
+            lines += [f'# HELP {p}_{name} {help_text}', f'# TYPE {p}_{name} {kind}']
+            for endpoint, s in sorted(snapshot.items()):
+                value = s[key]
+                value = f'{value:.6f}' if isinstance(value, float) else value
+                lines.append(f'{p}_{name}{{endpoint="{_label(endpoint)}"}} {value}')
+
+        lines += [f'# HELP {p}_sql_slowest_seconds 各端点最慢的 SQL 语句及其最长耗时',
+                  f'# TYPE {p}_sql_slowest_seconds gauge']
+        for endpoint, s in sorted(snapshot.items()):
+            for statement, elapsed in s['slowest']:
+                lines.append(f'{p}_sql_slowest_seconds{{endpoint="{_label(endpoint)}",'
+                             f'statement="{_label(statement)}"}} {elapsed:.6f}')
+
+        lines += [f'# HELP {p}_user_cache_total 登录身份缓存命中情况',
+                  f'# TYPE {p}_user_cache_total counter']
+        cache_metrics = user_cache.metrics()
+        for name in ('hits', 'misses', 'evictions', 'invalidations'):
+            lines.append(f'{p}_user_cache_total{{result="{name}"}} {cache_metrics[name]}')
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        """Prometheus 抓取入口：配置了 METRICS_TOKEN 时用 Bearer 令牌，否则仅管理员可访问"""
+        token = current_app.config.get('METRICS_TOKEN')
+        if token:
+            if request.headers.get('Authorization') != f'Bearer {token}':
+                abort(401)
+        elif not (current_user.is_authenticated and current_user.is_admin()):
+            abort(403)
+        return Response(self.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+
+class SamplingProfiler:
+    """
+    对选定端点的请求线程定时采样调用栈
+    - 请求开始时登记线程，结束时注销；采样线程只读取登记了的线程，其他请求没有额外开销
+    - 每个端点累计 {调用栈: 采样次数}，每 flush_interval 秒整体重写 <端点>.folded
+    """
+
+    def __init__(self, endpoints, interval, folder, flush_interval):
+        if isinstance(endpoints, str):
+            endpoints = [e.strip() for e in endpoints.split(',') if e.strip()]
+        self.endpoints = set(endpoints)
+        self.interval = interval
+        self.folder = folder
+        self.flush_interval = flush_interval
+        self._active = {}
+        self._samples = defaultdict(Counter)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def enter(self, endpoint):
+        if endpoint in self.endpoints:
+            self._active[threading.get_ident()] = endpoint
+
+    def leave(self):
+        self._active.pop(threading.get_ident(), None)
+
+    @staticmethod
+    def _stack(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+                         .replace(';', ':'))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            active = dict(self._active)
+            if active:
+                frames = sys._current_frames()
+                with self._lock:
+                    for ident, endpoint in active.items():
+                        frame = frames.get(ident)
+                        if frame is not None:
+                            self._samples[endpoint][self._stack(frame)] += 1
+                            self._dirty = True
+            if time.monotonic() - last_flush >= self.flush_interval:
+                last_flush = time.monotonic()
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            samples = {endpoint: dict(counter) for endpoint, counter in self._samples.items()}
+        os.makedirs(self.folder, exist_ok=True)
+        for endpoint, counter in samples.items():
+            path = os.path.join(self.folder, f'{endpoint}.{os.getpid()}.folded')
+            temp = path + '.part'
+            with open(temp, 'w', encoding='utf-8') as f:
+                for stack, count in sorted(counter.items()):
+                    f.write(f'{stack} {count}\n')
+            os.replace(temp, path)
+
+
+class Instrumentation:
+    """
+    应用级入口：init_app 为每个应用创建独立的 AppInstrumentation，放在 app.extensions['instrumentation']
+    钩子和引擎事件绑定在各自的状态上，同一进程内的多个应用（如测试）各自累计指标，互不覆盖配置
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['instrumentation'] = AppInstrumentation(app)
+
+    @property
+    def state(self):
+        return current_app.extensions['instrumentation']
+
+    def snapshot(self):
+        return self.state.snapshot()
+
+    def prometheus_text(self):
+        return self.state.prometheus_text()
+
+
+instrumentation = Instrumentation()
@@ -0,0 +1,51 @@
+from sqlalchemy.orm import joinedload, selectinload
+from models import WorkOrder, OrderStage, Attachment, User, ArchivedWorkOrder, ArchivedOrderStage, ArchivedAttachment
+
+# 预加载方案：按页面用到的关系一次性取回，避免模板里逐行触发懒加载（N+1 查询）
+# 多对一关系用 joinedload 合并进主查询；一对多集合用 selectinload 以 IN 批量加载
+
+# 工单列表：每行显示业务员和当前负责人，权限判断用到当前活跃环节
+ORDER_LIST_OPTIONS = (
+    joinedload(WorkOrder.salesperson),
+    joinedload(WorkOrder.current_assignee),
+    joinedload(WorkOrder.active_stage),
+)
+
+# 工单详情：流转记录及每个环节的负责人、附件
+ORDER_DETAIL_OPTIONS = ORDER_LIST_OPTIONS + (
+    selectinload(WorkOrder.stages).joinedload(OrderStage.assignee),
+    selectinload(WorkOrder.stages).selectinload(OrderStage.attachments),
+)
+
+# 指派 / 处理工单：工单、当前负责人及当前活跃环节（含环节负责人）
+ORDER_WORKFLOW_OPTIONS = (
+    joinedload(WorkOrder.current_assignee),
+    joinedload(WorkOrder.active_stage).joinedload(OrderStage.assignee),
+)
+
+# 搜索结果：显示当前负责人
+ORDER_SEARCH_OPTIONS = (
+    joinedload(WorkOrder.current_assignee),
+)
+
+# 附件下载：权限检查需要所属工单
+ATTACHMENT_DOWNLOAD_OPTIONS = (
+    joinedload(Attachment.order_stage).joinedload(OrderStage.work_order),
+)
+
+# 归档工单详情 / 附件下载：与在线工单相同的页面，关系结构一致
+ARCHIVED_ORDER_DETAIL_OPTIONS = (
+    joinedload(ArchivedWorkOrder.salesperson),
+    joinedload(ArchivedWorkOrder.current_assignee),
+    selectinload(ArchivedWorkOrder.stages).joinedload(ArchivedOrderStage.assignee),
+    selectinload(ArchivedWorkOrder.stages).selectinload(ArchivedOrderStage.attachments),
+)
+
+ARCHIVED_ATTACHMENT_DOWNLOAD_OPTIONS = (
+    joinedload(ArchivedAttachment.order_stage).joinedload(ArchivedOrderStage.work_order),
+)
+
+# 用户列表：显示所属部门
+USER_LIST_OPTIONS = (
+    joinedload(User.department),
+)
@@ -0,0 +1,50 @@
+"""order full-text search
+
+Revision ID: 2a15dfdb0f8e
+Revises: 49bfe33bb310
+Create Date: 2026-10-18 18:20:11.402315
+
+FTS5 虚拟表和触发器不在模型元数据里，autogenerate 不会生成，语句与 search.py 保持一致
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a15dfdb0f8e'
+down_revision = '49bfe33bb310'
+branch_labels = None
+depends_on = None
+
+SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS order_search USING fts5(order_number, comments, attachments, tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS order_search_order_ai AFTER INSERT ON work_order BEGIN DELETE FROM order_search WHERE rowid = NEW.id; INSERT INTO order_search (rowid, order_number, comments, attachments) SELECT work_order.id, work_order.order_number, (SELECT group_concat(order_stage.comments, ' ') FROM order_stage WHERE order_stage.order_id = work_order.id), (SELECT group_concat(attachment.filename, ' ') FROM attachment  JOIN order_stage ON order_stage.id = attachment.stage_id WHERE order_stage.order_id = work_order.id) FROM work_order WHERE work_order.id = NEW.id; END",
+    "CREATE TRIGGER IF NOT EXISTS order_search_order_au AFTER UPDATE OF order_number ON work_order BEGIN DELETE FROM order_search WHERE rowid = NEW.id; INSERT INTO order_search (rowid, order_number, comments, attachments) SELECT work_order.id, work_order.order_number, (SELECT group_concat(order_stage.comments, ' ') FROM order_stage WHERE order_stage.order_id = work_order.id), (SELECT group_concat(attachment.filename, ' ') FROM attachment  JOIN order_stage ON order_stage.id = attachment.stage_id WHERE order_stage.order_id = work_order.id) FROM work_order WHERE work_order.id = NEW.id; END",
+    'CREATE TRIGGER IF NOT EXISTS order_search_order_ad AFTER DELETE ON work_order BEGIN DELETE FROM order_search WHERE rowid = OLD.id; END',
+    "CREATE TRIGGER IF NOT EXISTS order_search_stage_ai AFTER INSERT ON order_stage BEGIN DELETE FROM order_search WHERE rowid = NEW.order_id; INSERT INTO order_search (rowid, order_number, comments, attachments) SELECT work_order.id, work_order.order_number, (SELECT group_concat(order_stage.comments, ' ') FROM order_stage WHERE order_stage.order_id = work_order.id), (SELECT group_concat(attachment.filename, ' ') FROM attachment  JOIN order_stage ON order_stage.id = attachment.stage_id WHERE order_stage.order_id = work_order.id) FROM work_order WHERE work_order.id = NEW.order_id; END",
+    "CREATE TRIGGER IF NOT EXISTS order_search_stage_au AFTER UPDATE OF comments, order_id ON order_stage BEGIN DELETE FROM order_search WHERE rowid = OLD.order_id; INSERT INTO order_search (rowid, order_number, comments, attachments) SELECT work_order.id, work_order.order_number, (SELECT group_concat(order_stage.comments, ' ') FROM order_stage WHERE order_stage.order_id = work_order.id), (SELECT group_concat(attachment.filename, ' ') FROM attachment  JOIN order_stage ON order_stage.id = attachment.stage_id WHERE order_stage.order_id = work_order.id) FROM work_order WHERE work_order.id = OLD.order_id;DELETE FROM order_search WHERE rowid = NEW.order_id; INSERT INTO order_search (rowid, order_number, comments, attachments) SELECT work_order.id, work_order.order_number, (SELECT group_concat(order_stage.comments, ' ') FROM order_stage WHERE order_stage.order_id = work_order.id), (SELECT group_concat(attachment.filename, ' ') FROM attachment  JOIN order_stage ON order_stage.id = attachment.stage_id WHERE order_stage.order_id = work_order.id) FROM work_order WHERE work_order.id = NEW.order_id; END",
+    "CREATE TRIGGER IF NOT EXISTS order_search_stage_ad AFTER DELETE ON order_stage BEGIN DELETE FROM order_search WHERE rowid = OLD.order_id; INSERT INTO order_search (rowid, order_number, comments, attachments) SELECT work_order.id, work_order.order_number, (SELECT group_concat(order_stage.comments, ' ') FROM order_stage WHERE order_stage.order_id = work_order.id), (SELECT group_concat(attachment.filename, ' ') FROM attachment  JOIN order_stage ON order_stage.id = attachment.stage_id WHERE order_stage.order_id = work_order.id) FROM work_order WHERE work_order.id = OLD.order_id; END",
+    "CREATE TRIGGER IF NOT EXISTS order_search_attachment_ai AFTER INSERT ON attachment BEGIN DELETE FROM order_search WHERE rowid = (SELECT order_id FROM order_stage WHERE id = NEW.stage_id); INSERT INTO order_search (rowid, order_number, comments, attachments) SELECT work_order.id, work_order.order_number, (SELECT group_concat(order_stage.comments, ' ') FROM order_stage WHERE order_stage.order_id = work_order.id), (SELECT group_concat(attachment.filename, ' ') FROM attachment  JOIN order_stage ON order_stage.id = attachment.stage_id WHERE order_stage.order_id = work_order.id) FROM work_order WHERE work_order.id = (SELECT order_id FROM order_stage WHERE id = NEW.stage_id); END",
+    "CREATE TRIGGER IF NOT EXISTS order_search_attachment_ad AFTER DELETE ON attachment BEGIN DELETE FROM order_search WHERE rowid = (SELECT order_id FROM order_stage WHERE id = OLD.stage_id); INSERT INTO order_search (rowid, order_number, comments, attachments) SELECT work_order.id, work_order.order_number, (SELECT group_concat(order_stage.comments, ' ') FROM order_stage WHERE order_stage.order_id = work_order.id), (SELECT group_concat(attachment.filename, ' ') FROM attachment  JOIN order_stage ON order_stage.id = attachment.stage_id WHERE order_stage.order_id = work_order.id) FROM work_order WHERE work_order.id = (SELECT order_id FROM order_stage WHERE id = OLD.stage_id); END",
+]
+
+TRIGGERS = [
+    'order_search_order_ai', 'order_search_order_au', 'order_search_order_ad',
+    'order_search_stage_ai', 'order_search_stage_au', 'order_search_stage_ad',
+    'order_search_attachment_ai', 'order_search_attachment_ad',
+]
+
+
+def upgrade():
+    for statement in SEARCH_DDL:
+        op.execute(statement)
+    # 为已有工单建立索引
+    op.execute(
+        "INSERT INTO order_search (rowid, order_number, comments, attachments) SELECT work_order.id, work_order.order_number, stage_text.comments, attachment_text.names FROM work_order LEFT JOIN (SELECT order_id, group_concat(comments, ' ') AS comments FROM order_stage  GROUP BY order_id) AS stage_text ON stage_text.order_id = work_order.id LEFT JOIN (SELECT order_stage.order_id, group_concat(attachment.filename, ' ') AS names  FROM attachment JOIN order_stage ON order_stage.id = attachment.stage_id  GROUP BY order_stage.order_id) AS attachment_text ON attachment_text.order_id = work_order.id"
+    )
+
+
+def downgrade():
+    for name in TRIGGERS:
+        op.execute(f'DROP TRIGGER IF EXISTS {name}')
+    op.execute('DROP TABLE IF EXISTS order_search')
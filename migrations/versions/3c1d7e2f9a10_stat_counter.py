@@ -0,0 +1,28 @@
+"""stat counter
+
+Revision ID: 3c1d7e2f9a10
+Revises: b529a65a77a4
+Create Date: 2026-10-18 17:49:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1d7e2f9a10'
+down_revision = 'b529a65a77a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stat_counter',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('stat_counter')
@@ -1,7 +1,6 @@
-from datetime import datetime
-from extensions import db
+from datetime import datetime, timedelta
+from extensions import db, bcrypt
 from flask_login import UserMixin
-from flask_bcrypt import generate_password_hash, check_password_hash
 
 class Department(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -26,15 +25,45 @@ class User(db.Model, UserMixin):
     
     @password.setter
     def password(self, password):
-        self.password_hash = generate_password_hash(password).decode('utf-8')
+        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
     
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return bcrypt.check_password_hash(self.password_hash, password)
     
     def is_admin(self):
         return self.role == 'admin'
 
-class WorkOrder(db.Model):
+class OrderQueryMixin:
+    """工单与归档工单共用的查询条件，环节表取各自 stages 关系的目标表"""
+
+    @classmethod
+    def visible_to(cls, user):
+        """用户可见工单的过滤条件：管理员看全部，其他人看自己创建或负责过的"""
+        if user.is_admin():
+            return db.true()
+        stage = cls.stages.property.mapper.class_
+        assigned_order_ids = db.select(stage.order_id).where(stage.assignee_id == user.id)
+        return db.or_(cls.salesperson_id == user.id, cls.id.in_(assigned_order_ids))
+
+    @classmethod
+    def filter_conditions(cls, stage=None, assignee_id=None, salesperson_id=None, delivery_from=None, delivery_to=None):
+        """工单列表 / 导出共用的筛选条件，交货期区间为日期且包含截止当天"""
+        conditions = []
+        if stage:
+            conditions.append(cls.current_stage == stage)
+        if assignee_id:
+            conditions.append(cls.current_assignee_id == assignee_id)
+        if salesperson_id:
+            conditions.append(cls.salesperson_id == salesperson_id)
+        if delivery_from:
+            conditions.append(cls.delivery_date >= datetime.combine(delivery_from, datetime.min.time()))
+        if delivery_to:
+            conditions.append(cls.delivery_date < datetime.combine(delivery_to, datetime.min.time()) + timedelta(days=1))
+        return conditions
+
+class WorkOrder(OrderQueryMixin, db.Model):
+    is_archived = False  # 详情页、下载权限据此区分在线工单和归档工单（ArchivedWorkOrder）
+
     id = db.Column(db.Integer, primary_key=True)
     order_number = db.Column(db.String(50), unique=True, nullable=False)
     order_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -47,14 +76,39 @@ class WorkOrder(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     current_assignee_id = db.Column(db.Integer, db.ForeignKey('user.id'))  # 新增当前负责人字段
     current_assignee = db.relationship('User', foreign_keys=[current_assignee_id])  # 新增关系
+    # 当前活跃环节（冗余指针），由创建、指派、处理工单时同步维护
+    active_stage_id = db.Column(db.Integer, db.ForeignKey('order_stage.id', use_alter=True,
+                                                          name='fk_work_order_active_stage_id'))
+    active_stage = db.relationship('OrderStage', foreign_keys=[active_stage_id], post_update=True)
+    # 行版本：任何 UPDATE（含批量更新）都会刷新，用于 API 的 ETag
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # 交期风险（risk.py 后台评估）：0~1 的风险分、预计完成时间，以及评估时的活跃环节和时间
+    risk_score = db.Column(db.Float)
+    projected_finish = db.Column(db.DateTime)
+    risk_stage_id = db.Column(db.Integer)
+    risk_scored_at = db.Column(db.DateTime)
+    # 乐观并发控制：ORM 的每次 UPDATE 都带 WHERE version = 读取时的值并加一，
+    # 影响 0 行（期间已被他人修改）时提交抛出 StaleDataError
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __mapper_args__ = {'version_id_col': version}
 
     
     stages = db.relationship('OrderStage', 
                              backref='work_order', 
+                             foreign_keys='OrderStage.order_id',
                              lazy=True, 
                              cascade='all, delete-orphan',
                              order_by='OrderStage.start_time')
 
+    __table_args__ = (
+        # 工单列表按 (下单日期, id) 键集分页，以及按业务员 / 环节 / 负责人筛选后排序
+        db.Index('ix_work_order_date_id', 'order_date', 'id'),
+        db.Index('ix_work_order_salesperson_date', 'salesperson_id', 'order_date'),
+        db.Index('ix_work_order_stage_date', 'current_stage', 'order_date'),
+        db.Index('ix_work_order_assignee_date', 'current_assignee_id', 'order_date'),
+    )
+
 class OrderStage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     stage_name = db.Column(db.String(50), nullable=False)
@@ -71,8 +125,174 @@ class OrderStage(db.Model):
                                  lazy=True, 
                                  cascade='all, delete-orphan')
 
+    __table_args__ = (
+        # 工单的流转记录（按开始时间排序）
+        db.Index('ix_order_stage_order_start', 'order_id', 'start_time'),
+        # 当前活跃环节：只索引 end_time 为空的行；唯一约束保证每张工单最多一个未结束环节
+        db.Index('ix_order_stage_open', 'order_id', unique=True, sqlite_where=db.text('end_time IS NULL')),
+        # 用户参与过的工单
+        db.Index('ix_order_stage_assignee_order', 'assignee_id', 'order_id'),
+    )
+
 class Attachment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    filename = db.Column(db.String(100), nullable=False)
+    filename = db.Column(db.String(100), nullable=False, index=True)
     upload_time = db.Column(db.DateTime, default=datetime.utcnow)
-    stage_id = db.Column(db.Integer, db.ForeignKey('order_stage.id'), nullable=False)
+    size = db.Column(db.Integer)  # 字节数
+    sha256 = db.Column(db.String(64), index=True)  # 上传时流式计算的内容摘要，即内容寻址存储的键
+    stage_id = db.Column(db.Integer, db.ForeignKey('order_stage.id'), nullable=False, index=True)
+
+class StatCounter(db.Model):
+    """仪表盘计数器，随工单流转在同一事务内增量维护"""
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class CacheVersion(db.Model):
+    """进程内缓存的版本号，各工作进程比较版本判断本地缓存是否过期"""
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def current(name):
+        return db.session.query(CacheVersion.version).filter_by(name=name).scalar() or 0
+
+    @staticmethod
+    def bump(name):
+        """在当前事务内递增版本号，随业务修改一起提交"""
+        result = db.session.execute(
+            db.update(CacheVersion)
+            .where(CacheVersion.name == name)
+            .values(version=CacheVersion.version + 1)
+        )
+        if result.rowcount == 0:
+            db.session.add(CacheVersion(name=name, version=1))
+
+class AttachmentBlob(db.Model):
+    """内容寻址存储中的文件，相同内容只存一份，ref_count 为引用它的附件数"""
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.Integer, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class StageDurationRollup(db.Model):
+    """环节历时日汇总：按 (结束日期, 环节, 负责人, 部门) 累计已结束环节的历时，由 analytics.py 增量维护"""
+    day = db.Column(db.Date, primary_key=True)
+    stage_name = db.Column(db.String(50), primary_key=True)
+    assignee_id = db.Column(db.Integer, primary_key=True)
+    department_id = db.Column(db.Integer, primary_key=True)  # 环节结束时负责人所在部门，0 表示未分配
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total_seconds = db.Column(db.Integer, nullable=False, default=0)
+    min_seconds = db.Column(db.Integer, nullable=False, default=0)
+    max_seconds = db.Column(db.Integer, nullable=False, default=0)
+
+class StageDurationBucket(db.Model):
+    """环节历时的对数直方图，与日汇总同键；各天、各人的直方图相加后估算分位数"""
+    day = db.Column(db.Date, primary_key=True)
+    stage_name = db.Column(db.String(50), primary_key=True)
+    assignee_id = db.Column(db.Integer, primary_key=True)
+    department_id = db.Column(db.Integer, primary_key=True)
+    bucket = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class Job(db.Model):
+    """后台任务：与触发它的业务修改在同一事务内写入，提交后由 tasks.py 的工作线程执行"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending / running / done / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(64))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        # 取待执行任务：status = 'pending' AND run_after <= now
+        db.Index('ix_job_status_run_after', 'status', 'run_after'),
+    )
+
+class OrderChange(db.Model):
+    """工单变更流水：与变更在同一事务内写入，自增 id 即 SSE 推送的事件编号，定期清理"""
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('work_order.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # created / stage / reassigned
+    stage_name = db.Column(db.String(50))
+    assignee_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    order = db.relationship('WorkOrder')
+
+class SubmissionKey(db.Model):
+    """已处理的表单提交键：与提交的修改在同一事务内写入，双击、刷新重发等重复提交据此识别"""
+    key = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    endpoint = db.Column(db.String(50), nullable=False)
+    order_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class ArchivedWorkOrder(OrderQueryMixin, db.Model):
+    """归档的已完成工单：保留原 id 和展示、导出、统计用到的字段，由 archive.py 从 work_order 批量迁入"""
+    is_archived = True
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    order_number = db.Column(db.String(50), unique=True, nullable=False)
+    order_date = db.Column(db.DateTime, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    delivery_date = db.Column(db.DateTime, nullable=False)
+    salesperson_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    salesperson = db.relationship('User', foreign_keys=[salesperson_id])
+    total_duration = db.Column(db.Integer)
+    current_stage = db.Column(db.String(50))
+    created_at = db.Column(db.DateTime)
+    current_assignee_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    current_assignee = db.relationship('User', foreign_keys=[current_assignee_id])
+    # 进入"完成"的时间（完成环节的开始时间），仪表盘准时率据此计算
+    completed_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    stages = db.relationship('ArchivedOrderStage',
+                             backref='work_order',
+                             lazy=True,
+                             cascade='all, delete-orphan',
+                             order_by='ArchivedOrderStage.start_time')
+
+    __table_args__ = (
+        # 导出按 (下单日期, id) 顺序扫描
+        db.Index('ix_archived_work_order_date_id', 'order_date', 'id'),
+    )
+
+class ArchivedOrderStage(db.Model):
+    """归档工单的流转记录，保留原 id"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    stage_name = db.Column(db.String(50), nullable=False)
+    start_time = db.Column(db.DateTime)
+    end_time = db.Column(db.DateTime)
+    duration = db.Column(db.Integer)
+    comments = db.Column(db.Text)
+    assignee_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    assignee = db.relationship('User', foreign_keys=[assignee_id])
+    order_id = db.Column(db.Integer, db.ForeignKey('archived_work_order.id'), nullable=False)
+
+    attachments = db.relationship('ArchivedAttachment',
+                                  backref='order_stage',
+                                  lazy=True,
+                                  cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('ix_archived_order_stage_order_start', 'order_id', 'start_time'),
+        # 可见性判断：用户参与过的归档工单
+        db.Index('ix_archived_order_stage_assignee_order', 'assignee_id', 'order_id'),
+    )
+
+class ArchivedAttachment(db.Model):
+    """归档工单的附件记录；文件仍在内容寻址存储中，引用计数把这些记录一并算上"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    filename = db.Column(db.String(100), nullable=False, index=True)
+    upload_time = db.Column(db.DateTime)
+    size = db.Column(db.Integer)
+    sha256 = db.Column(db.String(64), index=True)
+    stage_id = db.Column(db.Integer, db.ForeignKey('archived_order_stage.id'), nullable=False, index=True)
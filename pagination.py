@@ -0,0 +1,83 @@
+import base64
+import binascii
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+class KeysetPage:
+    """一页键集分页结果，游标为 (日期, id) 的不透明编码"""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def encode_cursor(sort_value, row_id):
+    raw = f'{sort_value.isoformat()}|{row_id}'
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标，格式无效时返回 None（即回到第一页）"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        sort_str, id_str = raw.split('|', 1)
+        return datetime.fromisoformat(sort_str), int(id_str)
+    except (ValueError, UnicodeError, binascii.Error):
+        return None
+
+
+def keyset_paginate(query, sort_column, id_column, per_page, after=None, before=None):
+    """
+    按 (sort_column, id_column) 倒序做键集分页
+    - after: 取该游标之后（更旧）的一页
+    - before: 取该游标之前（更新）的一页
+    每页只走索引范围扫描并多取一行判断是否还有下一页，不做 COUNT 也不用 OFFSET，
+    因此翻到任何位置的代价都与表大小无关。
+    """
+    after_key = decode_cursor(after)
+    before_key = decode_cursor(before) if after_key is None else None
+
+    if before_key is not None:
+        sort_value, row_id = before_key
+        rows = (query
+                .filter(or_(sort_column > sort_value,
+                            and_(sort_column == sort_value, id_column > row_id)))
+                .order_by(sort_column.asc(), id_column.asc())
+                .limit(per_page + 1)
+                .all())
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        next_cursor = _cursor_for(items[-1], sort_column, id_column) if items else None
+        prev_cursor = _cursor_for(items[0], sort_column, id_column) if has_more else None
+        return KeysetPage(items, next_cursor, prev_cursor)
+
+    if after_key is not None:
+        sort_value, row_id = after_key
+        query = query.filter(or_(sort_column < sort_value,
+                                 and_(sort_column == sort_value, id_column < row_id)))
+    rows = (query
+            .order_by(sort_column.desc(), id_column.desc())
+            .limit(per_page + 1)
+            .all())
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    next_cursor = _cursor_for(items[-1], sort_column, id_column) if has_more else None
+    prev_cursor = _cursor_for(items[0], sort_column, id_column) if after_key is not None and items else None
+    return KeysetPage(items, next_cursor, prev_cursor)
+
+
+def _cursor_for(row, sort_column, id_column):
+    return encode_cursor(getattr(row, sort_column.key), getattr(row, id_column.key))
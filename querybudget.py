@@ -0,0 +1,91 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from extensions import db
+from models import WorkOrder, User
+
+# 每个页面允许的最大 SQL 查询数，与数据量无关；超出说明出现了新的懒加载（N+1）
+QUERY_BUDGETS = {
+    'view_orders': 5,
+    'view_order': 4,
+    'assign_order': 3,
+    'process_order': 4,
+}
+
+
+class QueryCounter:
+    """统计 with 块内在数据库引擎上执行的 SQL 语句"""
+
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.engine = self.engine or db.engine
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+        return False
+
+
+def _client_as(user):
+    """以 user 身份登录的测试客户端"""
+    client = current_app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+    return client
+
+
+@click.command('check-query-budget')
+@click.option('--username', default='admin', help='以该用户身份访问页面（处理工单页面以当前负责人身份访问）')
+@click.option('--order-id', type=int, default=None, help='检查的工单，默认取最新一张')
+@with_appcontext
+def check_query_budget(username, order_id):
+    """逐个访问工单页面，查询数超过 QUERY_BUDGETS 或页面未返回 200 时以非零状态退出"""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f'用户不存在: {username}')
+    order = db.session.get(WorkOrder, order_id) if order_id else WorkOrder.query.order_by(WorkOrder.id.desc()).first()
+    if order is None:
+        raise click.ClickException('没有可检查的工单')
+    # 只有当前负责人能打开处理页面，其他人（包括管理员）会被重定向，查不到真实的查询数
+    assignee = db.session.get(User, order.current_assignee_id) if order.current_assignee_id else None
+    if assignee is None:
+        raise click.ClickException(f'工单 {order.id} 没有当前负责人，无法检查处理页面')
+
+    client = _client_as(user)
+    pages = {
+        'view_orders': ('/orders', client),
+        'view_order': (f'/order/{order.id}', client),
+        'assign_order': (f'/assign_order/{order.id}', client),
+        'process_order': (f'/process_order/{order.id}', _client_as(assignee)),
+    }
+
+    failed = False
+    for endpoint, (url, page_client) in pages.items():
+        # 每个页面在新的应用上下文中访问，避免复用会话和 g 上的请求级缓存
+        with current_app.app_context(), QueryCounter() as counter:
+            response = page_client.get(url)
+        budget = QUERY_BUDGETS[endpoint]
+        if response.status_code != 200:
+            status = f'HTTP {response.status_code}'
+        else:
+            status = 'OK' if counter.count <= budget else 'OVER'
+        click.echo(f'{endpoint:<15} {response.status_code} queries={counter.count:<3} budget={budget:<3} {status}')
+        if status != 'OK':
+            failed = True
+            for statement in counter.statements:
+                click.echo('    ' + ' '.join(statement.split())[:160])
+    if failed:
+        raise SystemExit(1)
@@ -0,0 +1,64 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import or_
+from extensions import db
+from models import WorkOrder, OrderStage
+
+# 执行计划中以 SCAN 开头且未使用索引的步骤即全表扫描
+FULL_SCAN_MARKER = 'SCAN '
+INDEXED_MARKERS = ('USING INDEX', 'USING COVERING INDEX', 'USING INTEGER PRIMARY KEY', 'USING PRIMARY KEY')
+# 额外排序只作提示：普通用户列表先按 OR 合并两路索引结果再排序，排序规模只与该用户的工单数有关
+SORT_MARKER = 'USE TEMP B-TREE'
+
+
+def hot_queries(user_id=1, order_id=1, per_page=50):
+    """工作流热点查询，与视图中的写法保持一致"""
+    assigned_order_ids = db.session.query(OrderStage.order_id).filter_by(assignee_id=user_id)
+    order_list = WorkOrder.query.order_by(WorkOrder.order_date.desc(), WorkOrder.id.desc())
+    return {
+        '当前活跃环节': OrderStage.query.filter_by(order_id=order_id, end_time=None),
+        '工单流转记录': OrderStage.query.filter_by(order_id=order_id).order_by(OrderStage.start_time),
+        '用户参与的工单': assigned_order_ids.distinct(),
+        '工单列表（管理员）': order_list.limit(per_page + 1),
+        '工单列表（普通用户）': order_list.filter(or_(WorkOrder.salesperson_id == user_id,
+                                                  WorkOrder.id.in_(assigned_order_ids))).limit(per_page + 1),
+        '按业务员筛选': order_list.filter(WorkOrder.salesperson_id == user_id).limit(per_page + 1),
+        '按环节筛选': order_list.filter(WorkOrder.current_stage == '计划').limit(per_page + 1),
+        '按负责人筛选': order_list.filter(WorkOrder.current_assignee_id == user_id).limit(per_page + 1),
+    }
+
+
+def explain(query):
+    """返回 SQLite EXPLAIN QUERY PLAN 的每一行说明"""
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    with db.engine.connect() as conn:
+        rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + str(compiled), params).fetchall()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan):
+    return [detail for detail in plan
+            if detail.startswith(FULL_SCAN_MARKER) and not any(m in detail for m in INDEXED_MARKERS)]
+
+
+@click.command('explain-queries')
+@with_appcontext
+def explain_queries_command():
+    """打印热点查询的执行计划，出现全表扫描时以非零状态退出"""
+    failed = False
+    for name, query in hot_queries().items():
+        plan = explain(query)
+        scans = full_scans(plan)
+        if scans:
+            status = 'FULL SCAN'
+        elif any(SORT_MARKER in detail for detail in plan):
+            status = 'OK (SORT)'
+        else:
+            status = 'OK'
+        click.echo(f'{name}: {status}')
+        for detail in plan:
+            click.echo(f'    {detail}')
+        failed = failed or bool(scans)
+    if failed:
+        raise SystemExit(1)
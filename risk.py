@@ -0,0 +1,171 @@
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, or_, select, update
+from extensions import db
+from models import WorkOrder, OrderStage
+import analytics
+
+# 交期风险评估：按历史环节历时推算未完成工单的完成时间
+# - 各环节的 p50 / p95 历时取自 analytics 的日汇总表，不扫描 order_stage
+# - 剩余流程按典型顺序估计：当前环节还需 max(历时 - 已用时, 0)，之后每一步各加一次
+# - 预计完成 = 现在 + 各步 p50 之和；悲观完成 = 现在 + 各步 p95 之和
+# - 风险分：悲观完成不晚于交货期为 0，预计完成已晚于交货期为 1，之间线性插值
+# - 增量评估：只重算活跃环节变化过（risk_stage_id 与 active_stage_id 不同）
+#   或上次评估超过 RISK_RESCORE_AFTER 秒的工单，后者用于反映在同一环节停留越来越久
+
+COMPLETED_STAGE = '完成'
+# 典型流转顺序；三家外协公司是并列的一步，历史数据合并计算
+STAGE_SEQUENCE = (
+    ('计划',),
+    ('技术部',),
+    ('采购部',),
+    ('宁泰公司', '鑫泽公司', '鑫波公司'),
+)
+# 没有历史数据的步骤使用的默认历时（秒）
+DEFAULT_PROFILE = (24 * 3600, 72 * 3600)
+# 历史样本少于该数时使用默认历时
+MIN_SAMPLES = 5
+
+StepProfile = namedtuple('StepProfile', 'p50 p95')
+
+
+def load_profiles(history_days=None):
+    """每一步的 (p50, p95) 秒数，合并步骤内各环节的直方图"""
+    history_days = history_days or current_app.config['RISK_HISTORY_DAYS']
+    end = datetime.utcnow().date()
+    histograms = analytics.stage_histograms(end - timedelta(days=history_days - 1), end)
+    profiles = {}
+    for step in STAGE_SEQUENCE:
+        count, low, high, merged = 0, None, None, {}
+        for stage in step:
+            if stage not in histograms:
+                continue
+            n, stage_low, stage_high, histogram = histograms[stage]
+            count += n
+            low = stage_low if low is None else min(low, stage_low)
+            high = stage_high if high is None else max(high, stage_high)
+            for bucket, c in histogram:
+                merged[bucket] = merged.get(bucket, 0) + c
+        if count < MIN_SAMPLES:
+            profile = StepProfile(*DEFAULT_PROFILE)
+        else:
+            histogram = sorted(merged.items())
+            profile = StepProfile(*(min(max(analytics.percentile(histogram, count, p), low), high)
+                                    for p in (50, 95)))
+        for stage in step:
+            profiles[stage] = profile
+    return profiles
+
+
+def _step_index(stage_name):
+    for i, step in enumerate(STAGE_SEQUENCE):
+        if stage_name in step:
+            return i
+    # 创建工单等不在序列中的环节：后续所有步骤都还没做
+    return -1
+
+
+def project(stage_name, stage_start, delivery_date, profiles, now):
+    """返回 (风险分, 预计完成时间)"""
+    index = _step_index(stage_name)
+    p50_left = p95_left = 0.0
+    if index >= 0:
+        elapsed = (now - stage_start).total_seconds() if stage_start else 0
+        current = profiles[stage_name]
+        p50_left = max(current.p50 - elapsed, 0)
+        p95_left = max(current.p95 - elapsed, 0)
+    for step in STAGE_SEQUENCE[index + 1:]:
+        profile = profiles[step[0]]
+        p50_left += profile.p50
+        p95_left += profile.p95
+
+    projected = now + timedelta(seconds=p50_left)
+    pessimistic = now + timedelta(seconds=p95_left)
+    if pessimistic <= delivery_date:
+        score = 0.0
+    elif projected >= delivery_date:
+        score = 1.0
+    else:
+        score = (pessimistic - delivery_date) / (pessimistic - projected)
+    return round(score, 3), projected
+
+
+def score_orders(full=False, batch_size=500):
+    """
+    评估需要重算的未完成工单，每批一个事务，返回评估的工单数
+    - full=True 时重算所有未完成工单
+    - 评估期间工单发生流转时，写入的 risk_stage_id 是旧环节，下一轮会再次评估
+    """
+    now = datetime.utcnow()
+    profiles = load_profiles()
+    stale_before = now - timedelta(seconds=current_app.config['RISK_RESCORE_AFTER'])
+    query = (select(WorkOrder.id, WorkOrder.current_stage, WorkOrder.delivery_date,
+                    WorkOrder.active_stage_id, OrderStage.start_time)
+             .join(OrderStage, OrderStage.id == WorkOrder.active_stage_id)
+             .where(WorkOrder.current_stage != COMPLETED_STAGE)
+             .order_by(WorkOrder.id))
+    if not full:
+        query = query.where(or_(WorkOrder.risk_stage_id.is_(None),
+                                WorkOrder.risk_stage_id != WorkOrder.active_stage_id,
+                                WorkOrder.risk_scored_at < stale_before))
+
+    scored = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(query.where(WorkOrder.id > last_id).limit(batch_size)).all()
+        if not rows:
+            break
+        updates = []
+        for order_id, stage_name, delivery_date, stage_id, stage_start in rows:
+            score, projected = project(stage_name, stage_start, delivery_date, profiles, now)
+            updates.append({'order_id': order_id, 'risk_score': score, 'projected_finish': projected,
+                            'risk_stage_id': stage_id, 'risk_scored_at': now})
+        # 风险分是派生数据，按主键直接更新，不递增工单版本号，不会让正在填写的流转表单判为冲突
+        db.session.execute(update(WorkOrder.__table__).where(WorkOrder.__table__.c.id == bindparam('order_id')),
+                           updates)
+        db.session.commit()
+        scored += len(rows)
+        last_id = rows[-1][0]
+    return scored
+
+
+def start_scheduler(app):
+    """每 RISK_INTERVAL 秒在后台线程增量评估一次；多进程各自运行时后到的一轮基本无事可做"""
+    interval = app.config['RISK_INTERVAL']
+    if not interval:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    started = time.perf_counter()
+                    scored = score_orders()
+                    if scored:
+                        app.logger.info(f'交期风险: 评估 {scored} 张工单，'
+                                        f'耗时 {(time.perf_counter() - started) * 1000:.0f}ms')
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error(f'交期风险评估失败: {e}', exc_info=True)
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=run, name='risk-scheduler', daemon=True)
+    thread.start()
+    return thread
+
+
+@click.command('score-risk')
+@click.option('--full', is_flag=True, help='重算所有未完成工单，而不只是有变化的')
+@with_appcontext
+def score_risk_command(full):
+    """立即评估未完成工单的交期风险"""
+    started = time.perf_counter()
+    scored = score_orders(full=full)
+    click.echo(f'评估 {scored} 张工单，耗时 {(time.perf_counter() - started) * 1000:.0f}ms')
@@ -0,0 +1,218 @@
+import re
+from contextlib import contextmanager
+import click
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+from sqlalchemy import DDL, column, event, func, literal, literal_column, or_, select, table, text
+from extensions import db
+from models import WorkOrder
+
+# 工单全文检索：SQLite FTS5 虚拟表 order_search，每张工单一行（rowid = 工单 id）
+# - 列：派工单号、所有环节备注、所有附件名
+# - trigram 分词：任意 3 个字符以上的片段都走索引，中文不需要分词，派工单号可以按片段查找
+# - 工单、环节、附件表上的触发器在同一事务内重算对应工单的索引行，
+#   创建 / 指派 / 处理工单以及批量导入都不需要额外调用
+# - 索引与数据不一致时（例如直接改库）用 flask rebuild-search 重建
+
+SEARCH_TABLE = 'order_search'
+
+# 按工单 id 重算索引行的语句，{id} 替换为触发器里的 NEW.xxx / OLD.xxx
+_REINDEX = (
+    "DELETE FROM order_search WHERE rowid = {id};"
+    " INSERT INTO order_search (rowid, order_number, comments, attachments)"
+    " SELECT work_order.id, work_order.order_number,"
+    " (SELECT group_concat(order_stage.comments, ' ') FROM order_stage WHERE order_stage.order_id = work_order.id),"
+    " (SELECT group_concat(attachment.filename, ' ') FROM attachment"
+    "  JOIN order_stage ON order_stage.id = attachment.stage_id WHERE order_stage.order_id = work_order.id)"
+    " FROM work_order WHERE work_order.id = {id};"
+)
+_ATTACHMENT_ORDER = '(SELECT order_id FROM order_stage WHERE id = {row}.stage_id)'
+
+SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS order_search"
+    " USING fts5(order_number, comments, attachments, tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS order_search_order_ai AFTER INSERT ON work_order BEGIN "
+    + _REINDEX.format(id='NEW.id') + " END",
+    "CREATE TRIGGER IF NOT EXISTS order_search_order_au AFTER UPDATE OF order_number ON work_order BEGIN "
+    + _REINDEX.format(id='NEW.id') + " END",
+    "CREATE TRIGGER IF NOT EXISTS order_search_order_ad AFTER DELETE ON work_order BEGIN "
+    "DELETE FROM order_search WHERE rowid = OLD.id; END",
+    "CREATE TRIGGER IF NOT EXISTS order_search_stage_ai AFTER INSERT ON order_stage BEGIN "
+    + _REINDEX.format(id='NEW.order_id') + " END",
+    "CREATE TRIGGER IF NOT EXISTS order_search_stage_au AFTER UPDATE OF comments, order_id ON order_stage BEGIN "
+    + _REINDEX.format(id='OLD.order_id') + _REINDEX.format(id='NEW.order_id') + " END",
+    "CREATE TRIGGER IF NOT EXISTS order_search_stage_ad AFTER DELETE ON order_stage BEGIN "
+    + _REINDEX.format(id='OLD.order_id') + " END",
+    "CREATE TRIGGER IF NOT EXISTS order_search_attachment_ai AFTER INSERT ON attachment BEGIN "
+    + _REINDEX.format(id=_ATTACHMENT_ORDER.format(row='NEW')) + " END",
+    "CREATE TRIGGER IF NOT EXISTS order_search_attachment_ad AFTER DELETE ON attachment BEGIN "
+    + _REINDEX.format(id=_ATTACHMENT_ORDER.format(row='OLD')) + " END",
+]
+
+# db.create_all() 建表后同时创建检索表和触发器（已有数据库由迁移创建）
+for _statement in SEARCH_DDL:
+    event.listen(db.metadata, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+
+
+_TRIGGER_NAMES = [re.search(r'TRIGGER IF NOT EXISTS (\w+)', s).group(1) for s in SEARCH_DDL if 'TRIGGER' in s]
+
+
+@contextmanager
+def triggers_suspended():
+    """批量写入期间删除触发器，结束后重新创建；调用方负责随后 rebuild()"""
+    for name in _TRIGGER_NAMES:
+        db.session.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+    db.session.commit()
+    try:
+        yield
+    finally:
+        db.session.rollback()
+        for statement in SEARCH_DDL:
+            db.session.execute(text(statement))
+        db.session.commit()
+
+
+def migration_include_name(name, type_, parent_names):
+    """自动生成迁移时忽略 FTS5 虚拟表及其影子表"""
+    return not (type_ == 'table' and name.startswith(SEARCH_TABLE))
+
+
+order_search = table(SEARCH_TABLE, column('rowid'), column('order_number'), column('comments'), column('attachments'))
+
+# bm25 列权重：派工单号命中最重要，其次附件名、备注
+RANK_WEIGHTS = (10.0, 1.0, 2.0)
+# 摘要高亮用控制字符占位，转义后再换成 <mark>，避免备注里的 HTML 原样输出
+_MARK_OPEN, _MARK_CLOSE = '\x02', '\x03'
+# trigram 索引只能匹配 3 个字符以上的片段
+MIN_TERM_LENGTH = 3
+# 命中数不超过该值时按相关度排序，否则按工单 id 倒序
+RANK_CANDIDATE_LIMIT = 2000
+
+
+def parse_terms(q):
+    """按空白拆分检索词，去重并保持顺序"""
+    return list(dict.fromkeys(t for t in re.split(r'\s+', (q or '').strip()) if t))
+
+
+def _match_expression(terms):
+    # 每个词作为短语（双引号转义），多个词之间为 AND
+    return ' '.join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def _like_pattern(term):
+    return '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def highlight(snippet):
+    if not snippet:
+        return Markup('')
+    return Markup(str(escape(snippet)).replace(_MARK_OPEN, '<mark>').replace(_MARK_CLOSE, '</mark>'))
+
+
+class SearchResult:
+    def __init__(self, order, rank, snippet):
+        self.order = order
+        self.rank = rank
+        self.snippet = highlight(snippet)
+
+
+class SearchPage:
+    def __init__(self, items, page, per_page, has_next):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_next = has_next
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+
+def _match_count(conditions, limit):
+    """命中行数，最多数到 limit"""
+    matched = select(order_search.c.rowid).where(*conditions).limit(limit).subquery()
+    return db.session.execute(select(func.count()).select_from(matched)).scalar()
+
+
+def search_orders(q, user, page=1, per_page=20, options=()):
+    """
+    按相关度检索当前用户可见的工单，返回 SearchPage
+    - 3 个字符以上的词用 FTS5 MATCH 走索引并按 bm25 排序
+    - 更短的词（如两个汉字）只能在索引表上做 LIKE 过滤，排序退化为按工单 id 倒序
+    - 命中超过 RANK_CANDIDATE_LIMIT 张工单的宽泛检索词同样按 id 倒序（最新的在前）：
+      bm25 要对每个命中行打分，几万行时超过 100ms，而 FTS5 按 rowid 倒序可以取够一页就停
+    - 相关度没有稳定的键集，按页码分页；多取一行判断是否还有下一页
+    """
+    terms = parse_terms(q)
+    if not terms:
+        return SearchPage([], 1, per_page, False)
+    long_terms = [t for t in terms if len(t) >= MIN_TERM_LENGTH]
+    short_terms = [t for t in terms if len(t) < MIN_TERM_LENGTH]
+    page = max(page, 1)
+
+    conditions = []
+    if not user.is_admin():
+        conditions.append(order_search.c.rowid.in_(db.select(WorkOrder.id).where(WorkOrder.visible_to(user))))
+    if long_terms:
+        conditions.append(text('order_search MATCH :match').bindparams(match=_match_expression(long_terms)))
+    for term in short_terms:
+        pattern = _like_pattern(term)
+        # 带 ESCAPE 的 LIKE 由 SQLite 逐行过滤；交给 trigram 处理时不足 3 个字的中文片段会漏匹配
+        conditions.append(or_(*(order_search.c[name].like(pattern, escape='\\')
+                                for name in ('order_number', 'comments', 'attachments'))))
+    ranked = long_terms and _match_count(conditions, RANK_CANDIDATE_LIMIT + 1) <= RANK_CANDIDATE_LIMIT
+    if ranked:
+        rank = func.bm25(literal_column(SEARCH_TABLE), *RANK_WEIGHTS)
+        order_by = (rank, order_search.c.rowid.desc())
+    else:
+        rank = literal(0.0)
+        order_by = (order_search.c.rowid.desc(),)
+    if long_terms:
+        snippet = func.snippet(literal_column(SEARCH_TABLE), -1, _MARK_OPEN, _MARK_CLOSE, '…', 12)
+    else:
+        snippet = func.substr(func.coalesce(order_search.c.comments, ''), 1, 60)
+
+    rows = db.session.execute(
+        select(order_search.c.rowid, rank, snippet)
+        .where(*conditions)
+        .order_by(*order_by)
+        .limit(per_page + 1)
+        .offset((page - 1) * per_page)
+    ).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    orders = {}
+    if rows:
+        orders = {o.id: o for o in WorkOrder.query.options(*options)
+                  .filter(WorkOrder.id.in_([r[0] for r in rows]))}
+    items = [SearchResult(orders[r[0]], r[1], r[2]) for r in rows if r[0] in orders]
+    return SearchPage(items, page, per_page, has_next)
+
+
+def rebuild():
+    """清空并按当前数据重建整个索引，一条 INSERT ... SELECT 完成"""
+    db.session.execute(text('DELETE FROM order_search'))
+    db.session.execute(text(
+        "INSERT INTO order_search (rowid, order_number, comments, attachments)"
+        " SELECT work_order.id, work_order.order_number, stage_text.comments, attachment_text.names"
+        " FROM work_order"
+        " LEFT JOIN (SELECT order_id, group_concat(comments, ' ') AS comments FROM order_stage"
+        "  GROUP BY order_id) AS stage_text ON stage_text.order_id = work_order.id"
+        " LEFT JOIN (SELECT order_stage.order_id, group_concat(attachment.filename, ' ') AS names"
+        "  FROM attachment JOIN order_stage ON order_stage.id = attachment.stage_id"
+        "  GROUP BY order_stage.order_id) AS attachment_text ON attachment_text.order_id = work_order.id"
+    ))
+    db.session.execute(text("INSERT INTO order_search (order_search) VALUES ('optimize')"))
+    db.session.commit()
+    return db.session.execute(text('SELECT count(*) FROM order_search')).scalar()
+
+
+@click.command('rebuild-search')
+@with_appcontext
+def rebuild_search_command():
+    """重建工单全文检索索引（缺少检索表或触发器时一并创建）"""
+    for statement in SEARCH_DDL:
+        db.session.execute(text(statement))
+    count = rebuild()
+    click.echo(f'已索引 {count} 张工单')
@@ -0,0 +1,306 @@
+import hashlib
+import math
+import os
+import random
+import time
+from datetime import datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, insert, select, text
+from extensions import db, bcrypt
+from models import Department, User, WorkOrder, OrderStage, Attachment, AttachmentBlob
+import storage
+import stats
+import analytics
+import search
+import risk
+
+# 生成压测用的模拟数据：部门、用户、工单、环节链和附件
+# - 用 Core 批量 executemany 插入，主键在 Python 中预先分配，工单与活跃环节互相引用也不需要回写
+# - 同一随机种子生成相同的数据，便于不同版本之间对比
+# - 插入期间暂停全文检索触发器，最后统一重建检索表、统计计数器、环节历时汇总和交期风险
+
+SEED_DEPARTMENTS = ('管理部', '销售部', '计划部', '技术部', '采购部', '生产部')
+# 环节由哪个部门的人负责；外协环节由生产部跟进
+STAGE_DEPARTMENTS = {
+    '计划': '计划部',
+    '技术部': '技术部',
+    '采购部': '采购部',
+    '宁泰公司': '生产部',
+    '鑫泽公司': '生产部',
+    '鑫波公司': '生产部',
+}
+OUTSOURCERS = ('宁泰公司', '鑫泽公司', '鑫波公司')
+# 各环节历时的中位数（小时），实际历时按对数正态分布抽样
+STAGE_MEDIAN_HOURS = {
+    '计划': 8,
+    '技术部': 30,
+    '采购部': 48,
+    '宁泰公司': 72,
+    '鑫泽公司': 60,
+    '鑫波公司': 96,
+}
+COMPLETED_RATIO = 0.6
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+GIVEN_NAMES = '伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华建国志红'
+COMMENTS = (
+    '已确认图纸', '物料已到齐', '等待客户确认', '按计划推进', '加急处理', '已与客户沟通交期',
+    '样品检验合格', '工艺调整后重新排产', '外协已回厂', '包装完成待发货',
+)
+ATTACHMENT_NAMES = ('图纸.pdf', '报价单.xlsx', '现场照片.jpg', '检验报告.pdf', '合同.docx')
+# 附件内容池：大量附件共用少量文件，与内容寻址存储去重后的实际情况一致
+BLOB_POOL_SIZE = 50
+
+
+def _next_id(column):
+    return db.session.execute(select(func.coalesce(func.max(column), 0))).scalar() + 1
+
+
+def _realname(rng):
+    return rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN_NAMES) for _ in range(rng.randint(1, 2)))
+
+
+def _duration(rng, stage_name):
+    # sigma = 0.8：p95 约为中位数的 3.7 倍
+    return max(60, int(STAGE_MEDIAN_HOURS[stage_name] * 3600 * math.exp(rng.gauss(0, 0.8))))
+
+
+def seed_users(rng, count, password):
+    """按部门生成用户，返回 {部门名: [用户 id]}；用户名 seed<id>，所有人使用同一个密码"""
+    departments = dict(db.session.execute(select(Department.name, Department.id)).all())
+    missing = [name for name in SEED_DEPARTMENTS if name not in departments]
+    if missing:
+        db.session.execute(insert(Department.__table__), [{'name': name} for name in missing])
+        departments = dict(db.session.execute(select(Department.name, Department.id)).all())
+
+    # bcrypt 很慢，所有模拟用户共用一个哈希
+    password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+    now = datetime.utcnow()
+    first_id = _next_id(User.id)
+    rows = []
+    members = {name: [] for name in SEED_DEPARTMENTS}
+    names = SEED_DEPARTMENTS[1:]
+    for i in range(count):
+        user_id = first_id + i
+        department = names[i % len(names)]
+        members[department].append(user_id)
+        rows.append({
+            'id': user_id,
+            'username': f'seed{user_id}',
+            'password_hash': password_hash,
+            'realname': _realname(rng),
+            'role': 'user',
+            'department_id': departments[department],
+            'can_create_order': department == '销售部',
+            'created_at': now,
+        })
+    db.session.execute(insert(User.__table__), rows)
+    return members
+
+
+def seed_blobs(rng):
+    """写入附件内容池，返回 [(sha256, size)]"""
+    blobs = []
+    now = datetime.utcnow()
+    for i in range(BLOB_POOL_SIZE):
+        content = f'seed attachment {i}\n'.encode() + rng.randbytes(rng.randint(1024, 64 * 1024))
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = storage.blob_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+        blobs.append((sha256, len(content)))
+    existing = set(db.session.execute(
+        select(AttachmentBlob.sha256).where(AttachmentBlob.sha256.in_([b[0] for b in blobs]))).scalars())
+    new_rows = [{'sha256': sha256, 'size': size, 'ref_count': 0, 'created_at': now, 'updated_at': now}
+                for sha256, size in blobs if sha256 not in existing]
+    if new_rows:
+        db.session.execute(insert(AttachmentBlob.__table__), new_rows)
+    return blobs
+
+
+def _order_chain(rng, extra_mean):
+    """工单经历的环节名序列（不含创建工单），以及是否已完成"""
+    path = ['计划', '技术部', '采购部', rng.choice(OUTSOURCERS)]
+    completed = rng.random() < COMPLETED_RATIO
+    steps = path if completed else path[:rng.randint(1, len(path))]
+    # 返工 / 改派：重复已经过的某个环节
+    extra = int(rng.expovariate(1 / extra_mean)) if extra_mean > 0 else 0
+    for _ in range(extra):
+        position = rng.randint(1, len(steps))
+        steps.insert(position, steps[position - 1])
+    return steps, completed
+
+
+class _Ids:
+    def __init__(self, start):
+        self.value = start
+
+    def take(self):
+        value = self.value
+        self.value += 1
+        return value
+
+
+def _build_order(rng, order_id, stage_ids, attachment_ids, members, salespeople, blobs,
+                 extra_mean, days, attachment_ratio, now, stages, attachments):
+    """生成一张工单的行，环节和附件行追加到 stages / attachments"""
+    steps, completed = _order_chain(rng, extra_mean)
+    durations = [_duration(rng, name) for name in steps]
+    salesperson_id = rng.choice(salespeople)
+    if completed:
+        # 已完成：整个流程在过去 days 天内
+        elapsed = sum(durations)
+        order_date = now - timedelta(seconds=elapsed) - timedelta(days=rng.uniform(0, days))
+    else:
+        # 进行中：活跃环节开始不久
+        elapsed = sum(durations[:-1])
+        order_date = now - timedelta(seconds=elapsed + rng.uniform(0, durations[-1]))
+    delivery_date = order_date + timedelta(days=rng.uniform(15, 60))
+    order_number = f'SD{order_id:07d}'
+
+    chain = [('创建工单', 0, salesperson_id, '模拟数据')]
+    for name, duration in zip(steps, durations):
+        assignee = rng.choice(members[STAGE_DEPARTMENTS[name]])
+        comment = rng.choice(COMMENTS) if rng.random() < 0.5 else None
+        chain.append((name, duration, assignee, comment))
+    if completed:
+        chain.append(('完成', None, salesperson_id, None))
+
+    start = order_date
+    active_id = None
+    for index, (name, duration, assignee, comment) in enumerate(chain):
+        stage_id = stage_ids.take()
+        is_active = index == len(chain) - 1
+        end = None if is_active else start + timedelta(seconds=duration)
+        stages.append({
+            'id': stage_id,
+            'order_id': order_id,
+            'stage_name': name,
+            'start_time': start,
+            'end_time': end,
+            'duration': None if is_active else duration,
+            'comments': comment,
+            'assignee_id': assignee,
+        })
+        if name != '创建工单' and rng.random() < attachment_ratio:
+            sha256, size = rng.choice(blobs)
+            stamp = start.strftime('%Y%m%d%H%M%S')
+            attachments.append({
+                'id': attachment_ids.take(),
+                'filename': f'{order_id}_{name}_{stamp}_{rng.choice(ATTACHMENT_NAMES)}',
+                'upload_time': start,
+                'size': size,
+                'sha256': sha256,
+                'stage_id': stage_id,
+            })
+        if is_active:
+            active_id = stage_id
+        else:
+            start = end
+
+    last = chain[-1]
+    return {
+        'id': order_id,
+        'order_number': order_number,
+        'order_date': order_date,
+        'quantity': rng.randint(1, 500),
+        'delivery_date': delivery_date,
+        'salesperson_id': salesperson_id,
+        'total_duration': int((delivery_date - order_date).total_seconds()),
+        'current_stage': last[0],
+        'current_assignee_id': last[2],
+        'active_stage_id': active_id,
+        'created_at': order_date,
+        'updated_at': now,
+    }
+
+
+def generate(orders, users=200, stages_per_order=6.0, attachment_ratio=0.1, days=365,
+             seed=1, password='password', batch_size=2000, progress=None):
+    """
+    生成模拟数据并重建派生数据，返回各表插入的行数
+    stages_per_order 为每张工单的平均环节数（含创建工单），超出基本流程的部分为返工 / 改派
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    # 基本流程的平均环节数：创建 + 已完成 (4 步 + 完成) 或进行中 (平均 2.5 步)
+    base = 1 + COMPLETED_RATIO * 5 + (1 - COMPLETED_RATIO) * 2.5
+    extra_mean = max(stages_per_order - base, 0)
+    counts = {'users': users, 'orders': 0, 'stages': 0, 'attachments': 0}
+
+    members = seed_users(rng, users, password)
+    salespeople = members['销售部']
+    if not all(members[name] for name in set(STAGE_DEPARTMENTS.values()) | {'销售部'}):
+        raise ValueError('用户数太少，每个部门至少需要一人')
+    blobs = seed_blobs(rng)
+    db.session.commit()
+
+    order_ids = _Ids(_next_id(WorkOrder.id))
+    stage_ids = _Ids(_next_id(OrderStage.id))
+    attachment_ids = _Ids(_next_id(Attachment.id))
+    blob_refs = {}
+
+    with search.triggers_suspended():
+        remaining = orders
+        while remaining:
+            order_rows, stage_rows, attachment_rows = [], [], []
+            for _ in range(min(batch_size, remaining)):
+                order_rows.append(_build_order(rng, order_ids.take(), stage_ids, attachment_ids, members,
+                                               salespeople, blobs, extra_mean, days, attachment_ratio, now,
+                                               stage_rows, attachment_rows))
+            db.session.execute(insert(WorkOrder.__table__), order_rows)
+            db.session.execute(insert(OrderStage.__table__), stage_rows)
+            if attachment_rows:
+                db.session.execute(insert(Attachment.__table__), attachment_rows)
+            db.session.commit()
+            for row in attachment_rows:
+                blob_refs[row['sha256']] = blob_refs.get(row['sha256'], 0) + 1
+            remaining -= len(order_rows)
+            counts['orders'] += len(order_rows)
+            counts['stages'] += len(stage_rows)
+            counts['attachments'] += len(attachment_rows)
+            if progress:
+                progress(counts)
+
+    for sha256, refs in blob_refs.items():
+        db.session.execute(AttachmentBlob.__table__.update()
+                           .where(AttachmentBlob.sha256 == sha256)
+                           .values(ref_count=AttachmentBlob.ref_count + refs))
+    db.session.commit()
+
+    # 派生数据
+    stats.rebuild()
+    analytics.rebuild()
+    search.rebuild()
+    risk.score_orders(full=True)
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+    return counts
+
+
+@click.command('seed-data')
+@click.option('--orders', default=10000, show_default=True, help='生成的工单数')
+@click.option('--users', default=200, show_default=True, help='生成的用户数（按部门平均分配）')
+@click.option('--stages', 'stages_per_order', default=6.0, show_default=True, help='每张工单的平均环节数')
+@click.option('--attachments', 'attachment_ratio', default=0.1, show_default=True, help='每个环节带附件的概率')
+@click.option('--days', default=365, show_default=True, help='已完成工单分布的天数')
+@click.option('--seed', default=1, show_default=True, help='随机种子')
+@click.option('--password', default='password', show_default=True, help='模拟用户的登录密码')
+@click.option('--batch-size', default=2000, show_default=True, help='每个事务插入的工单数')
+@with_appcontext
+def seed_data_command(orders, users, stages_per_order, attachment_ratio, days, seed, password, batch_size):
+    """批量生成压测用的模拟数据（追加到当前数据库）"""
+    started = time.perf_counter()
+
+    def progress(counts):
+        elapsed = time.perf_counter() - started
+        click.echo(f'\r  工单 {counts["orders"]}/{orders}  环节 {counts["stages"]}  '
+                   f'附件 {counts["attachments"]}  {counts["orders"] / elapsed:.0f} 单/秒', nl=False)
+
+    counts = generate(orders, users, stages_per_order, attachment_ratio, days, seed, password,
+                      batch_size, progress)
+    click.echo()
+    click.echo(f'生成 {counts["users"]} 个用户、{counts["orders"]} 张工单、{counts["stages"]} 个环节、'
+               f'{counts["attachments"]} 个附件，耗时 {time.perf_counter() - started:.1f}s（含重建派生数据）')
@@ -0,0 +1,120 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from extensions import db
+from models import StatCounter, WorkOrder, OrderStage, User, ArchivedWorkOrder
+
+COMPLETED_STAGE = '完成'
+
+# 计数器名称
+ONGOING = 'ongoing'
+COMPLETED = 'completed'
+ON_TIME = 'completed_on_time'
+USERS = 'users'
+
+COUNTERS = (ONGOING, COMPLETED, ON_TIME, USERS)
+
+
+def incr(name, delta=1):
+    """
+    在当前会话事务内原子地调整计数器，随业务数据一起提交或回滚
+    计数器尚未初始化时不做处理，首次读取时会从业务表完整重建
+    """
+    db.session.execute(
+        update(StatCounter)
+        .where(StatCounter.name == name)
+        .values(value=StatCounter.value + delta)
+    )
+
+
+def order_created(order):
+    if order.current_stage == COMPLETED_STAGE:
+        incr(COMPLETED)
+    else:
+        incr(ONGOING)
+
+
+def stage_changed(order, previous_stage, closed_stage):
+    """
+    工单环节变更后调整计数器
+    - previous_stage: 变更前的 order.current_stage
+    - closed_stage: 本次被结束的环节（可能为 None）
+    完成时间取进入"完成"时被结束环节的 end_time，不晚于交货期即为准时。
+    """
+    was_completed = previous_stage == COMPLETED_STAGE
+    now_completed = order.current_stage == COMPLETED_STAGE
+    if was_completed == now_completed:
+        return
+
+    if now_completed:
+        incr(ONGOING, -1)
+        incr(COMPLETED)
+        if closed_stage is not None and closed_stage.end_time <= order.delivery_date:
+            incr(ON_TIME)
+    else:
+        # 重新打开已完成的工单：被结束的是"完成"环节，其开始时间即上次完成时间
+        incr(COMPLETED, -1)
+        incr(ONGOING)
+        if closed_stage is not None and closed_stage.start_time <= order.delivery_date:
+            incr(ON_TIME, -1)
+
+
+def user_added():
+    incr(USERS)
+
+
+def user_deleted():
+    incr(USERS, -1)
+
+
+def rebuild():
+    """从业务表重新计算所有计数器，用于修复漂移；已完成数和准时数包含已归档的工单"""
+    completed_at = (db.session.query(OrderStage.order_id, func.max(OrderStage.end_time).label('completed_at'))
+                    .filter(OrderStage.stage_name != COMPLETED_STAGE)
+                    .group_by(OrderStage.order_id)
+                    .subquery())
+    values = {
+        ONGOING: WorkOrder.query.filter(WorkOrder.current_stage != COMPLETED_STAGE).count(),
+        COMPLETED: (WorkOrder.query.filter_by(current_stage=COMPLETED_STAGE).count()
+                    + ArchivedWorkOrder.query.count()),
+        ON_TIME: (WorkOrder.query
+                  .join(completed_at, completed_at.c.order_id == WorkOrder.id)
+                  .filter(WorkOrder.current_stage == COMPLETED_STAGE,
+                          completed_at.c.completed_at <= WorkOrder.delivery_date)
+                  .count()
+                  + ArchivedWorkOrder.query
+                  .filter(ArchivedWorkOrder.completed_at <= ArchivedWorkOrder.delivery_date)
+                  .count()),
+        USERS: User.query.count(),
+    }
+    # 两个首次请求可能同时重建，用 upsert 写入，后到的一方覆盖计数而不是主键冲突
+    stmt = sqlite_insert(StatCounter.__table__).values([{'name': name, 'value': value}
+                                                        for name, value in values.items()])
+    db.session.execute(stmt.on_conflict_do_update(index_elements=['name'], set_={'value': stmt.excluded.value}))
+    db.session.commit()
+    return values
+
+
+def get_dashboard_stats():
+    """一次主键表读取得到仪表盘数据；计数器尚未初始化时先重建"""
+    values = {c.name: c.value for c in StatCounter.query.all()}
+    if any(name not in values for name in COUNTERS):
+        values = rebuild()
+    completed = values.get(COMPLETED, 0)
+    on_time = values.get(ON_TIME, 0)
+    return {
+        'ongoing': values.get(ONGOING, 0),
+        'completed': completed,
+        'users': values.get(USERS, 0),
+        'on_time_rate': round(on_time * 100 / completed) if completed else 0
+    }
+
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats_command():
+    """重新计算仪表盘计数器"""
+    values = rebuild()
+    for name in COUNTERS:
+        click.echo(f'{name}: {values[name]}')
@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from extensions import db
+from models import Attachment, AttachmentBlob, ArchivedAttachment
+
+# 内容寻址附件存储：
+# - 文件按 SHA-256 存放在 UPLOAD_FOLDER/blobs/ab/cd/<sha256>，两级分片避免单目录文件过多
+# - 相同内容只存一份，重复上传只新增 Attachment 记录
+# - attachment_blob.ref_count 随 Attachment 的插入 / 删除（包括级联删除）在同一事务内增减
+# - 引用数归零的文件由后台清理任务在宽限期后删除
+# - 归档工单的附件记录（archived_attachment）同样算作引用
+#
+# 与并发上传的配合：上传先把临时文件硬链接到目标位置，提交后再确认文件仍在；
+# 清理任务在数据库写锁内删除记录和文件，上传的引用计数写入会等到清理提交之后，
+# 提交后发现文件已被清理时用保留的临时文件补回。
+
+
+def blob_folder():
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'blobs')
+
+
+def blob_path(sha256):
+    return os.path.join(blob_folder(), sha256[:2], sha256[2:4], sha256)
+
+
+def preview_path(sha256):
+    """图片附件的缩略图，由后台任务生成；不在 blobs 下，清理任务不会处理"""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'previews', sha256[:2], sha256 + '.jpg')
+
+
+def attachment_path(attachment):
+    """附件的实际文件路径；内容寻址存储之前上传的附件仍在 UPLOAD_FOLDER 下按文件名存放"""
+    if attachment.sha256:
+        path = blob_path(attachment.sha256)
+        if os.path.exists(path):
+            return path
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], attachment.filename)
+
+
+def place(temp_path, sha256):
+    """提交前把临时文件硬链接到存储位置，已存在相同内容时什么也不做"""
+    path = blob_path(sha256)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        os.link(temp_path, path)
+    except FileExistsError:
+        pass
+
+
+def finalize(temp_path, sha256):
+    """提交后确认文件存在并清理临时文件"""
+    path = blob_path(sha256)
+    if os.path.exists(path):
+        os.unlink(temp_path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(temp_path, path)
+
+
+@event.listens_for(Attachment, 'after_insert')
+def _attachment_inserted(mapper, connection, target):
+    if not target.sha256:
+        return
+    now = datetime.utcnow()
+    stmt = sqlite_insert(AttachmentBlob.__table__).values(
+        sha256=target.sha256, size=target.size or 0, ref_count=1, created_at=now, updated_at=now)
+    connection.execute(stmt.on_conflict_do_update(
+        index_elements=['sha256'],
+        set_={'ref_count': AttachmentBlob.__table__.c.ref_count + 1, 'updated_at': now}))
+
+
+@event.listens_for(Attachment, 'after_delete')
+def _attachment_deleted(mapper, connection, target):
+    if not target.sha256:
+        return
+    table = AttachmentBlob.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.sha256 == target.sha256)
+        .values(ref_count=table.c.ref_count - 1, updated_at=datetime.utcnow()))
+
+
+def sweep(grace_seconds=None):
+    """
+    清理无引用的文件，返回删除的文件数
+    - 先按 attachment 和 archived_attachment 表修正所有引用计数（弥补批量删除等绕过 ORM 事件的情况）
+    - 引用为零且超过宽限期的记录连同文件删除
+    - 磁盘上没有记录、超过宽限期的文件（上传事务失败留下的）一并删除
+    """
+    if grace_seconds is None:
+        grace_seconds = current_app.config['BLOB_GC_GRACE']
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    cutoff_ts = time.time() - grace_seconds
+    removed = 0
+    try:
+        # 第一条写语句即取得数据库写锁，直到提交前上传都无法增加引用
+        db.session.execute(
+            update(AttachmentBlob)
+            .values(ref_count=select(func.count(Attachment.id))
+                    .where(Attachment.sha256 == AttachmentBlob.sha256)
+                    .scalar_subquery()
+                    + select(func.count(ArchivedAttachment.id))
+                    .where(ArchivedAttachment.sha256 == AttachmentBlob.sha256)
+                    .scalar_subquery()),
+            execution_options={'synchronize_session': False})
+        orphans = [sha for (sha,) in db.session.query(AttachmentBlob.sha256)
+                   .filter(AttachmentBlob.ref_count <= 0, AttachmentBlob.updated_at < cutoff)]
+        for sha in orphans:
+            db.session.query(AttachmentBlob).filter_by(sha256=sha).delete(synchronize_session=False)
+            path = blob_path(sha)
+            if os.path.exists(path):
+                os.unlink(path)
+                removed += 1
+
+        known = {sha for (sha,) in db.session.query(AttachmentBlob.sha256)}
+        for root, dirs, files in os.walk(blob_folder()):
+            for name in files:
+                path = os.path.join(root, name)
+                if name not in known and os.path.getmtime(path) < cutoff_ts:
+                    os.unlink(path)
+                    removed += 1
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # 异常退出的进程留下的临时文件
+    temp_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], '.tmp')
+    if os.path.isdir(temp_folder):
+        for name in os.listdir(temp_folder):
+            path = os.path.join(temp_folder, name)
+            if os.path.getmtime(path) < cutoff_ts:
+                os.unlink(path)
+    return removed
+
+
+def start_sweeper(app):
+    """每 BLOB_GC_INTERVAL 秒在后台线程执行一次清理，多进程同时执行由数据库写锁串行化"""
+    interval = app.config['BLOB_GC_INTERVAL']
+    if not interval:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            with app.app_context():
+                try:
+                    removed = sweep()
+                    if removed:
+                        app.logger.info(f'附件清理: 删除 {removed} 个无引用文件')
+                except Exception as e:
+                    app.logger.error(f'附件清理失败: {e}', exc_info=True)
+                finally:
+                    db.session.remove()
+
+    thread = threading.Thread(target=run, name='blob-sweeper', daemon=True)
+    thread.start()
+    return thread
+
+
+@click.command('gc-blobs')
+@click.option('--grace', type=int, default=None, help='宽限期（秒），默认取 BLOB_GC_GRACE')
+@with_appcontext
+def gc_blobs_command(grace):
+    """立即清理无引用的附件文件"""
+    removed = sweep(grace)
+    click.echo(f'删除 {removed} 个无引用文件')
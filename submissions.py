@@ -0,0 +1,44 @@
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app, request
+from flask_login import current_user
+from extensions import db
+from models import SubmissionKey
+
+# 表单重复提交识别
+# - 表单渲染时生成随机提交键（隐藏字段 idempotency_key），提交成功时与修改在同一事务内登记
+# - 再次收到同一个键（双击、浏览器重发）时直接按已处理返回，不再执行
+# - 两个相同的提交同时到达时，后提交的一方会因工单版本冲突或主键冲突回滚，回滚后再查一次即可区分
+#   "重复提交" 和 "与他人的修改冲突"
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def submitted_key():
+    return (request.form.get('idempotency_key') or '').strip()[:64]
+
+
+def is_replay(key=None):
+    """当前用户是否已经成功提交过这个键"""
+    key = key if key is not None else submitted_key()
+    if not key:
+        return False
+    record = db.session.get(SubmissionKey, key)
+    return record is not None and record.user_id == current_user.id
+
+
+def remember(key, endpoint, order_id=None):
+    """在当前事务内登记提交键；没有键（旧页面）时不登记"""
+    if key:
+        db.session.add(SubmissionKey(key=key, user_id=current_user.id, endpoint=endpoint, order_id=order_id,
+                                     created_at=datetime.utcnow()))
+
+
+def purge(retention_hours=None):
+    retention_hours = retention_hours or current_app.config['SUBMISSION_KEY_RETENTION_HOURS']
+    cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+    result = db.session.execute(SubmissionKey.__table__.delete().where(SubmissionKey.created_at < cutoff))
+    db.session.commit()
+    return result.rowcount
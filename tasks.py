@@ -0,0 +1,399 @@
+import json
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import click
+from flask import current_app, has_app_context
+from flask.cli import with_appcontext
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.orm import Session, object_session
+from extensions import db
+from models import Job, OrderStage, Attachment, User
+import storage
+import changefeed
+import submissions
+
+# 后台任务队列：把请求里可以延后的工作移出核心事务
+# - 任务行由 OrderStage / Attachment 的 after_insert 事件在同一事务内写入 job 表，
+#   业务提交则任务一定存在，回滚则任务一起消失（不会通知一个不存在的环节）
+# - mapper 事件只在 ORM 逐行 flush 时触发；用 Core insert(...) 批量写入的代码（如 importer）
+#   不会触发，需要自己在同一事务内调用 enqueue / enqueue_many 登记任务
+# - 会话 after_commit 时唤醒本进程的调度线程，任务在线程池里执行，请求只等待核心事务
+# - 调度线程用一条 UPDATE ... RETURNING 认领任务，多个进程（Web 进程、flask worker）同时取也不会重复
+# - 失败按指数退避重试，超过 max_attempts 标记为 failed；认领后超时未完成（进程退出）的任务重新排队
+
+TASKS = {}
+_WAKE = 'tasks_wake'
+
+
+def task(name, max_attempts=5):
+    """注册任务函数，参数从 JSON 载荷按关键字传入"""
+    def decorator(fn):
+        TASKS[name] = (fn, max_attempts)
+        return fn
+    return decorator
+
+
+def enqueue(name, connection=None, delay=0, **payload):
+    """在当前事务内登记任务；在 mapper 事件里调用时传入事件的 connection"""
+    _, max_attempts = TASKS[name]
+    now = datetime.utcnow()
+    (connection or db.session).execute(insert(Job.__table__).values(
+        name=name, payload=json.dumps(payload, ensure_ascii=False), status='pending', attempts=0,
+        max_attempts=max_attempts, run_after=now + timedelta(seconds=delay), created_at=now))
+    if connection is None:
+        db.session.info[_WAKE] = True
+
+
+def enqueue_many(name, payloads):
+    """在当前事务内批量登记同一种任务，payloads 为关键字参数字典的列表"""
+    if not payloads:
+        return
+    _, max_attempts = TASKS[name]
+    now = datetime.utcnow()
+    db.session.execute(insert(Job.__table__), [
+        {'name': name, 'payload': json.dumps(payload, ensure_ascii=False), 'status': 'pending', 'attempts': 0,
+         'max_attempts': max_attempts, 'run_after': now, 'created_at': now}
+        for payload in payloads])
+    db.session.info[_WAKE] = True
+
+
+def _mark_wake(target):
+    session = object_session(target)
+    if session is not None:
+        session.info[_WAKE] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_after_commit(session):
+    if session.info.pop(_WAKE, False):
+        task_queue.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _clear_after_rollback(session):
+    session.info.pop(_WAKE, None)
+
+
+def backoff(attempts):
+    """第 n 次失败后的等待秒数：基数 × 2^(n-1)，有上限，带 ±20% 抖动避免同时重试"""
+    config = current_app.config
+    delay = min(config['TASK_BACKOFF_BASE'] * 2 ** (attempts - 1), config['TASK_BACKOFF_MAX'])
+    return delay * random.uniform(0.8, 1.2)
+
+
+class AppTaskQueue:
+    """一个应用的调度线程和线程池；任务在创建它的应用（及其数据库）上下文中认领和执行"""
+
+    def __init__(self, app):
+        self.app = app
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+        self._thread = None
+        self._last_requeue = self._last_purge = float('-inf')
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, concurrency=None):
+        with self._lock:
+            if self._thread is not None:
+                return
+            concurrency = concurrency or self.app.config['TASK_WORKERS']
+            self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='task')
+            self._slots = threading.BoundedSemaphore(concurrency)
+            self._thread = threading.Thread(target=self._dispatch_loop, name='task-dispatcher', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _dispatch_loop(self):
+        poll = self.app.config['TASK_POLL_INTERVAL']
+        while True:
+            self._wake.wait(timeout=poll)
+            self._wake.clear()
+            with self.app.app_context():
+                try:
+                    self._maintenance()
+                    self.dispatch()
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.warning(f'任务调度失败: {e}')
+                finally:
+                    db.session.remove()
+
+    def _free_slots(self):
+        taken = 0
+        while self._slots.acquire(blocking=False):
+            taken += 1
+        return taken
+
+    def dispatch(self):
+        """按空闲线程数认领到期任务并提交到线程池，返回认领数"""
+        slots = self._free_slots()
+        if not slots:
+            return 0
+        jobs = claim(self.worker_id, slots)
+        for _ in range(slots - len(jobs)):
+            self._slots.release()
+        for job in jobs:
+            self._executor.submit(self._run, job)
+        return len(jobs)
+
+    def _run(self, job):
+        try:
+            with self.app.app_context():
+                try:
+                    execute(job)
+                finally:
+                    db.session.remove()
+        finally:
+            self._slots.release()
+            # 可能还有排队的任务
+            self.wake()
+
+    def _maintenance(self):
+        """每分钟把超时未完成的任务重新排队，每小时删除过期的已完成任务、工单变更流水和提交键"""
+        now = time.monotonic()
+        if now - self._last_requeue >= 60:
+            self._last_requeue = now
+            requeue_stale()
+        if now - self._last_purge >= 3600:
+            self._last_purge = now
+            purge_finished()
+            changefeed.purge()
+            submissions.purge()
+
+
+class TaskQueue:
+    """
+    应用级入口：init_app 为每个应用创建独立的 AppTaskQueue，放在 app.extensions['task_queue']
+    同一进程内有多个应用（测试、命令行里嵌入的应用）时，各自只认领和执行自己数据库里的任务
+    """
+
+    def init_app(self, app):
+        queue = app.extensions['task_queue'] = AppTaskQueue(app)
+        if app.config['TASK_RUN_IN_PROCESS']:
+            # 第一个请求时才启动，flask 命令行（迁移、导入等）不会起线程
+            @app.before_request
+            def _start_task_queue():
+                if not queue.running:
+                    queue.start()
+
+    @property
+    def queue(self):
+        return current_app.extensions['task_queue']
+
+    @property
+    def worker_id(self):
+        return self.queue.worker_id
+
+    @property
+    def running(self):
+        return self.queue.running
+
+    def start(self, concurrency=None):
+        self.queue.start(concurrency)
+
+    def wake(self):
+        # 会话提交可能发生在应用上下文之外（如直接使用引擎），此时没有可唤醒的调度线程
+        if has_app_context() and 'task_queue' in current_app.extensions:
+            self.queue.wake()
+
+
+task_queue = TaskQueue()
+
+
+def claim(worker_id, limit):
+    """认领最多 limit 个到期任务，返回 [(id, name, payload, attempts, max_attempts)]"""
+    now = datetime.utcnow()
+    due = (select(Job.id)
+           .where(Job.status == 'pending', Job.run_after <= now)
+           .order_by(Job.run_after, Job.id)
+           .limit(limit)
+           .scalar_subquery())
+    rows = db.session.execute(
+        update(Job)
+        .where(Job.id.in_(due), Job.status == 'pending')
+        .values(status='running', locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1)
+        .returning(Job.id, Job.name, Job.payload, Job.attempts, Job.max_attempts),
+        execution_options={'synchronize_session': False}
+    ).all()
+    db.session.commit()
+    return rows
+
+
+def execute(job):
+    """执行一个已认领的任务并记录结果"""
+    job_id, name, payload, attempts, max_attempts = job
+    values = {}
+    try:
+        if name not in TASKS:
+            raise LookupError(f'未注册的任务: {name}')
+        TASKS[name][0](**json.loads(payload))
+        db.session.commit()
+        values = {'status': 'done', 'finished_at': datetime.utcnow(), 'last_error': None}
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc()[-4000:]
+        if name in TASKS and attempts < max_attempts:
+            values = {'status': 'pending', 'run_after': datetime.utcnow() + timedelta(seconds=backoff(attempts)),
+                      'last_error': error}
+        else:
+            values = {'status': 'failed', 'finished_at': datetime.utcnow(), 'last_error': error}
+        current_app.logger.warning(f'任务 {name}#{job_id} 第 {attempts} 次执行失败')
+    db.session.execute(update(Job).where(Job.id == job_id).values(locked_by=None, locked_at=None, **values),
+                       execution_options={'synchronize_session': False})
+    db.session.commit()
+    return values['status']
+
+
+def requeue_stale():
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['TASK_LOCK_TIMEOUT'])
+    result = db.session.execute(
+        update(Job)
+        .where(Job.status == 'running', Job.locked_at < cutoff)
+        .values(status='pending', run_after=datetime.utcnow(), locked_by=None, locked_at=None),
+        execution_options={'synchronize_session': False})
+    db.session.commit()
+    return result.rowcount
+
+
+def purge_finished():
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['TASK_RETENTION_DAYS'])
+    result = db.session.execute(
+        Job.__table__.delete().where(Job.status == 'done', Job.finished_at < cutoff))
+    db.session.commit()
+    return result.rowcount
+
+
+# =========== 任务 ===========
+
+PREVIEW_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+PREVIEW_SIZE = (320, 320)
+
+
+def has_preview_type(filename):
+    return os.path.splitext(filename or '')[1].lower() in PREVIEW_EXTENSIONS
+
+
+@event.listens_for(OrderStage, 'after_insert')
+def _stage_inserted(mapper, connection, target):
+    # 新的活跃环节：通知负责人
+    if target.end_time is None:
+        enqueue('notify_assignee', connection=connection, stage_id=target.id)
+        _mark_wake(target)
+
+
+@event.listens_for(Attachment, 'after_insert')
+def _attachment_inserted(mapper, connection, target):
+    if target.sha256 and has_preview_type(target.filename):
+        enqueue('attachment_preview', connection=connection, attachment_id=target.id)
+        _mark_wake(target)
+
+
+@task('attachment_preview', max_attempts=3)
+def attachment_preview(attachment_id):
+    """为图片附件生成缩略图（按内容摘要存放，相同内容只生成一次）；未安装 Pillow 时跳过"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return
+    attachment = db.session.get(Attachment, attachment_id)
+    if attachment is None:
+        return
+    target = storage.preview_path(attachment.sha256)
+    if os.path.exists(target):
+        return
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp = f'{target}.{os.getpid()}.{threading.get_ident()}.part'
+    try:
+        with Image.open(storage.attachment_path(attachment)) as image:
+            image.thumbnail(PREVIEW_SIZE)
+            image.convert('RGB').save(temp, 'JPEG', quality=80)
+        os.replace(temp, target)
+    finally:
+        if os.path.exists(temp):
+            os.unlink(temp)
+
+
+@task('notify_assignee')
+def notify_assignee(stage_id):
+    """
+    通知新环节的负责人；配置了 NOTIFY_WEBHOOK_URL 时以 JSON POST 到该地址（如企业微信、钉钉机器人），
+    否则只写日志。环节在执行前已结束（被快速转走）则不再通知
+    """
+    stage = db.session.get(OrderStage, stage_id)
+    if stage is None or stage.end_time is not None:
+        return
+    assignee = db.session.get(User, stage.assignee_id)
+    order = stage.work_order
+    text = f'工单 {order.order_number} 已流转到「{stage.stage_name}」，负责人：{assignee.realname if assignee else "-"}'
+    url = current_app.config['NOTIFY_WEBHOOK_URL']
+    if not url:
+        current_app.logger.info(f'通知: {text}')
+        return
+    body = json.dumps({'msgtype': 'text', 'text': {'content': text}}, ensure_ascii=False).encode('utf-8')
+    request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        if response.status >= 300:
+            raise RuntimeError(f'通知接口返回 {response.status}')
+
+
+# =========== 命令行 ===========
+
+@click.command('worker')
+@click.option('--concurrency', type=int, default=None, help='并发执行的任务数，默认取 TASK_WORKERS')
+@click.option('--once', is_flag=True, help='执行完当前到期的任务后退出')
+@with_appcontext
+def worker_command(concurrency, once):
+    """运行后台任务执行进程"""
+    if once:
+        done = 0
+        requeue_stale()
+        while True:
+            jobs = claim(task_queue.worker_id, concurrency or 1)
+            if not jobs:
+                break
+            for job in jobs:
+                execute(job)
+                done += 1
+        click.echo(f'执行 {done} 个任务')
+        return
+    task_queue.start(concurrency)
+    click.echo(f'任务执行进程 {task_queue.worker_id} 已启动，Ctrl+C 退出')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command('jobs')
+@click.option('--retry-failed', is_flag=True, help='把失败的任务重新排队')
+@with_appcontext
+def jobs_command(retry_failed):
+    """查看后台任务状态"""
+    if retry_failed:
+        result = db.session.execute(
+            update(Job).where(Job.status == 'failed')
+            .values(status='pending', attempts=0, run_after=datetime.utcnow(), finished_at=None),
+            execution_options={'synchronize_session': False})
+        db.session.commit()
+        click.echo(f'重新排队 {result.rowcount} 个失败任务')
+    for status, count in db.session.query(Job.status, func.count()).group_by(Job.status).order_by(Job.status):
+        click.echo(f'  {status:<8} {count}')
+    for job in Job.query.filter_by(status='failed').order_by(Job.id.desc()).limit(5):
+        last_line = (job.last_error or '').strip().splitlines()[-1:] or ['']
+        click.echo(f'  failed #{job.id} {job.name} {job.payload}: {last_line[0]}')
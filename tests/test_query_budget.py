@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+import pytest
+from app import create_app
+from extensions import db
+from models import Department, User, WorkOrder, OrderStage, Attachment
+from querybudget import QUERY_BUDGETS, QueryCounter
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def order(app):
+    """一张工单：已结束的计划环节（带附件）和分配给 worker 的活跃环节"""
+    department = Department(name='生产部')
+    db.session.add(department)
+    db.session.flush()
+    admin = User(username='admin', realname='管理员', role='admin', department_id=department.id,
+                 can_create_order=True)
+    worker = User(username='worker', realname='员工', department_id=department.id)
+    admin.password = worker.password = 'x'
+    db.session.add_all([admin, worker])
+    db.session.flush()
+
+    started = datetime.utcnow() - timedelta(days=2)
+    order = WorkOrder(order_number='QB-1', order_date=started, quantity=3,
+                      delivery_date=started + timedelta(days=30), salesperson_id=admin.id,
+                      current_stage='技术部', current_assignee_id=worker.id, total_duration=86400)
+    planning = OrderStage(stage_name='计划', start_time=started, end_time=started + timedelta(days=1),
+                          duration=86400, comments='ok', assignee_id=admin.id)
+    active = OrderStage(stage_name='技术部', start_time=started + timedelta(days=1), assignee_id=worker.id)
+    order.stages.extend([planning, active])
+    db.session.add(order)
+    db.session.flush()
+    db.session.add(Attachment(filename='plan.pdf', size=9, stage_id=planning.id))
+    order.active_stage = active
+    db.session.commit()
+    return order.id, admin.id, worker.id
+
+
+def client_as(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+@pytest.mark.parametrize('endpoint, url, as_assignee', [
+    ('view_orders', '/orders', False),
+    ('view_order', '/order/{id}', False),
+    ('assign_order', '/assign_order/{id}', False),
+    ('process_order', '/process_order/{id}', True),
+])
+def test_query_budget(app, order, endpoint, url, as_assignee):
+    order_id, admin_id, worker_id = order
+    client = client_as(app, worker_id if as_assignee else admin_id)
+    url = url.format(id=order_id)
+    # 预算针对稳定状态：先访问一次，填充用户、部门目录和统计计数缓存
+    with app.app_context():
+        client.get(url)
+    # 新的应用上下文，避免复用 fixture 的会话和请求级缓存
+    with app.app_context(), QueryCounter() as counter:
+        response = client.get(url)
+    assert response.status_code == 200
+    assert counter.count <= QUERY_BUDGETS[endpoint], '\n'.join(counter.statements)
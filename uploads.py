@@ -0,0 +1,118 @@
+import hashlib
+import os
+import re
+import tempfile
+from collections import namedtuple
+from datetime import datetime
+from flask import current_app, Request
+import storage
+
+# 上传流水线：
+# 1. 请求体由 Werkzeug 按块解析，每块直接写入 UPLOAD_FOLDER/.tmp 下的临时文件，同时计算 SHA-256
+# 2. 业务代码在开启数据库写事务之前调用 save_upload，把文件放入内容寻址存储（见 storage.py）
+# 3. 之后才写 Attachment 记录并提交；提交成功调用 release_upload，失败调用 discard_upload
+# 整个过程内存占用与文件大小无关，磁盘 I/O 期间也不持有数据库锁
+
+StoredFile = namedtuple('StoredFile', 'filename temp_path size sha256')
+
+_UNSAFE_CHARS = re.compile(r'[\x00-\x1f/\\:*?"<>|]+')
+
+
+def temp_folder():
+    folder = os.path.join(current_app.config['UPLOAD_FOLDER'], '.tmp')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+class HashingTempFile:
+    """边写边计算 SHA-256 的临时文件，未被 save_upload 取走时在关闭时删除"""
+
+    def __init__(self, folder):
+        fd, self.path = tempfile.mkstemp(dir=folder, suffix='.part')
+        self._file = os.fdopen(fd, 'w+b')
+        self._hash = hashlib.sha256()
+        self.size = 0
+        self.claimed = False
+
+    def write(self, data):
+        self._hash.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self.claimed and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def __getattr__(self, name):
+        if name == '_file':
+            raise AttributeError(name)
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class StreamingRequest(Request):
+    """上传文件不经过内存缓冲，直接按块落到与 UPLOAD_FOLDER 同一文件系统的临时文件"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingTempFile(temp_folder())
+
+
+def safe_filename(filename):
+    """去掉目录部分和文件系统不允许的字符，保留中文文件名"""
+    name = os.path.basename((filename or '').replace('\\', '/'))
+    name = _UNSAFE_CHARS.sub('_', name).strip(' .')
+    return name or 'file'
+
+
+def save_upload(file, prefix):
+    """
+    把上传文件放入内容寻址存储，返回 StoredFile
+    - 附件名为 {prefix}_{时间戳}_{原文件名}，用于下载链接和显示
+    - 相同内容已存在时不再写入，只保留临时文件到提交之后
+    - 若上传流不是 HashingTempFile（例如测试中直接构造的 FileStorage），按块复制并计算摘要
+    """
+    filename = f"{prefix}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{safe_filename(file.filename)}"
+    stream = file.stream
+
+    if isinstance(stream, HashingTempFile):
+        temp = stream
+    else:
+        chunk_size = current_app.config['UPLOAD_CHUNK_SIZE']
+        temp = HashingTempFile(temp_folder())
+        try:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                temp.write(chunk)
+        except Exception:
+            temp.close()
+            raise
+
+    temp.flush()
+    os.fsync(temp.fileno())
+    # 临时文件此后由 release_upload / discard_upload 负责清理
+    temp.claimed = True
+    temp.close()
+    storage.place(temp.path, temp.sha256)
+    return StoredFile(filename, temp.path, temp.size, temp.sha256)
+
+
+def release_upload(stored):
+    """事务提交后调用"""
+    if stored is not None:
+        storage.finalize(stored.temp_path, stored.sha256)
+
+
+def discard_upload(stored):
+    """事务失败时删除临时文件；已放入存储但无人引用的文件由后台清理"""
+    if stored is not None and os.path.exists(stored.temp_path):
+        os.unlink(stored.temp_path)
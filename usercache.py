@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy.orm import joinedload
+from models import CacheVersion, User
+
+# 版本号名称：后台修改 / 删除用户时递增，其他进程据此清空本地缓存
+USERS = 'users'
+
+
+class SessionUser(UserMixin):
+    """
+    登录用户的只读快照，可在线程和请求之间安全共享
+    只包含请求处理和模板中用到的字段，部门信息随之一并加载
+    """
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.realname = user.realname
+        self.role = user.role
+        self.can_create_order = user.can_create_order
+        self.department_id = user.department_id
+        self.department = (SimpleNamespace(id=user.department.id, name=user.department.name)
+                           if user.department else None)
+
+    def is_admin(self):
+        return self.role == 'admin'
+
+
+class UserCache:
+    """
+    按用户 id 缓存登录身份的 LRU + TTL 缓存，每个应用一份（见 AppUserCache）
+    - 本进程内的修改立即失效对应条目
+    - 其他进程的修改通过 cache_version 发现，最多每 USER_CACHE_VERSION_INTERVAL 秒核对一次
+    """
+
+    def __init__(self, maxsize=1024, ttl=300, version_interval=5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version_interval = version_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id):
+        self._check_version()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                user, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return user
+                del self._entries[user_id]
+            self.misses += 1
+
+        user = User.query.options(joinedload(User.department)).get(user_id)
+        if user is None:
+            return None
+        snapshot = SessionUser(user)
+        with self._lock:
+            self._entries[user_id] = (snapshot, now + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return snapshot
+
+    def invalidate(self, user_id=None):
+        """在当前事务内递增版本号并移除本进程中的条目，user_id 为空时清空全部"""
+        CacheVersion.bump(USERS)
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _check_version(self):
+        now = time.monotonic()
+        if self._version is not None and now - self._version_checked_at < self.version_interval:
+            return
+        version = CacheVersion.current(USERS)
+        self._version_checked_at = now
+        if version != self._version:
+            self.clear()
+            self._version = version
+
+    def metrics(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            'size': size,
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+
+class AppUserCache:
+    """
+    应用级入口：init_app 为每个应用创建独立的 UserCache，放在 app.extensions['user_cache']
+    条目按用户 id 存放、按各自数据库里的版本号失效，同一进程内的多个应用（如测试）共用一份会互相串号
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['user_cache'] = UserCache(
+            maxsize=app.config.get('USER_CACHE_SIZE', 1024),
+            ttl=app.config.get('USER_CACHE_TTL', 300),
+            version_interval=app.config.get('USER_CACHE_VERSION_INTERVAL', 5))
+
+    @property
+    def cache(self):
+        return current_app.extensions['user_cache']
+
+    def get(self, user_id):
+        return self.cache.get(user_id)
+
+    def invalidate(self, user_id=None):
+        self.cache.invalidate(user_id)
+
+    def clear(self):
+        self.cache.clear()
+
+    def metrics(self):
+        return self.cache.metrics()
+
+
+user_cache = AppUserCache()